@@ -1,21 +1,44 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+import pymongo
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 import os
+import re
+import socket
 import logging
 import json
 import asyncio
+import base64
+import contextlib
+import contextvars
+import functools
+import hashlib
+import heapq
+import importlib.util
+import itertools
+import math
+import random
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError, create_model, field_validator
+from typing import List, Optional, Dict, Any, Literal
 import uuid
 from datetime import datetime, timezone, timedelta
 import jwt
 import bcrypt
 from google import genai
-from groq import AsyncGroq
+from groq import AsyncGroq, BadRequestError
+import anyio
+import httpx
+import numpy as np
 import stripe
 import certifi
 import ssl
@@ -26,7 +49,8 @@ load_dotenv(ROOT_DIR / '.env')
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
 _use_tls = 'mongodb+srv' in mongo_url or 'mongodb.net' in mongo_url
-_mongo_kwargs = dict(serverSelectionTimeoutMS=10000)
+# tz_aware: timestamps are stored as BSON dates and read back as aware UTC datetimes
+_mongo_kwargs = dict(serverSelectionTimeoutMS=10000, tz_aware=True)
 if _use_tls:
     _mongo_kwargs.update(tls=True, tlsAllowInvalidCertificates=True)
 client = AsyncIOMotorClient(mongo_url, **_mongo_kwargs)
@@ -35,18 +59,104 @@ db = client[os.environ['DB_NAME']]
 # Security
 security = HTTPBearer()
 JWT_SECRET = os.environ.get('JWT_SECRET', 'default-secret-key')
+# Accounts allowed to read the operational endpoints (comma-separated emails)
+OPS_ADMIN_EMAILS = frozenset(
+    email.strip().lower() for email in os.environ.get('OPS_ADMIN_EMAILS', '').split(',') if email.strip()
+)
+
+# Authenticated-user cache; the TTL bounds how stale a cached user may be
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '30'))
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', '10000'))
+
+# Password hashing runs on its own pool so bcrypt never blocks the event loop
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
 
 # AI API keys
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 GROQ_API_KEY = os.environ.get('GROQ_API_KEY')
+GEMINI_MODEL = 'gemini-2.0-flash'
+GROQ_MODEL = "llama-3.3-70b-versatile"
 
 # Stripe
 stripe.api_key = os.environ.get('STRIPE_API_KEY')
 STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
 FRONTEND_URL = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
 
-# Configure Gemini
-gemini_client = genai.Client(api_key=GEMINI_API_KEY) if GEMINI_API_KEY else None
+# Hedged generation: fire the fallback provider if the primary is slow. A fixed
+# delay wins when set; otherwise the primary's recent p90 latency is used.
+GENERATION_HEDGING = os.environ.get('GENERATION_HEDGING', 'true').lower() in ('1', 'true', 'yes')
+GENERATION_HEDGE_DELAY_SECONDS = os.environ.get('GENERATION_HEDGE_DELAY_SECONDS')
+GENERATION_HEDGE_DEFAULT_SECONDS = float(os.environ.get('GENERATION_HEDGE_DEFAULT_SECONDS', '8'))
+
+# Combined generation: one LLM call for every profile in a batch (base info sent once).
+# Requests can override the default with combined_generation.
+BATCH_COMBINED_GENERATION = os.environ.get('BATCH_COMBINED_GENERATION', 'false').lower() in ('1', 'true', 'yes')
+GENERATION_COMBINED_MAX_TOKENS = int(os.environ.get('GENERATION_COMBINED_MAX_TOKENS', '8000'))
+# Ask providers for schema-constrained JSON (Groq JSON mode, Gemini response schema)
+STRUCTURED_OUTPUT = os.environ.get('STRUCTURED_OUTPUT', 'true').lower() in ('1', 'true', 'yes')
+
+# Generated profiles are memoized in Mongo (TTL index), keyed on the prompt inputs; 0 disables
+GENERATION_CACHE_TTL_SECONDS = int(os.environ.get('GENERATION_CACHE_TTL_SECONDS', '604800'))
+GENERATION_CACHE_MAX_ENTRIES = int(os.environ.get('GENERATION_CACHE_MAX_ENTRIES', '256'))
+
+# Background batch jobs
+BATCH_JOB_WORKERS = int(os.environ.get('BATCH_JOB_WORKERS', '2'))
+BATCH_JOB_MAX_GENERATIONS = int(os.environ.get('BATCH_JOB_MAX_GENERATIONS', '5'))
+BATCH_JOB_LEASE_SECONDS = int(os.environ.get('BATCH_JOB_LEASE_SECONDS', '120'))
+BATCH_JOB_MAX_ATTEMPTS = int(os.environ.get('BATCH_JOB_MAX_ATTEMPTS', '3'))
+BATCH_JOB_POLL_SECONDS = float(os.environ.get('BATCH_JOB_POLL_SECONDS', '2'))
+
+# Fail startup when a route query would need a collection scan
+VERIFY_QUERY_PLANS = os.environ.get('VERIFY_QUERY_PLANS', 'false').lower() in ('1', 'true', 'yes')
+
+# ATS result cache
+ATS_CACHE_TTL_SECONDS = int(os.environ.get('ATS_CACHE_TTL_SECONDS', '86400'))
+ATS_CACHE_MAX_ENTRIES = int(os.environ.get('ATS_CACHE_MAX_ENTRIES', '2048'))
+ATS_CACHE_MONGO = os.environ.get('ATS_CACHE_MONGO', 'false').lower() in ('1', 'true', 'yes')
+
+# Resume/job matching considers at most this many of a user's resumes
+ATS_MATCH_MAX_RESUMES = int(os.environ.get('ATS_MATCH_MAX_RESUMES', '200'))
+
+# Prompt input budgets, in estimated tokens (~4 characters each)
+ATS_RESUME_TOKEN_BUDGET = int(os.environ.get('ATS_RESUME_TOKEN_BUDGET', '2500'))
+ATS_JOB_DESCRIPTION_TOKEN_BUDGET = int(os.environ.get('ATS_JOB_DESCRIPTION_TOKEN_BUDGET', '1500'))
+GENERATION_PROFILE_TOKEN_BUDGET = int(os.environ.get('GENERATION_PROFILE_TOKEN_BUDGET', '2500'))
+
+# AI provider HTTP pool
+PROVIDER_MAX_CONNECTIONS = int(os.environ.get('PROVIDER_MAX_CONNECTIONS', '20'))
+PROVIDER_MAX_KEEPALIVE = int(os.environ.get('PROVIDER_MAX_KEEPALIVE', '10'))
+PROVIDER_KEEPALIVE_EXPIRY = float(os.environ.get('PROVIDER_KEEPALIVE_EXPIRY', '60'))
+PROVIDER_HTTP2 = os.environ.get('PROVIDER_HTTP2', 'false').lower() in ('1', 'true', 'yes')
+GROQ_MAX_CONCURRENCY = int(os.environ.get('GROQ_MAX_CONCURRENCY', '8'))
+GEMINI_MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', '8'))
+# "async" uses the SDK's native async surface; "thread" keeps the old
+# to_thread path around for A/B comparisons.
+GEMINI_TRANSPORT = os.environ.get('GEMINI_TRANSPORT', 'async').lower()
+
+# Provider router: circuit breaker and latency tracking per provider
+ROUTER_FAILURE_THRESHOLD = int(os.environ.get('ROUTER_FAILURE_THRESHOLD', '3'))
+ROUTER_OPEN_SECONDS = float(os.environ.get('ROUTER_OPEN_SECONDS', '30'))
+ROUTER_HALF_OPEN_PROBES = int(os.environ.get('ROUTER_HALF_OPEN_PROBES', '1'))
+ROUTER_EWMA_ALPHA = float(os.environ.get('ROUTER_EWMA_ALPHA', '0.2'))
+
+# Per-route deadlines (seconds; 0 disables). Provider calls stop early enough
+# to leave PROVIDER_DEADLINE_RESERVE_SECONDS for saving what did finish.
+ATS_DEADLINE_SECONDS = float(os.environ.get('ATS_DEADLINE_SECONDS', '45'))
+BATCH_DEADLINE_SECONDS = float(os.environ.get('BATCH_DEADLINE_SECONDS', '150'))
+PROVIDER_DEADLINE_RESERVE_SECONDS = float(os.environ.get('PROVIDER_DEADLINE_RESERVE_SECONDS', '1'))
+
+# Provider rate limits per minute (0 disables a budget). Defaults are the free
+# tiers of GROQ_MODEL and GEMINI_MODEL; raise them for paid plans.
+GROQ_RPM = int(os.environ.get('GROQ_RPM', '30'))
+GROQ_TPM = int(os.environ.get('GROQ_TPM', '12000'))
+GEMINI_RPM = int(os.environ.get('GEMINI_RPM', '15'))
+GEMINI_TPM = int(os.environ.get('GEMINI_TPM', '1000000'))
+# Retries of a 429 response, waiting out Retry-After (or an exponential
+# backoff from RATE_LIMIT_BACKOFF_SECONDS) plus jitter
+RATE_LIMIT_MAX_RETRIES = int(os.environ.get('RATE_LIMIT_MAX_RETRIES', '3'))
+RATE_LIMIT_BACKOFF_SECONDS = float(os.environ.get('RATE_LIMIT_BACKOFF_SECONDS', '2'))
+RATE_LIMIT_BACKOFF_MAX_SECONDS = float(os.environ.get('RATE_LIMIT_BACKOFF_MAX_SECONDS', '60'))
 
 # Create the main app
 app = FastAPI()
@@ -84,6 +194,7 @@ class TokenResponse(BaseModel):
 class ResumeSection(BaseModel):
     type: str
     content: Any
+    id: Optional[str] = None            # stable id, assigned when the section is first saved
 
 class Resume(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -94,9 +205,22 @@ class Resume(BaseModel):
     sections: List[ResumeSection] = []
     job_profile: Optional[str] = None
     batch_generated: bool = False
+    version: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class ResumeSummary(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    title: str
+    template: str = "modern"
+    job_profile: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+RESUME_SUMMARY_PROJECTION = {"_id": 0, "id": 1, "title": 1, "template": 1, "job_profile": 1,
+                             "created_at": 1, "updated_at": 1}
+
 class ResumeCreate(BaseModel):
     title: str
     template: str = "modern"
@@ -107,6 +231,19 @@ class ResumeUpdate(BaseModel):
     template: Optional[str] = None
     sections: Optional[List[ResumeSection]] = None
 
+class SectionOperation(BaseModel):
+    op: Literal["set", "insert", "remove", "reorder"]
+    index: Optional[int] = Field(default=None, ge=0)     # target position in sections
+    section_id: Optional[str] = None                     # or the target section's stable id
+    section: Optional[ResumeSection] = None              # new content for set / insert
+    to_index: Optional[int] = Field(default=None, ge=0)  # destination for reorder
+
+class ResumePatch(BaseModel):
+    expected_version: Optional[int] = None
+    title: Optional[str] = None
+    template: Optional[str] = None
+    operations: List[SectionOperation] = []
+
 class ExperienceEntry(BaseModel):
     position: str
     company: str
@@ -119,6 +256,14 @@ class EducationEntry(BaseModel):
     year: str
     details: Optional[str] = ""
 
+class GeneratedResume(BaseModel):
+    """One profile's generation output; also the response schema sent to providers."""
+    model_config = ConfigDict(extra="ignore")
+    summary: str
+    skills: str
+    experience: List[ExperienceEntry]
+    education: List[EducationEntry]
+
 class BatchGenerateRequest(BaseModel):
     personal_info: Dict[str, str]       # name, email, phone, location
     summary_base: str
@@ -127,11 +272,49 @@ class BatchGenerateRequest(BaseModel):
     skills_base: str
     job_profiles: List[str]             # preset IDs, max 5
     template: str = "modern"
+    combined_generation: Optional[bool] = None  # one LLM call for all profiles; None = server default
+    force_regenerate: bool = False      # skip the generation cache
 
 class BatchGenerateResponse(BaseModel):
     resumes: List[Dict[str, Any]]
     generation_stats: Dict[str, Any]
 
+class BatchJob(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    request: Dict[str, Any]
+    status: str = "queued"              # queued, running, completed, failed
+    profiles: Dict[str, Dict[str, Any]] = {}
+    attempts: int = 0
+    lease_owner: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    generation_stats: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class ATSProviderResult(BaseModel):
+    """One provider's ATS answer; also the response schema sent to providers."""
+    model_config = ConfigDict(extra="ignore")
+    score: int
+    feedback: str = ""
+    strengths: List[str] = []
+    improvements: List[str] = []
+
+    @field_validator("score", mode="before")
+    @classmethod
+    def coerce_score(cls, value):
+        # Providers often answer 72.5 or "72" (even "72%") despite the schema
+        if isinstance(value, str):
+            try:
+                value = float(value.strip().rstrip("%"))
+            except ValueError:
+                return value
+        if isinstance(value, float) and math.isfinite(value):
+            return round(value)
+        return value
+
 class ATSAnalysis(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -150,12 +333,55 @@ class ATSAnalysis(BaseModel):
     groq_feedback: Optional[str] = None
     groq_strengths: List[str] = []
     groq_improvements: List[str] = []
+    local_score: Optional[int] = None
+    matched_keywords: List[str] = []
+    missing_keywords: List[str] = []
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class ATSAnalysisSummary(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    resume_id: str
+    score: int
+    created_at: datetime
+
+ANALYSIS_SUMMARY_PROJECTION = {"_id": 0, "id": 1, "resume_id": 1, "score": 1, "created_at": 1}
+
 class ATSAnalysisRequest(BaseModel):
     resume_id: str
     job_description: str
 
+class LocalATSScore(BaseModel):
+    score: int
+    keyword_coverage: float
+    similarity: float
+    section_completeness: float
+    matched_keywords: List[str] = []
+    missing_keywords: List[str] = []
+    missing_sections: List[str] = []
+
+class ATSMatchRequest(BaseModel):
+    job_descriptions: List[str] = Field(min_length=1, max_length=10)
+    resume_ids: Optional[List[str]] = None  # default: all of the user's resumes
+    top_k: int = Field(3, ge=1, le=20)
+    escalate: int = Field(0, ge=0, le=3)  # top candidates per posting sent to the LLM analyzers
+
+class ATSMatchCandidate(BaseModel):
+    resume_id: str
+    title: str
+    score: int
+    keyword_coverage: float
+    similarity: float
+    matched_keywords: List[str] = []
+    missing_keywords: List[str] = []
+
+class ATSMatchResponse(BaseModel):
+    resume_ids: List[str]
+    scores: List[List[int]]  # one row per job description, one column per resume
+    rankings: List[List[ATSMatchCandidate]]
+    analyses: List[ATSAnalysis] = []
+    escalation_errors: List[str] = []
+
 class PaymentTransaction(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -236,17 +462,810 @@ JOB_PROFILE_PRESETS = {
     }
 }
 
-RESUME_GENERATION_SYSTEM_PROMPT = """You are an expert resume writer and ATS optimization specialist. Given a user's base information and a target job profile, generate an optimized resume tailored for that role.
+# ========== REQUEST DEADLINES ==========
 
-Return your response as JSON only with these keys:
-- summary: A 2-3 sentence professional summary optimized for the target role
+# Absolute time.monotonic() deadline for the current request, if any. Tasks
+# copy it from the context that creates them.
+request_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """The request's deadline ran out before (or during) a call."""
+
+
+def deadline_after(seconds: float) -> Optional[float]:
+    return time.monotonic() + seconds if seconds > 0 else None
+
+
+def remaining_time(reserve: float = 0.0) -> Optional[float]:
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic() - reserve)
+
+
+async def with_deadline(deadline: Optional[float], awaitable):
+    """Await ``awaitable`` under ``deadline`` (None: no limit).
+
+    Provider calls read the deadline back through remaining_time(); Mongo
+    operations get it through pymongo's client-side operation timeout.
+    """
+    if deadline is None:
+        return await awaitable
+    current = request_deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    token = request_deadline.set(deadline)
+    try:
+        # timeout(0) would mean "no limit" to pymongo
+        with pymongo.timeout(max(deadline - time.monotonic(), 0.001)):
+            return await awaitable
+    finally:
+        request_deadline.reset(token)
+
+
+async def without_deadline(awaitable):
+    """Await ``awaitable`` with no deadline (and no Mongo operation timeout).
+
+    For writes that the caller's bookkeeping depends on: a timeout could
+    fire after the server already applied the write. For the same reason a
+    cancelled caller waits for the write to finish before it is cancelled.
+    """
+    task = asyncio.create_task(awaitable, context=contextvars.Context())
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        with contextlib.suppress(Exception):
+            await task
+        raise
+
+
+async def call_within_deadline(awaitable):
+    """Bound a provider call by the remaining budget, minus the save reserve."""
+    budget = remaining_time(PROVIDER_DEADLINE_RESERVE_SECONDS)
+    if budget is None:
+        return await awaitable
+    if budget <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded("Request deadline exceeded before the provider call")
+    try:
+        return await asyncio.wait_for(awaitable, timeout=budget)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"Provider call cut off by the request deadline after {budget:.1f}s") from None
+
+# ========== AI PROVIDER CLIENTS ==========
+
+class ProviderClients:
+    """Long-lived Groq and Gemini clients built once per process.
+
+    Both SDKs are handed httpx clients configured from the same pool limits,
+    so connections (and TLS sessions) are kept alive and reused across ATS
+    checks and batch generations instead of being rebuilt on every call.
+    """
+
+    PROVIDERS = ("groq", "gemini")
+
+    def __init__(self):
+        self.groq: Optional[AsyncGroq] = None
+        self.gemini: Optional[genai.Client] = None
+        self._transport: Optional[httpx.AsyncHTTPTransport] = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._http_sync: Optional[httpx.Client] = None
+        self.http2 = False
+        self.concurrency = {"groq": GROQ_MAX_CONCURRENCY, "gemini": GEMINI_MAX_CONCURRENCY}
+        self._slots = {p: asyncio.Semaphore(n) for p, n in self.concurrency.items()}
+        self.waiting = {p: 0 for p in self.PROVIDERS}
+        self.in_flight = {p: 0 for p in self.PROVIDERS}
+        self.peak_in_flight = {p: 0 for p in self.PROVIDERS}
+        self.requests = {p: 0 for p in self.PROVIDERS}
+
+    def start(self):
+        limits = httpx.Limits(
+            max_connections=PROVIDER_MAX_CONNECTIONS,
+            max_keepalive_connections=PROVIDER_MAX_KEEPALIVE,
+            keepalive_expiry=PROVIDER_KEEPALIVE_EXPIRY,
+        )
+        self.http2 = PROVIDER_HTTP2
+        if self.http2 and importlib.util.find_spec("h2") is None:
+            logging.warning("PROVIDER_HTTP2 is set but the 'h2' package is not installed; using HTTP/1.1")
+            self.http2 = False
+
+        self._transport = httpx.AsyncHTTPTransport(limits=limits, http2=self.http2)
+        self._http = httpx.AsyncClient(transport=self._transport, timeout=httpx.Timeout(60.0, connect=10.0))
+        self._http_sync = httpx.Client(limits=limits, http2=self.http2, timeout=httpx.Timeout(60.0, connect=10.0))
+
+        if GROQ_API_KEY:
+            # 429s are retried by the rate limiter, which also holds back other calls meanwhile
+            self.groq = AsyncGroq(api_key=GROQ_API_KEY, http_client=self._http, max_retries=0)
+        if GEMINI_API_KEY:
+            self.gemini = genai.Client(
+                api_key=GEMINI_API_KEY,
+                http_options=genai.types.HttpOptions(
+                    httpx_client=self._http_sync,
+                    httpx_async_client=self._http,
+                )
+            )
+
+    async def close(self):
+        if self.gemini is not None:
+            self.gemini.close()
+            await self.gemini.aio.aclose()
+        if self.groq is not None:
+            await self.groq.close()
+        if self._http is not None:
+            await self._http.aclose()
+        if self._http_sync is not None:
+            self._http_sync.close()
+        self.groq = self.gemini = None
+        self._transport = self._http = self._http_sync = None
+
+    @contextlib.asynccontextmanager
+    async def track(self, provider: str):
+        """Hold one of the provider's concurrency slots for the duration of a call.
+
+        Waiting for a slot counts against the request deadline: calls without
+        one (background jobs) may be holding every slot.
+        """
+        budget = remaining_time(PROVIDER_DEADLINE_RESERVE_SECONDS)
+        self.waiting[provider] += 1
+        try:
+            await asyncio.wait_for(self._slots[provider].acquire(), timeout=budget)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"No {provider} slot freed up before the request deadline") from None
+        finally:
+            self.waiting[provider] -= 1
+        self.requests[provider] += 1
+        self.in_flight[provider] += 1
+        self.peak_in_flight[provider] = max(self.peak_in_flight[provider], self.in_flight[provider])
+        try:
+            yield
+        finally:
+            self.in_flight[provider] -= 1
+            self._slots[provider].release()
+
+    def pool_stats(self) -> dict:
+        pool_info = {"connections": 0, "idle": 0, "active": 0, "queued_requests": 0}
+        # httpx does not expose pool state publicly; read httpcore's view of it
+        pool = getattr(self._transport, "_pool", None)
+        if pool is not None:
+            connections = list(pool.connections)
+            idle = sum(1 for c in connections if c.is_idle())
+            pool_info.update(
+                connections=len(connections),
+                idle=idle,
+                active=len(connections) - idle,
+                queued_requests=sum(1 for r in getattr(pool, "_requests", []) if r.is_queued()),
+            )
+        return {
+            "limits": {
+                "max_connections": PROVIDER_MAX_CONNECTIONS,
+                "max_keepalive_connections": PROVIDER_MAX_KEEPALIVE,
+                "keepalive_expiry": PROVIDER_KEEPALIVE_EXPIRY,
+                "http2": self.http2,
+            },
+            "async_pool": pool_info,
+            "gemini_transport": GEMINI_TRANSPORT,
+            "max_concurrency": dict(self.concurrency),
+            "waiting": dict(self.waiting),
+            "in_flight": dict(self.in_flight),
+            "peak_in_flight": dict(self.peak_in_flight),
+            "requests": dict(self.requests),
+            "clients": {"groq": self.groq is not None, "gemini": self.gemini is not None},
+        }
+
+
+providers = ProviderClients()
+
+
+class ProviderUnavailable(RuntimeError):
+    """Raised without calling out when a provider's circuit is open."""
+
+
+# When set to a list, every successful provider request made in this context
+# appends its duration: the request alone, without rate-limit or slot waits.
+provider_call_seconds: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar(
+    "provider_call_seconds", default=None)
+
+
+class ProviderRouter:
+    """Health-based provider ordering with a circuit breaker per provider.
+
+    Every request records its outcome: an EWMA of latency and of success,
+    plus a run of consecutive failures. After ROUTER_FAILURE_THRESHOLD failures in a
+    row the circuit opens and calls fail immediately; once ROUTER_OPEN_SECONDS
+    pass it goes half-open and lets ROUTER_HALF_OPEN_PROBES trial calls
+    through, closing again on the first success.
+    """
+
+    def __init__(self, names, failure_threshold: int, open_seconds: float,
+                 half_open_probes: int, alpha: float):
+        self.names = tuple(names)
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.alpha = alpha
+        self.health = {name: {
+            "state": "closed", "consecutive_failures": 0, "opened_at": None, "probes_in_flight": 0,
+            "latency_ewma": None, "success_ewma": 1.0, "successes": 0, "failures": 0,
+            "rejected": 0, "opened": 0,
+        } for name in self.names}
+
+    def _refresh(self, name: str):
+        h = self.health[name]
+        if h["state"] == "open" and time.monotonic() - h["opened_at"] >= self.open_seconds:
+            h["state"] = "half_open"
+
+    def available(self, name: str) -> bool:
+        self._refresh(name)
+        h = self.health[name]
+        if h["state"] == "open":
+            return False
+        return h["state"] == "closed" or h["probes_in_flight"] < self.half_open_probes
+
+    def rank(self, names=None) -> List[str]:
+        """Providers best first: available ones by latency / success rate, then the rest."""
+        names = list(names or self.names)
+
+        def cost(name: str) -> tuple:
+            h = self.health[name]
+            latency = h["latency_ewma"] if h["latency_ewma"] is not None else 0.0
+            return (not self.available(name), latency / max(h["success_ewma"], 0.05), names.index(name))
+
+        return sorted(names, key=cost)
+
+    @contextlib.asynccontextmanager
+    async def guard(self, name: str):
+        """Admit one provider call, refusing it if the circuit is open.
+
+        Outcomes are recorded by observe(), around the request itself.
+        """
+        if not self.available(name):
+            self.health[name]["rejected"] += 1
+            raise ProviderUnavailable(f"{name} circuit is open")
+        h = self.health[name]
+        probe = h["state"] == "half_open"
+        if probe:
+            h["probes_in_flight"] += 1
+        try:
+            yield
+        finally:
+            if probe:
+                h["probes_in_flight"] -= 1
+
+    @contextlib.asynccontextmanager
+    async def observe(self, name: str):
+        """Record the outcome and latency of one request to the provider.
+
+        Only the request is timed: waiting on our own rate limits or
+        concurrency cap is pacing, not provider slowness. A 429 is our budget
+        running out rather than an outage, so it is not a failure either.
+        """
+        started = time.monotonic()
+        try:
+            yield
+        except (asyncio.CancelledError, DeadlineExceeded):
+            # A hedge loser or a caller's budget running out says nothing about the provider's health
+            raise
+        except Exception as e:
+            if not is_rate_limit_error(e):
+                self._record(name, success=False)
+            raise
+        seconds = time.monotonic() - started
+        self._record(name, success=True, seconds=seconds)
+        timings = provider_call_seconds.get()
+        if timings is not None:
+            timings.append(seconds)
+
+    def _record(self, name: str, success: bool, seconds: Optional[float] = None):
+        h = self.health[name]
+        h["success_ewma"] = self.alpha * (1.0 if success else 0.0) + (1 - self.alpha) * h["success_ewma"]
+        if success:
+            h["successes"] += 1
+            h["consecutive_failures"] = 0
+            h["latency_ewma"] = (seconds if h["latency_ewma"] is None
+                                 else self.alpha * seconds + (1 - self.alpha) * h["latency_ewma"])
+            if h["state"] != "closed":
+                logging.info(f"Provider {name} recovered; closing circuit")
+            h["state"] = "closed"
+            return
+        h["failures"] += 1
+        h["consecutive_failures"] += 1
+        if h["state"] == "half_open" or (h["state"] == "closed" and h["consecutive_failures"] >= self.failure_threshold):
+            if h["state"] == "closed":
+                logging.warning(f"Provider {name} failed {h['consecutive_failures']} times in a row; opening circuit")
+            h["state"] = "open"
+            h["opened_at"] = time.monotonic()
+            h["opened"] += 1
+
+    def snapshot(self) -> dict:
+        for name in self.names:
+            self._refresh(name)
+        return {
+            "order": self.rank(),
+            "failure_threshold": self.failure_threshold,
+            "open_seconds": self.open_seconds,
+            "providers": {
+                name: {
+                    **{k: v for k, v in h.items() if k != "opened_at"},
+                    "latency_ewma": round(h["latency_ewma"], 3) if h["latency_ewma"] is not None else None,
+                    "success_ewma": round(h["success_ewma"], 4),
+                    "open_for_seconds": (round(max(0.0, self.open_seconds - (time.monotonic() - h["opened_at"])), 1)
+                                         if h["state"] == "open" else 0.0),
+                }
+                for name, h in self.health.items()
+            },
+        }
+
+
+provider_router = ProviderRouter(ProviderClients.PROVIDERS, ROUTER_FAILURE_THRESHOLD, ROUTER_OPEN_SECONDS,
+                                 ROUTER_HALF_OPEN_PROBES, ROUTER_EWMA_ALPHA)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+
+class RateLimiter:
+    """Keeps each provider under its requests- and tokens-per-minute budgets.
+
+    A call reserves its estimated tokens (prompt plus max output) in a
+    sliding one-minute window before it goes out, and the reservation is
+    corrected to the provider-reported usage afterwards. Calls that do not
+    fit wait in a per-provider queue ordered by priority, so interactive ATS
+    checks go ahead of batch generations. A 429 holds back the whole
+    provider until its Retry-After (or a backoff) has passed.
+    """
+
+    WINDOW_SECONDS = 60.0
+
+    def __init__(self, budgets: Dict[str, tuple]):
+        self.budgets = budgets
+        self._window = {p: deque() for p in budgets}
+        self._queue = {p: [] for p in budgets}
+        self._changed = {p: asyncio.Event() for p in budgets}
+        self._order = itertools.count()
+        self.blocked_until = {p: 0.0 for p in budgets}
+        self.stats = {p: {"granted": 0, "queued": 0, "wait_seconds": 0.0, "rate_limited": 0, "retries": 0}
+                      for p in budgets}
+
+    def _notify(self, provider: str):
+        # Wake every waiter; each re-checks whether it is now at the head and fits
+        self._changed[provider].set()
+        self._changed[provider] = asyncio.Event()
+
+    def _wait_time(self, provider: str, tokens: int, now: float) -> float:
+        rpm, tpm = self.budgets[provider]
+        window = self._window[provider]
+        while window and window[0][0] <= now - self.WINDOW_SECONDS:
+            window.popleft()
+        wait = max(0.0, self.blocked_until[provider] - now)
+        if rpm and len(window) >= rpm:
+            wait = max(wait, window[len(window) - rpm][0] + self.WINDOW_SECONDS - now)
+        if tpm:
+            # A call larger than the whole budget waits for an empty window
+            excess = sum(entry[1] for entry in window) + min(tokens, tpm) - tpm
+            for granted_at, used in window:
+                if excess <= 0:
+                    break
+                excess -= used
+                wait = max(wait, granted_at + self.WINDOW_SECONDS - now)
+        return wait
+
+    async def acquire(self, provider: str, tokens: int, priority: int) -> list:
+        """Wait for room in the provider's budgets and reserve ``tokens`` of them."""
+        queue = self._queue[provider]
+        ticket = (priority, next(self._order))
+        heapq.heappush(queue, ticket)
+        started = time.monotonic()
+        try:
+            while True:
+                now = time.monotonic()
+                wait = self._wait_time(provider, tokens, now) if queue[0] == ticket else None
+                if wait == 0:
+                    break
+                budget = remaining_time(PROVIDER_DEADLINE_RESERVE_SECONDS)
+                if budget is not None and (budget <= 0 or (wait is not None and wait > budget)):
+                    raise DeadlineExceeded(f"{provider} rate limit would not free up before the request deadline")
+                timeout = wait if budget is None else min(budget, wait if wait is not None else budget)
+                try:
+                    await asyncio.wait_for(self._changed[provider].wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            reservation = [now, tokens]
+            self._window[provider].append(reservation)
+        finally:
+            queue.remove(ticket)
+            heapq.heapify(queue)
+            self._notify(provider)
+
+        stats = self.stats[provider]
+        stats["granted"] += 1
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            stats["queued"] += 1
+            stats["wait_seconds"] += waited
+        return reservation
+
+    def settle(self, provider: str, reservation: list, used_tokens: Optional[int]):
+        """Replace a reservation's estimate with what the provider says it used."""
+        if used_tokens is not None and used_tokens != reservation[1]:
+            reservation[1] = used_tokens
+            self._notify(provider)
+
+    def back_off(self, provider: str, retry_after: Optional[float], attempt: int) -> float:
+        """Hold back every call to ``provider`` after a 429; returns the delay."""
+        backoff = min(RATE_LIMIT_BACKOFF_MAX_SECONDS, RATE_LIMIT_BACKOFF_SECONDS * 2 ** attempt)
+        if retry_after is not None:
+            delay = min(RATE_LIMIT_BACKOFF_MAX_SECONDS, retry_after) + random.uniform(0, RATE_LIMIT_BACKOFF_SECONDS)
+        else:
+            delay = random.uniform(backoff / 2, backoff)
+        self.blocked_until[provider] = max(self.blocked_until[provider], time.monotonic() + delay)
+        self.stats[provider]["rate_limited"] += 1
+        return delay
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        result = {}
+        for provider, (rpm, tpm) in self.budgets.items():
+            self._wait_time(provider, 0, now)  # drop expired reservations
+            window = self._window[provider]
+            stats = self.stats[provider]
+            result[provider] = {
+                "rpm_limit": rpm,
+                "tpm_limit": tpm,
+                "requests_last_minute": len(window),
+                "tokens_last_minute": sum(entry[1] for entry in window),
+                "waiting": len(self._queue[provider]),
+                "waiting_interactive": sum(1 for priority, _ in self._queue[provider] if priority == PRIORITY_INTERACTIVE),
+                "blocked_for_seconds": round(max(0.0, self.blocked_until[provider] - now), 1),
+                **stats,
+                "wait_seconds": round(stats["wait_seconds"], 3),
+            }
+        return result
+
+
+rate_limiter = RateLimiter({"groq": (GROQ_RPM, GROQ_TPM), "gemini": (GEMINI_RPM, GEMINI_TPM)})
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    # Groq errors carry status_code, google-genai errors code
+    return (getattr(error, "status_code", None) or getattr(error, "code", None)) == 429
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return max(0.0, float(headers.get("retry-after")))
+    except (TypeError, ValueError):
+        return None
+
+
+async def call_provider(name: str, tokens: int, priority: int, make_call, usage):
+    """Run one provider call under its circuit breaker, rate limits and concurrency cap.
+
+    ``make_call`` builds the request coroutine (again on each retry) and
+    ``usage`` reads the token count off the response.
+    """
+    async with provider_router.guard(name):
+        for attempt in itertools.count():
+            reservation = await rate_limiter.acquire(name, tokens, priority)
+            try:
+                async with providers.track(name), provider_router.observe(name):
+                    response = await call_within_deadline(make_call())
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    raise
+                # A rejected call still counts as a request, but used no tokens
+                rate_limiter.settle(name, reservation, 0)
+                if attempt >= RATE_LIMIT_MAX_RETRIES:
+                    raise
+                delay = rate_limiter.back_off(name, retry_after_seconds(e), attempt)
+                rate_limiter.stats[name]["retries"] += 1
+                logging.warning(f"{name.capitalize()} rate limited; retrying in {delay:.1f}s")
+                continue
+            rate_limiter.settle(name, reservation, usage(response))
+            return response
+
+
+def require_groq() -> AsyncGroq:
+    if providers.groq is None:
+        raise RuntimeError("Groq client is not initialized: GROQ_API_KEY is missing or not set")
+    return providers.groq
+
+
+def require_gemini() -> genai.Client:
+    if providers.gemini is None:
+        raise RuntimeError("Gemini client is not initialized: GEMINI_API_KEY is missing or not set")
+    return providers.gemini
+
+
+def json_mode_failed_generation(error: BadRequestError) -> Optional[str]:
+    """The raw output Groq's JSON mode rejected, if that is what ``error`` is."""
+    body = error.body if isinstance(error.body, dict) else {}
+    body = body.get("error", body)
+    if not isinstance(body, dict) or body.get("code") != "json_validate_failed":
+        return None
+    return body.get("failed_generation") or None
+
+
+async def groq_chat(system_prompt: str, prompt: str, temperature: float, max_tokens: int,
+                    priority: int = PRIORITY_INTERACTIVE, schema: Optional[type] = None) -> str:
+    """With ``schema``, asks for JSON mode. GROQ_MODEL has no json_schema support,
+    so the shape itself comes from the prompt."""
+    extra = {"response_format": {"type": "json_object"}} if schema is not None and STRUCTURED_OUTPUT else {}
+
+    async def complete() -> tuple:
+        groq_client = require_groq()
+        try:
+            response = await groq_client.chat.completions.create(
+                model=GROQ_MODEL,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                **extra
+            )
+        except BadRequestError as e:
+            # JSON mode refuses output that does not parse (truncation, mostly);
+            # the repair path in parse_ai_response may still recover it
+            failed = json_mode_failed_generation(e)
+            if failed is None:
+                raise
+            return failed, None
+        return response.choices[0].message.content, getattr(getattr(response, "usage", None), "total_tokens", None)
+
+    text, _ = await call_provider(
+        "groq", estimate_tokens(system_prompt) + estimate_tokens(prompt) + max_tokens, priority, complete,
+        lambda r: r[1]
+    )
+    return text
+
+
+async def gemini_generate(contents: str, output_tokens: int, priority: int = PRIORITY_INTERACTIVE,
+                          schema: Optional[type] = None) -> str:
+    """``output_tokens`` is the expected answer size, reserved against GEMINI_TPM.
+
+    With ``schema`` (a pydantic model), the answer is constrained to it.
+    """
+    def make_call():
+        gemini_client = require_gemini()
+        options = {}
+        if schema is not None and STRUCTURED_OUTPUT:
+            options.update(response_mime_type="application/json", response_schema=schema)
+        budget = remaining_time(PROVIDER_DEADLINE_RESERVE_SECONDS)
+        if budget:
+            # Also bounds the HTTP request itself, which asyncio cannot cancel
+            # once it is running on a worker thread
+            options["http_options"] = genai.types.HttpOptions(timeout=max(1, int(budget * 1000)))
+        config = genai.types.GenerateContentConfig(**options) if options else None
+        if GEMINI_TRANSPORT == "thread":
+            return asyncio.to_thread(
+                gemini_client.models.generate_content,
+                model=GEMINI_MODEL,
+                contents=contents,
+                config=config
+            )
+        return gemini_client.aio.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=contents,
+            config=config
+        )
+
+    response = await call_provider(
+        "gemini", estimate_tokens(contents) + output_tokens, priority, make_call,
+        lambda r: getattr(getattr(r, "usage_metadata", None), "total_token_count", None)
+    )
+    return response.text
+
+
+class EventLoopLagMonitor:
+    """Samples how late the event loop wakes up from a short sleep.
+
+    Anything blocking the loop (sync SDK calls, CPU-heavy work) shows up as lag
+    here, which makes it the number to compare when switching transports.
+    """
+
+    def __init__(self, interval: float = 0.05, window: int = 1200):
+        self.interval = interval
+        self.samples: "deque[float]" = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - started - self.interval))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def reset(self):
+        self.samples.clear()
+
+    def snapshot(self) -> dict:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {"samples": 0}
+
+        def pct(q: float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+        return {
+            "samples": len(ordered),
+            "interval_ms": self.interval * 1000,
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+            "p50_ms": pct(0.50),
+            "p99_ms": pct(0.99),
+            "max_ms": round(ordered[-1] * 1000, 2),
+        }
+
+
+loop_lag = EventLoopLagMonitor()
+
+
+# ========== RESUME RENDERING ==========
+
+PROMPT_CHARS_PER_TOKEN = 4
+
+# Field order per entry type: (heading fields, free-text field)
+RESUME_ENTRY_FIELDS = {
+    "experience": (("position", "company", "duration"), "description"),
+    "education": (("degree", "institution", "year"), "details"),
+}
+PERSONAL_FIELD_ORDER = ("name", "email", "phone", "location")
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // PROMPT_CHARS_PER_TOKEN)
+
+
+def flatten_content(content) -> str:
+    """Collect the text of a section's content, whatever its shape."""
+    if isinstance(content, dict):
+        return " ".join(flatten_content(v) for v in content.values())
+    if isinstance(content, list):
+        return " ".join(flatten_content(v) for v in content)
+    return "" if content is None else str(content)
+
+
+def clip_text(text: str, max_chars: Optional[int] = None) -> str:
+    """Collapse whitespace and, if needed, shorten to a sentence or word boundary."""
+    text = " ".join(str(text).split())
+    if max_chars is None or len(text) <= max_chars:
+        return text
+    cut = text[:max(max_chars - 1, 1)]
+    sentence = cut.rfind(". ")
+    if sentence >= len(cut) // 2:
+        return cut[:sentence + 1]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > 0 else cut) + "…"
+
+
+def render_entry(kind: str, entry, cap: Optional[int]) -> str:
+    if not isinstance(entry, dict):
+        return f"- {clip_text(flatten_content(entry), cap)}"
+    heading_fields, text_field = RESUME_ENTRY_FIELDS[kind]
+    values = [clip_text(entry.get(f) or "") for f in heading_fields]
+    heading = ", ".join(v for v in values[:2] if v)
+    if values[2]:
+        heading = f"{heading} ({values[2]})"
+    detail = clip_text(entry.get(text_field) or "", cap)
+    return f"- {heading}: {detail}" if detail else f"- {heading}"
+
+
+def render_section(kind: str, content, cap: Optional[int]) -> List[str]:
+    """Compact plain-text lines for one section (empty sections render nothing)."""
+    if not flatten_content(content).strip():
+        return []
+    label = str(kind).upper()
+    if kind == "personal" and isinstance(content, dict):
+        keys = [k for k in PERSONAL_FIELD_ORDER if k in content] + sorted(k for k in content if k not in PERSONAL_FIELD_ORDER)
+        return [f"{label}: " + " | ".join(clip_text(flatten_content(content[k])) for k in keys
+                                       if flatten_content(content[k]).strip())]
+    if kind == "skills":
+        skills = content if isinstance(content, list) else [content]
+        return [f"{label}: " + ", ".join(clip_text(flatten_content(s)) for s in skills)]
+    if kind in RESUME_ENTRY_FIELDS and isinstance(content, dict):
+        content = [content]  # batch-generated resumes store one entry per section
+    if kind in RESUME_ENTRY_FIELDS and isinstance(content, list):
+        return [f"{label}:"] + [render_entry(kind, entry, cap) for entry in content
+                                 if flatten_content(entry).strip()]
+    return [f"{label}: {clip_text(flatten_content(content), cap)}"]
+
+
+def render_resume_text(title: Optional[str], sections: List[dict], max_tokens: Optional[int] = None) -> str:
+    """Render resume sections as compact, deterministic prompt text.
+
+    When the result exceeds ``max_tokens``, free-text fields (summaries and
+    entry descriptions) are shortened with a progressively tighter cap,
+    keeping leading sentences and every heading; as a last resort the text is
+    cut at the budget.
+    """
+    def render(cap: Optional[int]) -> str:
+        lines = [f"Title: {clip_text(title)}"] if title else []
+        for section in sections:
+            lines.extend(render_section(section.get("type", ""), section.get("content"), cap))
+        return "\n".join(lines)
+
+    text = render(None)
+    if max_tokens is None or estimate_tokens(text) <= max_tokens:
+        return text
+    cap = 600
+    while cap >= 80:
+        text = render(cap)
+        if estimate_tokens(text) <= max_tokens:
+            return text
+        cap = int(cap * 0.7)
+    return clip_lines(text.split("\n"), max_tokens * PROMPT_CHARS_PER_TOKEN)
+
+
+def clip_lines(lines: List[str], max_chars: int) -> str:
+    kept, used = [], 0
+    for line in lines:
+        if used + len(line) + 1 > max_chars:
+            remaining = max_chars - used
+            if remaining > 40:
+                kept.append(clip_text(line, remaining))
+            break
+        kept.append(line)
+        used += len(line) + 1
+    return "\n".join(kept)
+
+
+def fit_job_description(job_description: str, max_tokens: int = ATS_JOB_DESCRIPTION_TOKEN_BUDGET) -> str:
+    """Normalize a pasted posting (collapsed whitespace, no blank or repeated lines) and keep it in budget."""
+    lines, seen = [], set()
+    for line in job_description.splitlines():
+        line = clip_text(line)
+        if line and line.casefold() not in seen:
+            seen.add(line.casefold())
+            lines.append(line)
+    return clip_lines(lines, max_tokens * PROMPT_CHARS_PER_TOKEN)
+
+
+# Bump whenever the generation prompts or result handling change in a way
+# that should invalidate cached generations.
+GENERATION_PROMPT_VERSION = "1"
+
+GENERATION_OUTPUT_KEYS = """- summary: A 2-3 sentence professional summary optimized for the target role
 - skills: A comma-separated string of relevant skills (mix user's existing skills with role-specific ones)
 - experience: An array of objects with keys: position, company, duration, description (enhance descriptions with role-relevant keywords and achievements)
 - education: An array of objects with keys: degree, institution, year, details (keep as-is but add relevant coursework if applicable)"""
 
+RESUME_GENERATION_SYSTEM_PROMPT = f"""You are an expert resume writer and ATS optimization specialist. Given a user's base information and a target job profile, generate an optimized resume tailored for that role.
+
+Return your response as JSON only with these keys:
+{GENERATION_OUTPUT_KEYS}"""
+
+COMBINED_GENERATION_SYSTEM_PROMPT = f"""You are an expert resume writer and ATS optimization specialist. Given a user's base information and several target job profiles, generate one optimized resume per profile.
+
+Return your response as JSON only: an object whose keys are the profile ids from the prompt and whose values are objects with these keys:
+{GENERATION_OUTPUT_KEYS}"""
+
+def render_base_profile(personal_info, summary_base, experience, education, skills_base) -> str:
+    """The user's base information for generation prompts, within GENERATION_PROFILE_TOKEN_BUDGET."""
+    return render_resume_text(None, [
+        {"type": "personal", "content": {"name": personal_info.get('name', '')}},
+        {"type": "summary", "content": summary_base},
+        {"type": "skills", "content": skills_base},
+        {"type": "experience", "content": experience},
+        {"type": "education", "content": education},
+    ], GENERATION_PROFILE_TOKEN_BUDGET)
+
+
 def build_resume_generation_prompt(personal_info, summary_base, experience, education, skills_base, profile):
-    exp_text = "\n".join([f"- {e['position']} at {e['company']} ({e['duration']}): {e['description']}" for e in experience])
-    edu_text = "\n".join([f"- {e['degree']} from {e['institution']} ({e['year']})" for e in education])
+    base_profile = render_base_profile(personal_info, summary_base, experience, education, skills_base)
 
     return f"""Optimize this resume for a {profile['title']} position.
 
@@ -255,51 +1274,318 @@ SUMMARY FOCUS: {profile['summary_focus']}
 SKILLS CATEGORIES: {', '.join(profile['skills_categories'])}
 
 USER'S BASE INFORMATION:
-Name: {personal_info.get('name', '')}
-Current Summary: {summary_base}
-Skills: {skills_base}
+{base_profile}
 
-Experience:
-{exp_text}
+Generate an ATS-optimized resume. Enhance the content with relevant keywords naturally woven in. Keep factual information accurate but improve descriptions. Return JSON only."""
 
-Education:
-{edu_text}
 
-Generate an ATS-optimized resume. Enhance the content with relevant keywords naturally woven in. Keep factual information accurate but improve descriptions. Return JSON only."""
+def build_combined_generation_prompt(personal_info, summary_base, experience, education, skills_base, profiles):
+    base_profile = render_base_profile(personal_info, summary_base, experience, education, skills_base)
+    profile_blocks = "\n\n".join(
+        f"""[{profile['id']}] {profile['title']}
+KEYWORDS: {', '.join(profile['keywords'])}
+SUMMARY FOCUS: {profile['summary_focus']}
+SKILLS CATEGORIES: {', '.join(profile['skills_categories'])}"""
+        for profile in profiles
+    )
+
+    return f"""Optimize this resume separately for each of the following target roles.
+
+TARGET PROFILES:
+{profile_blocks}
+
+USER'S BASE INFORMATION:
+{base_profile}
+
+For every profile id, generate an ATS-optimized resume. Enhance the content with that role's keywords naturally woven in. Keep factual information accurate but improve descriptions. Return JSON only, keyed by profile id."""
+
+
+def validate_generation_result(result) -> Optional[dict]:
+    """Return ``result`` (skills normalized to a string) if it has the generation shape, else None."""
+    if not isinstance(result, dict):
+        return None
+    if not isinstance(result.get("summary"), str) or not result["summary"].strip():
+        return None
+    for key in ("experience", "education"):
+        if key in result and not (isinstance(result[key], list) and all(isinstance(e, dict) for e in result[key])):
+            return None
+    if "skills" in result:
+        if isinstance(result["skills"], list):
+            result = {**result, "skills": ", ".join(str(skill) for skill in result["skills"])}
+        elif not isinstance(result["skills"], str):
+            return None
+    return result
+
+
+@functools.lru_cache(maxsize=64)
+def combined_generation_schema(profile_ids: tuple) -> type:
+    """Response schema for a combined generation: one GeneratedResume per profile id."""
+    return create_model("CombinedGeneration", **{pid: (GeneratedResume, ...) for pid in profile_ids})
 
 
 async def call_groq_generate(prompt: str) -> dict:
-    groq_client = AsyncGroq(api_key=GROQ_API_KEY)
-    response = await groq_client.chat.completions.create(
-        model="llama-3.3-70b-versatile",
-        messages=[
-            {"role": "system", "content": RESUME_GENERATION_SYSTEM_PROMPT},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.4,
-        max_tokens=3000
-    )
-    return parse_ai_response(response.choices[0].message.content)
+    text = await groq_chat(RESUME_GENERATION_SYSTEM_PROMPT, prompt, temperature=0.4, max_tokens=3000,
+                           priority=PRIORITY_BATCH, schema=GeneratedResume)
+    return parse_ai_response(text, "generation", validate=validate_generation_result)
 
 
 async def call_gemini_generate(prompt: str) -> dict:
-    if gemini_client is None:
-        raise RuntimeError("Gemini client is not initialized: GEMINI_API_KEY is missing or not set")
-    response = await asyncio.to_thread(
-        gemini_client.models.generate_content,
-        model='gemini-2.0-flash',
-        contents=f"{RESUME_GENERATION_SYSTEM_PROMPT}\n\n{prompt}"
-    )
-    return parse_ai_response(response.text)
+    text = await gemini_generate(f"{RESUME_GENERATION_SYSTEM_PROMPT}\n\n{prompt}", 3000,
+                                 priority=PRIORITY_BATCH, schema=GeneratedResume)
+    return parse_ai_response(text, "generation", validate=validate_generation_result)
+
+
+async def call_groq_generate_combined(prompt: str, profile_ids: List[str]) -> dict:
+    max_tokens = min(GENERATION_COMBINED_MAX_TOKENS, 3000 * len(profile_ids))
+    text = await groq_chat(COMBINED_GENERATION_SYSTEM_PROMPT, prompt, temperature=0.4, max_tokens=max_tokens,
+                           priority=PRIORITY_BATCH, schema=combined_generation_schema(tuple(profile_ids)))
+    # Repair may cut into the per-profile objects; validate_generation_result sorts those out later
+    return parse_ai_response(text, "combined", repair_depth=2)
+
+
+async def call_gemini_generate_combined(prompt: str, profile_ids: List[str]) -> dict:
+    text = await gemini_generate(f"{COMBINED_GENERATION_SYSTEM_PROMPT}\n\n{prompt}",
+                                 min(GENERATION_COMBINED_MAX_TOKENS, 3000 * len(profile_ids)),
+                                 priority=PRIORITY_BATCH, schema=combined_generation_schema(tuple(profile_ids)))
+    return parse_ai_response(text, "combined", repair_depth=2)
+
+# ========== IN-PROCESS CACHING ==========
+
+class TTLCache:
+    """Small LRU mapping whose entries also expire after ``ttl_seconds``."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        if self.max_entries <= 0 or self.ttl_seconds <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: str):
+        self._entries.pop(key, None)
+
+
+class UserCache:
+    """Authenticated users keyed by id, so most requests skip the users lookup.
+
+    ``USER_CACHE_TTL_SECONDS`` is the maximum staleness: this process drops its
+    own entries whenever it changes a user, but changes made by other workers
+    are only seen once the entry expires.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.entries = TTLCache(max_entries, ttl_seconds)
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, user_id: str) -> Optional[User]:
+        user = self.entries.get(user_id)
+        if user is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return user.model_copy()
+
+    def set(self, user: User):
+        self.entries.set(user.id, user)
+
+    def invalidate(self, user_id: Optional[str]):
+        if user_id:
+            self.entries.pop(user_id)
+            self.stats["invalidations"] += 1
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "entries": len(self.entries),
+            "evictions": self.entries.evictions,
+            "max_entries": self.entries.max_entries,
+            "max_staleness_seconds": self.entries.ttl_seconds,
+        }
+
+
+user_cache = UserCache(USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL_SECONDS)
+
+
+class ResultCache:
+    """Content-addressed cache of LLM results.
+
+    The in-process tier is an LRU bounded by entry count and TTL. When a Mongo
+    collection is given, results are also written through to it so that other
+    workers (and restarts) can reuse them; expiry there is left to a TTL index.
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl_seconds: int, collection=None):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.collection = collection
+        self.memory = TTLCache(max_entries, ttl_seconds)
+        self.stats = {"memory_hits": 0, "mongo_hits": 0, "misses": 0, "stores": 0}
+
+    async def get(self, key: str) -> Optional[dict]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            return value
+
+        if self.collection is not None:
+            try:
+                doc = await self.collection.find_one(
+                    {"key": key, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+                    {"_id": 0, "value": 1}
+                )
+            except Exception as e:
+                logging.error(f"{self.name} cache lookup failed: {str(e)}")
+                doc = None
+            if doc:
+                self.memory.set(key, doc["value"])
+                self.stats["mongo_hits"] += 1
+                return doc["value"]
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: dict):
+        self.memory.set(key, value)
+        self.stats["stores"] += 1
+        if self.collection is not None:
+            try:
+                await self.collection.update_one(
+                    {"key": key},
+                    {"$set": {
+                        "value": value,
+                        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds)
+                    }},
+                    upsert=True
+                )
+            except Exception as e:
+                logging.error(f"{self.name} cache store failed: {str(e)}")
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["memory_hits"] + self.stats["mongo_hits"] + self.stats["misses"]
+        hits = lookups - self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self.memory),
+            "evictions": self.memory.evictions,
+            "max_entries": self.memory.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "mongo_tier": self.collection is not None,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class SingleFlight:
+    """Lets concurrent identical requests share one in-flight call.
+
+    The first caller for a key starts the work as a task; callers arriving
+    while it runs attach to that task and get its result (or exception).
+    The task runs in a fresh context, so it does not inherit the first
+    caller's request deadline; each caller instead waits only as long as
+    its own deadline allows. A caller going away does not cancel the task
+    while others still wait on it; the last one to go does. Keys are
+    grouped by kind for the stats.
+    """
+
+    def __init__(self):
+        self._flights: Dict[tuple, asyncio.Task] = {}
+        self._waiters: Dict[tuple, int] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    async def run(self, kind: str, key: str, make_call):
+        stats = self.stats.setdefault(kind, {"calls": 0, "coalesced": 0, "deadline_exceeded": 0})
+        stats["calls"] += 1
+        flight = (kind, key)
+        task = self._flights.get(flight)
+        if task is None:
+            task = asyncio.create_task(make_call(), context=contextvars.Context())
+            self._flights[flight] = task
+            task.add_done_callback(functools.partial(self._landed, flight))
+        else:
+            stats["coalesced"] += 1
+
+        self._waiters[flight] = self._waiters.get(flight, 0) + 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(task),
+                                          timeout=remaining_time(PROVIDER_DEADLINE_RESERVE_SECONDS))
+        except asyncio.TimeoutError:
+            if task.done():
+                raise  # the shared call's own error
+            stats["deadline_exceeded"] += 1
+            raise DeadlineExceeded(f"Request deadline passed while waiting on a shared {kind} call") from None
+        finally:
+            self._waiters[flight] -= 1
+            if not self._waiters[flight]:
+                del self._waiters[flight]
+                if not task.done():
+                    task.cancel()
+
+    def _landed(self, flight: tuple, task: asyncio.Task):
+        if self._flights.get(flight) is task:
+            del self._flights[flight]
+        if not task.cancelled():
+            task.exception()  # retrieved, even if every caller went away
+
+    def snapshot(self) -> dict:
+        return {
+            kind: {
+                **stats,
+                "in_flight": sum(1 for k, _ in self._flights if k == kind),
+                "coalesced_rate": round(stats["coalesced"] / stats["calls"], 4) if stats["calls"] else 0.0,
+            }
+            for kind, stats in self.stats.items()
+        }
+
+
+single_flight = SingleFlight()
 
 # ========== AUTH HELPERS ==========
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+# bcrypt releases the GIL while hashing, so a thread pool gives real parallelism
+password_hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+def _hash_password_sync(password: str) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
 
-def verify_password(plain: str, hashed: str) -> bool:
+def _verify_password_sync(plain: str, hashed: str) -> bool:
     return bcrypt.checkpw(plain.encode('utf-8'), hashed.encode('utf-8'))
 
+async def hash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_hash_pool, _hash_password_sync, password)
+
+async def verify_password(plain: str, hashed: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_hash_pool, _verify_password_sync, plain, hashed)
+
+def password_needs_rehash(hashed: str) -> bool:
+    # bcrypt hashes look like $2b$<cost>$<salt+hash>
+    try:
+        return int(hashed.split('$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
 def create_token(user_id: str) -> str:
     payload = {
         "sub": user_id,
@@ -311,15 +1597,238 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     try:
         payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=["HS256"])
         user_id = payload.get("sub")
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        cached = user_cache.get(user_id)
+        if cached is not None:
+            return cached
+        user = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
-        return User(**user)
+        user = User(**user)
+        user_cache.set(user)
+        return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+async def get_ops_user(current_user: User = Depends(get_current_user)) -> User:
+    # Provider, cache and runtime internals are for operators, not every signed-in user
+    if current_user.email.lower() not in OPS_ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return current_user
+
+# ========== STREAMING HELPERS ==========
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+class SettlingStreamingResponse(StreamingResponse):
+    """StreamingResponse that always runs ``settle`` once the response is over.
+
+    Quota reserved before the response is returned cannot be released from
+    the body generator's ``finally``: when the client disconnects before
+    the body is iterated, the generator never starts. ``settle`` runs after
+    the body generator has been closed, however the response ended.
+    """
+
+    def __init__(self, content, settle, **kwargs):
+        super().__init__(content, **kwargs)
+        self.settle = settle
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose()
+                await self.settle()
+
+# ========== PAGINATION ==========
+
+def encode_cursor(timestamp, doc_id: str) -> str:
+    # Documents migrate_datetimes has not reached yet still hold ISO strings;
+    # the cursor keeps the type so the next page compares like with like
+    if isinstance(timestamp, datetime):
+        value = [timestamp.isoformat(), doc_id]
+    else:
+        value = [str(timestamp), doc_id, "string"]
+    raw = json.dumps(value).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        timestamp, doc_id, *kind = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if kind == ["string"]:
+            return str(timestamp), str(doc_id)
+        if kind:
+            raise ValueError(kind)
+        return datetime.fromisoformat(timestamp), str(doc_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def cursor_filter(sort_field: str, timestamp, doc_id: str) -> List[dict]:
+    """Conditions selecting the documents after a cursor position, newest first."""
+    after = [
+        {sort_field: {"$lt": timestamp}},
+        {sort_field: timestamp, "id": {"$lt": doc_id}},
+    ]
+    if isinstance(timestamp, datetime):
+        # String timestamps sort after every date and never match $lt on a date
+        after.append({sort_field: {"$type": "string"}})
+    return after
+
+async def fetch_page(collection, base_filter: dict, sort_field: str, cursor: Optional[str],
+                     limit: int, projection: dict) -> tuple:
+    """Keyset page over (sort_field, id), newest first. Returns (docs, next_cursor).
+
+    Legacy string timestamps are paged too: they follow every date-typed
+    document, in MongoDB's string order.
+    """
+    query = dict(base_filter)
+    if cursor:
+        timestamp, doc_id = decode_cursor(cursor)
+        query["$or"] = cursor_filter(sort_field, timestamp, doc_id)
+    docs = await (collection.find(query, projection)
+                  .sort([(sort_field, -1), ("id", -1)])
+                  .limit(limit + 1)
+                  .to_list(limit + 1))
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_cursor(last[sort_field], last["id"])
+    return docs, next_cursor
+
+# ========== CONDITIONAL REQUESTS ==========
+
+# Per-user counters on the user document, bumped after every write to the
+# collection so list ETags can be computed without reading the list itself.
+COLLECTION_VERSION_FIELDS = {
+    "resumes": "resumes_version",
+    "ats_analyses": "analyses_version",
+}
+
+# Browsers store the response but revalidate it (If-None-Match) on every use
+CONDITIONAL_CACHE_CONTROL = "private, no-cache"
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+    return f'"{digest[:32]}"'
+
+def resume_etag(doc: dict) -> str:
+    # updated_at also covers job retries, which replace the document wholesale
+    return make_etag("resume", doc.get("id"), doc.get("version", 0), doc.get("updated_at"))
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so ignore any W/ prefix
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag in candidates
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CONDITIONAL_CACHE_CONTROL})
+
+def set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CONDITIONAL_CACHE_CONTROL
+
+async def bump_collection_version(user_id: str, collection: str):
+    await db.users.update_one({"id": user_id}, {"$inc": {COLLECTION_VERSION_FIELDS[collection]: 1}})
+
+async def collection_etag(request: Request, user_id: str, collection: str) -> str:
+    """ETag for a user's list view: collection version plus the query string.
+
+    Reads the counter straight from Mongo (not the user cache) and must run
+    before the list query, so a concurrent write can only make the tag stale
+    in the safe direction (an extra 200, never a wrong 304).
+    """
+    field = COLLECTION_VERSION_FIELDS[collection]
+    doc = await db.users.find_one({"id": user_id}, {"_id": 0, field: 1})
+    version = (doc or {}).get(field, 0)
+    params = sorted(request.query_params.multi_items())
+    return make_etag(collection, user_id, version, params)
+
+# ========== QUOTA LEDGER ==========
+
+FREE_TIER_RESUME_LIMIT = 5
+
+async def reserve_ats_check(user_id: str):
+    """Atomically take one ATS check from the user's allowance, before any LLM work."""
+    reserved = await db.users.find_one_and_update(
+        {"id": user_id, "$or": [
+            {"is_premium": True},
+            {"$expr": {"$lt": [{"$ifNull": ["$ats_checks_used", 0]}, {"$ifNull": ["$ats_checks_limit", 10]}]}},
+        ]},
+        {"$inc": {"ats_checks_used": 1}},
+        projection={"_id": 0, "id": 1}
+    )
+    user_cache.invalidate(user_id)
+    if not reserved:
+        raise HTTPException(status_code=403, detail="ATS check limit reached. Upgrade to premium for unlimited checks.")
+
+async def refund_ats_check(user_id: str):
+    await db.users.update_one({"id": user_id, "ats_checks_used": {"$gt": 0}}, {"$inc": {"ats_checks_used": -1}})
+    user_cache.invalidate(user_id)
+
+async def ensure_resume_count(user_id: str) -> int:
+    """Return the denormalized resume count, backfilling it once for older accounts."""
+    doc = await db.users.find_one({"id": user_id}, {"_id": 0, "resume_count": 1})
+    if doc is not None and "resume_count" in doc:
+        return doc["resume_count"]
+    count = await db.resumes.count_documents({"user_id": user_id})
+    await db.users.update_one({"id": user_id, "resume_count": {"$exists": False}},
+                              {"$set": {"resume_count": count}})
+    return count
+
+async def record_resume_count_change(user_id: str, delta: int):
+    """Adjust resume_count for a direct create/delete and bump the list version.
+
+    Accounts that have not been backfilled yet are left without a count, so
+    the backfill's count_documents stays the single source for them.
+    """
+    await db.users.update_one({"id": user_id}, [{"$set": {
+        COLLECTION_VERSION_FIELDS["resumes"]: {"$add": [{"$ifNull": [f"${COLLECTION_VERSION_FIELDS['resumes']}", 0]}, 1]},
+        "resume_count": {"$cond": [
+            {"$eq": [{"$type": "$resume_count"}, "missing"]},
+            "$$REMOVE",
+            {"$max": [0, {"$add": ["$resume_count", delta]}]},
+        ]},
+    }}])
+
+async def reserve_resume_slots(user_id: str, count: int):
+    """Atomically reserve ``count`` resumes against the free-tier limit.
+
+    Slots that do not end up as saved resumes must be handed back with
+    release_resume_slots.
+    """
+    await ensure_resume_count(user_id)
+    reserved = await db.users.find_one_and_update(
+        {"id": user_id, "$or": [
+            {"is_premium": True},
+            {"resume_count": {"$lte": FREE_TIER_RESUME_LIMIT - count}},
+        ]},
+        {"$inc": {"resume_count": count}},
+        projection={"_id": 0, "id": 1}
+    )
+    if not reserved:
+        existing_count = await ensure_resume_count(user_id)
+        raise HTTPException(
+            status_code=403,
+            detail=f"Free tier limit: you have {existing_count} resumes and can create {max(0, FREE_TIER_RESUME_LIMIT - existing_count)} more. Upgrade to premium for unlimited resumes."
+        )
+
+async def release_resume_slots(user_id: str, count: int):
+    if count > 0:
+        await db.users.update_one({"id": user_id, "resume_count": {"$gte": count}},
+                                  {"$inc": {"resume_count": -count}})
+
 # ========== HEALTH CHECK ==========
 
 @app.get("/health")
@@ -334,7 +1843,7 @@ async def register(user_data: UserCreate):
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_pwd = hash_password(user_data.password)
+    hashed_pwd = await hash_password(user_data.password)
     user = User(
         email=user_data.email,
         full_name=user_data.full_name
@@ -342,9 +1851,13 @@ async def register(user_data: UserCreate):
 
     user_dict = user.model_dump()
     user_dict['password'] = hashed_pwd
-    user_dict['created_at'] = user_dict['created_at'].isoformat()
+    user_dict['resume_count'] = 0
 
-    await db.users.insert_one(user_dict)
+    try:
+        await db.users.insert_one(user_dict)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration for the same email
+        raise HTTPException(status_code=400, detail="Email already registered")
     token = create_token(user.id)
 
     return TokenResponse(token=token, user=user)
@@ -355,9 +1868,17 @@ async def login(credentials: UserLogin):
     if not user_doc:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    if not verify_password(credentials.password, user_doc['password']):
+    if not await verify_password(credentials.password, user_doc['password']):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
+    # Upgrade hashes created with a different work factor while we have the password
+    if password_needs_rehash(user_doc['password']):
+        rehashed = await hash_password(credentials.password)
+        await db.users.update_one(
+            {"id": user_doc['id'], "password": user_doc['password']},
+            {"$set": {"password": rehashed}}
+        )
+
     user = User(**{k: v for k, v in user_doc.items() if k != 'password'})
     token = create_token(user.id)
 
@@ -369,8 +1890,9 @@ async def reset_password(request: PasswordReset):
     if not user_doc:
         raise HTTPException(status_code=404, detail="No account found with this email")
 
-    hashed = hash_password(request.new_password)
+    hashed = await hash_password(request.new_password)
     await db.users.update_one({"email": request.email}, {"$set": {"password": hashed}})
+    user_cache.invalidate(user_doc.get('id'))
 
     return {"message": "Password reset successfully. You can now log in with your new password."}
 
@@ -386,26 +1908,145 @@ async def create_resume(resume_data: ResumeCreate, current_user: User = Depends(
         user_id=current_user.id,
         title=resume_data.title,
         template=resume_data.template,
-        sections=resume_data.sections
+        sections=assign_section_ids(resume_data.sections)
     )
 
     resume_dict = resume.model_dump()
-    resume_dict['created_at'] = resume_dict['created_at'].isoformat()
-    resume_dict['updated_at'] = resume_dict['updated_at'].isoformat()
 
     await db.resumes.insert_one(resume_dict)
+    await record_resume_count_change(current_user.id, 1)
     resume_dict.pop('_id', None)  # Remove MongoDB ObjectId (not JSON-serializable)
     return resume
 
-@api_router.get("/resumes", response_model=List[Resume])
-async def get_resumes(current_user: User = Depends(get_current_user)):
-    resumes = await db.resumes.find({"user_id": current_user.id}, {"_id": 0}).to_list(100)
-    for resume in resumes:
-        if isinstance(resume.get('created_at'), str):
-            resume['created_at'] = datetime.fromisoformat(resume['created_at'])
-        if isinstance(resume.get('updated_at'), str):
-            resume['updated_at'] = datetime.fromisoformat(resume['updated_at'])
-    return resumes
+@api_router.get("/resumes", response_model=None,
+                responses={200: {"model": List[Resume], "description": "Resumes, newest first; "
+                                 "ResumeSummary items when fields=summary. X-Next-Cursor is set when more remain."}})
+async def get_resumes(
+    request: Request,
+    response: Response,
+    limit: int = Query(100, ge=1, le=200),
+    cursor: Optional[str] = None,
+    fields: str = Query("full", pattern="^(full|summary)$"),
+    current_user: User = Depends(get_current_user)
+):
+    etag = await collection_etag(request, current_user.id, "resumes")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
+    summary = fields == "summary"
+    resumes, next_cursor = await fetch_page(
+        db.resumes, {"user_id": current_user.id}, "updated_at", cursor, limit,
+        RESUME_SUMMARY_PROJECTION if summary else {"_id": 0}
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    model = ResumeSummary if summary else Resume
+    return [model(**r) for r in resumes]
+
+def assign_section_ids(sections: List[ResumeSection]) -> List[ResumeSection]:
+    for section in sections:
+        if not section.id:
+            section.id = str(uuid.uuid4())
+    return sections
+
+
+def build_section_patch(operations: List[SectionOperation]) -> tuple:
+    """Translate section operations into an update pipeline.
+
+    Returns ``(guards, stages)``. The operations are folded over ``sections``
+    with ``$reduce``, so each one resolves its target against the array as
+    the previous operations left it. The fold also yields ``ok``, which turns
+    false once any target is out of range or no longer there; the ``$expr``
+    guard requires it, so such a patch matches nothing and writes nothing.
+    User content is wrapped in ``$literal`` so strings starting with ``$``
+    are never read as field paths.
+    """
+    steps = []
+    for op in operations:
+        section = None
+        if op.op in ("set", "insert"):
+            if op.section is None:
+                raise HTTPException(status_code=400, detail=f"'{op.op}' needs a section")
+            section = op.section.model_copy()
+            if op.op == "insert":
+                assign_section_ids([section])
+                section = section.model_dump()
+            else:
+                # Replacing keeps the section's identity unless a new id is given
+                section = section.model_dump(exclude_none=True)
+        if op.op != "insert" and op.section_id is None and op.index is None:
+            raise HTTPException(status_code=400, detail=f"'{op.op}' needs an index or section_id")
+        if op.op == "reorder" and op.to_index is None:
+            raise HTTPException(status_code=400, detail="'reorder' needs a to_index")
+        steps.append({"op": op.op, "index": op.index, "section_id": op.section_id,
+                      "section": section, "to_index": op.to_index})
+    if not steps:
+        return [], []
+
+    size = {"$size": "$$s"}
+
+    def positions(arr, cond: dict) -> dict:
+        return {"$filter": {"input": {"$range": [0, {"$size": arr}]}, "as": "i", "cond": cond}}
+
+    def pick(arr, indices: dict) -> dict:
+        return {"$map": {"input": indices, "as": "i", "in": {"$arrayElemAt": [arr, "$$i"]}}}
+
+    def insert_at(arr, position, item) -> dict:
+        return {"$let": {"vars": {"at": position}, "in": {"$concatArrays": [
+            pick(arr, positions(arr, {"$lt": ["$$i", "$$at"]})),
+            [item],
+            pick(arr, positions(arr, {"$gte": ["$$i", "$$at"]})),
+        ]}}}
+
+    def remove_at(arr, position) -> dict:
+        return pick(arr, positions(arr, {"$ne": ["$$i", position]}))
+
+    replacement = {"$mergeObjects": [{"id": {"$arrayElemAt": ["$$ids", "$$p"]}}, "$$this.section"]}
+    apply = {"$switch": {"branches": [
+        {"case": {"$eq": ["$$this.op", "set"]}, "then": {"$map": {
+            "input": {"$range": [0, size]}, "as": "i", "in": {"$cond": [
+                {"$eq": ["$$i", "$$p"]}, replacement, {"$arrayElemAt": ["$$s", "$$i"]}
+            ]}
+        }}},
+        {"case": {"$eq": ["$$this.op", "insert"]}, "then": insert_at("$$s", "$$p", "$$this.section")},
+        {"case": {"$eq": ["$$this.op", "remove"]}, "then": remove_at("$$s", "$$p")},
+        {"case": {"$eq": ["$$this.op", "reorder"]}, "then": {"$let": {
+            "vars": {"rest": remove_at("$$s", "$$p")},
+            "in": insert_at("$$rest", {"$min": ["$$this.to_index", {"$size": "$$rest"}]},
+                            {"$arrayElemAt": ["$$s", "$$p"]}),
+        }}},
+    ]}}
+
+    fold = {"$reduce": {
+        "input": {"$literal": steps},
+        "initialValue": {"sections": {"$ifNull": ["$sections", []]}, "ok": True},
+        "in": {"$let": {
+            "vars": {"s": "$$value.sections"},
+            "in": {"$let": {
+                "vars": {"ids": {"$map": {"input": "$$s", "as": "x", "in": "$$x.id"}}},
+                "in": {"$let": {
+                    "vars": {"p": {"$switch": {"branches": [
+                        {"case": {"$eq": ["$$this.op", "insert"]},
+                         "then": {"$min": [{"$ifNull": ["$$this.index", size]}, size]}},
+                        {"case": {"$ne": ["$$this.section_id", None]},
+                         "then": {"$indexOfArray": ["$$ids", "$$this.section_id"]}},
+                    ], "default": "$$this.index"}}},
+                    "in": {"$cond": [
+                        {"$and": ["$$value.ok", {"$gte": ["$$p", 0]}, {"$or": [
+                            {"$eq": ["$$this.op", "insert"]}, {"$lt": ["$$p", size]}
+                        ]}]},
+                        {"sections": apply, "ok": True},
+                        {"sections": "$$s", "ok": False},
+                    ]},
+                }},
+            }},
+        }},
+    }}
+
+    guards = [{"$let": {"vars": {"patched": fold}, "in": "$$patched.ok"}}]
+    stages = [{"$set": {"sections": {"$let": {"vars": {"patched": fold}, "in": "$$patched.sections"}}}}]
+    return guards, stages
 
 # ========== BATCH GENERATION ROUTES ==========
 
@@ -418,8 +2059,136 @@ async def get_job_profiles(current_user: User = Depends(get_current_user)):
     return profiles
 
 
-@api_router.post("/resumes/batch-generate", response_model=BatchGenerateResponse)
-async def batch_generate_resumes(request: BatchGenerateRequest, current_user: User = Depends(get_current_user)):
+class HedgePolicy:
+    """Decides when to hedge a slow generation call and keeps score of outcomes."""
+
+    def __init__(self, fixed_delay: Optional[float], default_delay: float,
+                 min_samples: int = 20, window: int = 200):
+        self.fixed_delay = fixed_delay
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.latencies: Dict[str, deque] = {}
+        self.window = window
+        self.stats = {"calls": 0, "hedges_fired": 0, "wins": {}, "failures": 0, "saved_seconds": 0.0}
+
+    def record(self, provider: str, seconds: float):
+        self.latencies.setdefault(provider, deque(maxlen=self.window)).append(seconds)
+
+    def delay(self, provider: str, scale: float = 1.0) -> float:
+        if self.fixed_delay is not None:
+            return self.fixed_delay * scale
+        samples = self.latencies.get(provider)
+        if not samples or len(samples) < self.min_samples:
+            return self.default_delay * scale
+        ordered = sorted(samples)
+        return ordered[int(0.9 * (len(ordered) - 1))]
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "enabled": GENERATION_HEDGING,
+            "delay_seconds": {p: round(self.delay(p), 3) for p in ("groq", "gemini")},
+            "samples": {p: len(v) for p, v in self.latencies.items()},
+        }
+
+
+hedge_policy = HedgePolicy(
+    float(GENERATION_HEDGE_DELAY_SECONDS) if GENERATION_HEDGE_DELAY_SECONDS else None,
+    GENERATION_HEDGE_DEFAULT_SECONDS
+)
+
+
+async def hedged_generate(prompt: str, label: str, primary: Optional[str] = None, secondary: Optional[str] = None,
+                          profile_ids: Optional[List[str]] = None) -> tuple:
+    """Generate with ``primary``, starting ``secondary`` early if the primary is slow.
+
+    Unless given, the two providers come from the router's current ranking, so
+    a degraded provider is tried second (and fails fast while its circuit is open).
+
+    The secondary is started as soon as the primary fails, or once the hedge
+    delay passes without an answer. The first valid result wins and the other
+    call is cancelled. Returns (result, provider); raises if both fail.
+
+    With several ``profile_ids`` the prompt is a combined one; those calls keep
+    their own latency samples and scale the default delay by the profile count.
+    """
+    profiles = len(profile_ids) if profile_ids else 1
+    if profiles > 1:
+        calls = {"groq": functools.partial(call_groq_generate_combined, profile_ids=profile_ids),
+                 "gemini": functools.partial(call_gemini_generate_combined, profile_ids=profile_ids)}
+    else:
+        calls = {"groq": call_groq_generate, "gemini": call_gemini_generate}
+    key_suffix = f"x{profiles}" if profiles > 1 else ""
+    ranked = provider_router.rank()
+    primary = primary or ranked[0]
+    secondary = secondary or next(name for name in ranked if name != primary)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    hedge_policy.stats["calls"] += 1
+
+    async def attempt(provider: str) -> dict:
+        # Sample the provider's own request time, not our rate-limit pacing
+        timings = []
+        provider_call_seconds.set(timings)
+        result = await calls[provider](prompt)
+        if not isinstance(result, dict):
+            raise ValueError(f"{provider} returned {type(result).__name__}, expected a JSON object")
+        if timings:
+            hedge_policy.record(provider + key_suffix, sum(timings))
+        return result
+
+    tasks = {asyncio.create_task(attempt(primary)): primary}
+    delay = hedge_policy.delay(primary + key_suffix, scale=profiles) if GENERATION_HEDGING else None
+    hedged_at = None
+    hedged = False
+    last_error = None
+    try:
+        while tasks:
+            done, _ = await asyncio.wait(tasks, timeout=delay if hedged_at is None else None,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                provider = tasks.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    last_error = e
+                    logging.error(f"{provider.capitalize()} generation failed for {label}: {str(e)}")
+                    if isinstance(e, StructuredOutputError) and hedged_at is None:
+                        # Unusable output is what starts the secondary call here
+                        structured_output.record_recall("combined" if profiles > 1 else "generation")
+                    continue
+
+                elapsed = loop.time() - started
+                wins = hedge_policy.stats["wins"]
+                wins[provider] = wins.get(provider, 0) + 1
+                if hedged and provider == secondary:
+                    # Sequential fallback would still be waiting on the primary and
+                    # then pay for the whole secondary call on top of that.
+                    saved = elapsed - hedged_at
+                    hedge_policy.stats["saved_seconds"] += saved
+                    logging.info(f"Hedged generation for {label}: {provider} won after {elapsed:.2f}s "
+                                 f"(hedge fired at {hedged_at:.2f}s, saved >= {saved:.2f}s)")
+                elif hedged:
+                    logging.info(f"Hedged generation for {label}: {provider} won after {elapsed:.2f}s "
+                                 f"(hedge fired at {hedged_at:.2f}s, no latency saved)")
+                return result, provider
+
+            if hedged_at is None:
+                # Primary failed, or is still running past the hedge delay
+                hedged_at = loop.time() - started
+                hedged = bool(tasks)
+                if hedged:
+                    hedge_policy.stats["hedges_fired"] += 1
+                tasks[asyncio.create_task(attempt(secondary))] = secondary
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    hedge_policy.stats["failures"] += 1
+    raise last_error or RuntimeError(f"No provider produced a result for {label}")
+
+
+def validate_batch_request(request: BatchGenerateRequest):
     # Validate max 5 profiles
     if len(request.job_profiles) > 5:
         raise HTTPException(status_code=400, detail="Maximum 5 job profiles allowed per batch")
@@ -431,153 +2200,605 @@ async def batch_generate_resumes(request: BatchGenerateRequest, current_user: Us
         if profile_id not in JOB_PROFILE_PRESETS:
             raise HTTPException(status_code=400, detail=f"Invalid job profile: {profile_id}")
 
-    # Check free tier limits
-    if not current_user.is_premium:
-        existing_count = await db.resumes.count_documents({"user_id": current_user.id})
-        if existing_count + len(request.job_profiles) > 5:
-            raise HTTPException(
-                status_code=403,
-                detail=f"Free tier limit: you have {existing_count} resumes and can create {max(0, 5 - existing_count)} more. Upgrade to premium for unlimited resumes."
-            )
 
+def request_base_profile(request: BatchGenerateRequest) -> str:
+    return render_base_profile(
+        request.personal_info, request.summary_base,
+        [e.model_dump() for e in request.experience], [e.model_dump() for e in request.education],
+        request.skills_base
+    )
+
+
+def generation_cache_key(base_profile: str, profile_id: str) -> str:
+    """Hash of everything that shapes a profile's generation prompt.
+
+    ``base_profile`` is the normalized rendering of the request's base fields,
+    so whitespace edits or a different template still hit.
+    """
+    digest = hashlib.sha256()
+    for part in (GENERATION_PROMPT_VERSION, GROQ_MODEL, GEMINI_MODEL, RESUME_GENERATION_SYSTEM_PROMPT,
+                 json.dumps(JOB_PROFILE_PRESETS[profile_id], sort_keys=True), base_profile):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+generation_cache = ResultCache(
+    "Generation",
+    GENERATION_CACHE_MAX_ENTRIES,
+    GENERATION_CACHE_TTL_SECONDS,
+    collection=db.generation_cache if GENERATION_CACHE_TTL_SECONDS > 0 else None
+)
+
+
+def use_combined_generation(request: BatchGenerateRequest, profile_count: int) -> bool:
+    enabled = request.combined_generation
+    if enabled is None:
+        enabled = BATCH_COMBINED_GENERATION
+    return enabled and profile_count > 1
+
+
+async def generate_combined(request: BatchGenerateRequest, profile_ids: List[str]) -> Dict[str, tuple]:
+    """Generate several profiles in one LLM call.
+
+    Returns ``{profile_id: (result, provider)}`` for the profiles that came back
+    valid; callers fall back to the per-profile path for the rest.
+    """
+    prompt = build_combined_generation_prompt(
+        request.personal_info, request.summary_base,
+        [e.model_dump() for e in request.experience], [e.model_dump() for e in request.education],
+        request.skills_base, [JOB_PROFILE_PRESETS[pid] for pid in profile_ids]
+    )
+    try:
+        combined, provider = await hedged_generate(prompt, f"combined[{','.join(profile_ids)}]",
+                                                   profile_ids=profile_ids)
+    except Exception as e:
+        logging.error(f"Combined generation failed for {profile_ids}: {str(e)}")
+        if isinstance(e, StructuredOutputError):
+            structured_output.record_recall("combined", len(profile_ids))
+        return {}
+
+    generated = {}
+    for profile_id in profile_ids:
+        result = validate_generation_result(combined.get(profile_id))
+        if result is None:
+            logging.warning(f"Combined generation gave no valid result for {profile_id}; using the per-profile path")
+            structured_output.record_recall("combined")
+        else:
+            generated[profile_id] = (result, provider)
+    return generated
+
+
+async def prepare_generation(request: BatchGenerateRequest, profile_ids: List[str]) -> Dict[str, tuple]:
+    """Results that need no per-profile LLM call: ``{profile_id: (result, provider, source)}``.
+
+    Cached profiles come first (unless ``force_regenerate``); the rest go
+    through one combined call when that mode is on.
+    """
+    base_profile = request_base_profile(request)
+    generated = {}
+    if not request.force_regenerate:
+        hits = await asyncio.gather(*[
+            generation_cache.get(generation_cache_key(base_profile, pid)) for pid in profile_ids
+        ])
+        for profile_id, hit in zip(profile_ids, hits):
+            if hit is not None:
+                generated[profile_id] = (hit["result"], hit["provider"], "cache")
+
+    remaining = [pid for pid in profile_ids if pid not in generated]
+    if use_combined_generation(request, len(remaining)):
+        for profile_id, (result, provider) in (await generate_combined(request, remaining)).items():
+            await generation_cache.set(generation_cache_key(base_profile, profile_id),
+                                       {"result": result, "provider": provider})
+            generated[profile_id] = (result, provider, "combined")
+    return generated
+
+
+async def generate_single_resume(request: BatchGenerateRequest, profile_id: str, user_id: str,
+                                 resume_id: Optional[str] = None,
+                                 generated: Optional[tuple] = None,
+                                 saved: Optional[set] = None) -> Optional[dict]:
+    """Generate, persist and return one tailored resume, or None if every provider failed.
+
+    Passing ``resume_id`` makes the write idempotent, so a retried job cannot
+    leave duplicate resumes behind. ``generated`` is a ``(result, provider,
+    source)`` triple from prepare_generation; the LLM is skipped then.
+    ``profile_id`` is added to ``saved`` as soon as the resume is written,
+    even if the caller is cancelled before this returns.
+    """
     experience_dicts = [e.model_dump() for e in request.experience]
     education_dicts = [e.model_dump() for e in request.education]
+    profile = JOB_PROFILE_PRESETS[profile_id]
 
-    async def generate_single_resume(profile_id: str) -> dict:
-        profile = JOB_PROFILE_PRESETS[profile_id]
+    if generated is not None:
+        ai_result, ai_provider, source = generated
+    else:
+        source = "llm"
         prompt = build_resume_generation_prompt(
             request.personal_info, request.summary_base,
             experience_dicts, education_dicts,
             request.skills_base, profile
         )
+        cache_key = generation_cache_key(request_base_profile(request), profile_id)
 
-        ai_result = None
-        ai_provider = None
+        async def generate() -> tuple:
+            # Healthiest provider first, hedged with the other when it is slow or fails
+            generated = await hedged_generate(prompt, profile_id)
+            await generation_cache.set(cache_key, {"result": generated[0], "provider": generated[1]})
+            return generated
 
-        # Try Groq first (faster)
+        # Concurrent batches asking for the same profile share one generation
         try:
-            ai_result = await call_groq_generate(prompt)
-            ai_provider = "groq"
+            ai_result, ai_provider = await single_flight.run("generation", cache_key, generate)
         except Exception as e:
-            logging.error(f"Groq generation failed for {profile_id}: {str(e)}")
+            logging.error(f"Generation failed for {profile_id}: {str(e)}")
+            return None
 
-        # Fallback to Gemini
-        if ai_result is None:
-            try:
-                ai_result = await call_gemini_generate(prompt)
-                ai_provider = "gemini"
-            except Exception as e:
-                logging.error(f"Gemini generation failed for {profile_id}: {str(e)}")
-                return None
+    # Build resume sections from AI output
+    sections = []
+
+    # Personal info section
+    sections.append(ResumeSection(type="personal", content=request.personal_info))
 
-        # Build resume sections from AI output
-        sections = []
+    # Summary
+    sections.append(ResumeSection(type="summary", content=ai_result.get("summary", request.summary_base)))
 
-        # Personal info section
-        sections.append(ResumeSection(type="personal", content=request.personal_info))
+    # Experience
+    ai_experience = ai_result.get("experience", experience_dicts)
+    for exp in ai_experience:
+        sections.append(ResumeSection(type="experience", content=exp))
 
-        # Summary
-        sections.append(ResumeSection(type="summary", content=ai_result.get("summary", request.summary_base)))
+    # Education
+    ai_education = ai_result.get("education", education_dicts)
+    for edu in ai_education:
+        sections.append(ResumeSection(type="education", content=edu))
 
-        # Experience
-        ai_experience = ai_result.get("experience", experience_dicts)
-        for exp in ai_experience:
-            sections.append(ResumeSection(type="experience", content=exp))
+    # Skills
+    sections.append(ResumeSection(type="skills", content=ai_result.get("skills", request.skills_base)))
 
-        # Education
-        ai_education = ai_result.get("education", education_dicts)
-        for edu in ai_education:
-            sections.append(ResumeSection(type="education", content=edu))
+    resume = Resume(
+        user_id=user_id,
+        title=f"{request.personal_info.get('name', 'Resume')} - {profile['title']}",
+        template=request.template,
+        sections=assign_section_ids(sections),
+        job_profile=profile_id,
+        batch_generated=True
+    )
+    if resume_id:
+        resume.id = resume_id
+
+    resume_dict = resume.model_dump()
 
-        # Skills
-        sections.append(ResumeSection(type="skills", content=ai_result.get("skills", request.skills_base)))
+    async def save():
+        if resume_id:
+            await db.resumes.replace_one({"id": resume_id}, resume_dict, upsert=True)
+        else:
+            await db.resumes.insert_one(resume_dict)
+        if saved is not None:
+            saved.add(profile_id)
+        await bump_collection_version(user_id, "resumes")
+
+    # The generated resume is kept (and its slot counted) even this close to the deadline
+    await without_deadline(save())
+    resume_dict.pop('_id', None)  # Remove MongoDB ObjectId (not JSON-serializable)
 
-        resume = Resume(
-            user_id=current_user.id,
-            title=f"{request.personal_info.get('name', 'Resume')} - {profile['title']}",
-            template=request.template,
-            sections=sections,
-            job_profile=profile_id,
-            batch_generated=True
-        )
+    return {"resume": resume_dict, "provider": ai_provider, "profile_id": profile_id, "source": source}
 
-        resume_dict = resume.model_dump()
-        resume_dict['created_at'] = resume_dict['created_at'].isoformat()
-        resume_dict['updated_at'] = resume_dict['updated_at'].isoformat()
-        await db.resumes.insert_one(resume_dict)
-        resume_dict.pop('_id', None)  # Remove MongoDB ObjectId (not JSON-serializable)
 
-        return {"resume": resume_dict, "provider": ai_provider, "profile_id": profile_id}
+async def iter_batch_generation(request: BatchGenerateRequest, user_id: str, deadline: Optional[float] = None,
+                                saved: Optional[set] = None):
+    """Yield (profile_id, result) pairs in completion order; result is None on failure.
 
-    # Run all generations in parallel
+    Profiles whose generation has not finished by ``deadline`` fail, so the
+    caller still gets every profile that did finish. Every profile whose
+    resume was written lands in ``saved``, consumed or not; once the
+    generator is closed no generation is left running, so ``saved`` is final.
+    """
+    generated = await with_deadline(deadline, prepare_generation(request, request.job_profiles))
+
+    async def run(profile_id: str) -> tuple:
+        try:
+            return profile_id, await generate_single_resume(request, profile_id, user_id,
+                                                            generated=generated.get(profile_id), saved=saved)
+        except Exception as e:
+            logging.error(f"Batch generate unexpected error for {profile_id}: {str(e)}", exc_info=True)
+            return profile_id, None
+
+    tasks = [asyncio.create_task(with_deadline(deadline, run(pid))) for pid in request.job_profiles]
     try:
-        results = await asyncio.gather(*[generate_single_resume(pid) for pid in request.job_profiles])
-    except Exception as e:
-        logging.error(f"Batch generate unexpected error: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Batch generation failed: {str(e)}")
-
-    successful = [r for r in results if r is not None]
-    failed = [request.job_profiles[i] for i, r in enumerate(results) if r is None]
-
-    # Fix datetime fields for response
-    resume_list = []
-    for r in successful:
-        res = r["resume"]
-        if isinstance(res.get('created_at'), str):
-            res['created_at'] = datetime.fromisoformat(res['created_at'])
-        if isinstance(res.get('updated_at'), str):
-            res['updated_at'] = datetime.fromisoformat(res['updated_at'])
-        resume_list.append(res)
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def build_generation_stats(request: BatchGenerateRequest, successful: List[dict], failed: List[str],
+                           deadline: Optional[float] = None) -> dict:
+    return {
+        "total_requested": len(request.job_profiles),
+        "successful": len(successful),
+        "failed": len(failed),
+        "failed_profiles": failed,
+        "providers_used": {r["profile_id"]: r["provider"] for r in successful},
+        "combined_profiles": [r["profile_id"] for r in successful if r.get("source") == "combined"],
+        "cache_hits": [r["profile_id"] for r in successful if r.get("source") == "cache"],
+        "deadline_exceeded": bool(failed) and deadline is not None and time.monotonic() >= deadline
+    }
+
+
+@api_router.post("/resumes/batch-generate", response_model=BatchGenerateResponse,
+                 responses={202: {"description": "Job queued (background=true)"}})
+async def batch_generate_resumes(request: BatchGenerateRequest, background: bool = False,
+                                 current_user: User = Depends(get_current_user)):
+    validate_batch_request(request)
+
+    if background:
+        await reserve_resume_slots(current_user.id, len(request.job_profiles))
+        try:
+            job = await enqueue_batch_job(request, current_user.id)
+        except Exception:
+            await release_resume_slots(current_user.id, len(request.job_profiles))
+            raise
+        return JSONResponse(status_code=202, content={"job_id": job.id, "status": job.status})
+
+    # A double-click or client retry of a batch that is still running gets
+    # that batch's resumes instead of generating (and paying for) a second set
+    request_hash = hashlib.sha256(request.model_dump_json().encode('utf-8')).hexdigest()
+    return await single_flight.run("batch", f"{current_user.id}:{request_hash}",
+                                   functools.partial(run_batch_generation, request, current_user.id))
+
+
+async def run_batch_generation(request: BatchGenerateRequest, user_id: str) -> BatchGenerateResponse:
+    await reserve_resume_slots(user_id, len(request.job_profiles))
+
+    # Run all generations in parallel; slots not turned into resumes go back
+    deadline = deadline_after(BATCH_DEADLINE_SECONDS)
+    results = {}
+    saved = set()
+    try:
+        async with contextlib.aclosing(iter_batch_generation(request, user_id, deadline, saved)) as batch:
+            async for profile_id, result in batch:
+                results[profile_id] = result
+    finally:
+        await release_resume_slots(user_id, len(request.job_profiles) - len(saved))
+
+    successful = [results[pid] for pid in request.job_profiles if results[pid] is not None]
+    failed = [pid for pid in request.job_profiles if results[pid] is None]
 
     return BatchGenerateResponse(
-        resumes=resume_list,
-        generation_stats={
-            "total_requested": len(request.job_profiles),
-            "successful": len(successful),
-            "failed": len(failed),
-            "failed_profiles": failed,
-            "providers_used": {r["profile_id"]: r["provider"] for r in successful}
-        }
+        resumes=[r["resume"] for r in successful],
+        generation_stats=build_generation_stats(request, successful, failed, deadline)
+    )
+
+
+@api_router.post("/resumes/batch-generate/stream")
+async def batch_generate_resumes_stream(request: BatchGenerateRequest, current_user: User = Depends(get_current_user)):
+    """Server-Sent Events variant of /resumes/batch-generate.
+
+    Emits a ``resume`` event as soon as each profile is generated and saved (or
+    a ``failed`` event), then a ``done`` event carrying ``generation_stats``.
+    """
+    validate_batch_request(request)
+    deadline = deadline_after(BATCH_DEADLINE_SECONDS)
+    await reserve_resume_slots(current_user.id, len(request.job_profiles))
+    saved = set()
+
+    async def events():
+        successful, failed = [], []
+        async with contextlib.aclosing(iter_batch_generation(request, current_user.id, deadline, saved)) as batch:
+            async for profile_id, result in batch:
+                if result is None:
+                    failed.append(profile_id)
+                    yield sse_event("failed", {"profile_id": profile_id})
+                else:
+                    successful.append(result)
+                    yield sse_event("resume", result)
+        failed.sort(key=request.job_profiles.index)
+        yield sse_event("done", {"generation_stats": build_generation_stats(request, successful, failed, deadline)})
+
+    async def release_unused_slots():
+        # Also runs when the client disconnects, even before the stream started.
+        # Resumes saved but never sent to the client still keep their slots.
+        await release_resume_slots(current_user.id, len(request.job_profiles) - len(saved))
+
+    return SettlingStreamingResponse(events(), release_unused_slots, media_type="text/event-stream",
+                                     headers=SSE_HEADERS)
+
+
+# ========== BATCH JOB QUEUE ==========
+
+async def enqueue_batch_job(request: BatchGenerateRequest, user_id: str) -> BatchJob:
+    job = BatchJob(
+        user_id=user_id,
+        request=request.model_dump(),
+        profiles={pid: {"status": "pending"} for pid in request.job_profiles}
     )
+    await db.batch_jobs.insert_one(job.model_dump())
+    batch_workers.wake()
+    return job
+
+
+class BatchJobWorkers:
+    """Worker coroutines that run queued batch generation jobs.
+
+    Jobs are claimed with a lease that the owning worker keeps renewing. Each
+    finished profile is checkpointed onto the job document, so when a worker
+    dies (or the process restarts) another worker re-claims the job once the
+    lease expires and only runs the profiles that are still pending. A shared
+    semaphore caps how many profile generations this process runs at once.
+    """
+
+    def __init__(self, workers: int, max_generations: int):
+        self.workers = workers
+        self.max_generations = max_generations
+        self.worker_prefix = f"{socket.gethostname()}-{os.getpid()}"
+        self.generation_slots: Optional[asyncio.Semaphore] = None
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self):
+        self.generation_slots = asyncio.Semaphore(self.max_generations)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run(f"{self.worker_prefix}-{i}")) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self, worker_id: str):
+        while True:
+            try:
+                job = await self.claim(worker_id)
+                if job is not None:
+                    await self.process(job, worker_id)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Batch worker {worker_id} error: {str(e)}", exc_info=True)
+            self._wakeup.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=BATCH_JOB_POLL_SECONDS)
+
+    async def claim(self, worker_id: str) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        claimable = {"$or": [
+            {"status": "queued"},
+            {"status": "running", "lease_expires_at": {"$lt": now}},
+        ]}
+
+        # Jobs whose leases keep expiring are given up on
+        exhausted = await db.batch_jobs.find_one_and_update(
+            {**claimable, "attempts": {"$gte": BATCH_JOB_MAX_ATTEMPTS}},
+            {"$set": {"status": "failed", "error": "Maximum attempts exceeded",
+                      "lease_owner": None, "lease_expires_at": None, "updated_at": now}},
+            projection={"_id": 0, "id": 1, "user_id": 1, "profiles": 1}
+        )
+        if exhausted:
+            logging.error(f"Batch job {exhausted['id']} failed after {BATCH_JOB_MAX_ATTEMPTS} attempts")
+            pending = sum(1 for state in exhausted["profiles"].values() if state.get("status") == "pending")
+            await release_resume_slots(exhausted["user_id"], pending)
+
+        return await db.batch_jobs.find_one_and_update(
+            {**claimable, "attempts": {"$lt": BATCH_JOB_MAX_ATTEMPTS}},
+            {
+                "$set": {"status": "running", "lease_owner": worker_id,
+                         "lease_expires_at": now + timedelta(seconds=BATCH_JOB_LEASE_SECONDS),
+                         "updated_at": now},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _renew_lease(self, job_id: str, worker_id: str, lost: asyncio.Event):
+        while True:
+            await asyncio.sleep(BATCH_JOB_LEASE_SECONDS / 3)
+            result = await db.batch_jobs.update_one(
+                {"id": job_id, "lease_owner": worker_id},
+                {"$set": {"lease_expires_at": datetime.now(timezone.utc) + timedelta(seconds=BATCH_JOB_LEASE_SECONDS)}}
+            )
+            if result.matched_count == 0:
+                lost.set()
+                return
+
+    async def process(self, job: dict, worker_id: str):
+        request = BatchGenerateRequest(**job["request"])
+        owned = {"id": job["id"], "lease_owner": worker_id}
+        pending = [pid for pid, state in job["profiles"].items() if state.get("status") == "pending"]
+        lost = asyncio.Event()
+        renewer = asyncio.create_task(self._renew_lease(job["id"], worker_id, lost))
+        generated = {}
+
+        async def run_profile(profile_id: str):
+            # Deterministic ids make a retried profile overwrite, not duplicate
+            resume_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"batch-job:{job['id']}:{profile_id}"))
+            async with self.generation_slots:
+                if lost.is_set():
+                    return
+                try:
+                    result = await generate_single_resume(request, profile_id, job["user_id"], resume_id=resume_id,
+                                                          generated=generated.get(profile_id))
+                except Exception as e:
+                    logging.error(f"Batch job {job['id']} profile {profile_id} error: {str(e)}", exc_info=True)
+                    result = None
+            state = ({"status": "done", "resume_id": result["resume"]["id"], "provider": result["provider"],
+                      "source": result["source"]}
+                     if result else {"status": "failed"})
+            checkpoint = await db.batch_jobs.update_one(
+                owned,
+                {"$set": {f"profiles.{profile_id}": state, "updated_at": datetime.now(timezone.utc)}}
+            )
+            if checkpoint.matched_count == 0:
+                lost.set()
+            elif not result:
+                await release_resume_slots(job["user_id"], 1)
+
+        try:
+            if pending:
+                async with self.generation_slots:
+                    generated.update(await prepare_generation(request, pending))
+            await asyncio.gather(*[run_profile(pid) for pid in pending])
+        finally:
+            renewer.cancel()
+
+        if lost.is_set():
+            logging.warning(f"Batch job {job['id']} lease lost by {worker_id}; leaving it for another worker")
+            return
+
+        final = await db.batch_jobs.find_one({"id": job["id"]}, {"_id": 0, "profiles": 1})
+        successful = [
+            {"profile_id": pid, "provider": state["provider"], "source": state.get("source")}
+            for pid, state in final["profiles"].items() if state.get("status") == "done"
+        ]
+        failed = [pid for pid in request.job_profiles if final["profiles"][pid].get("status") != "done"]
+        await db.batch_jobs.update_one(owned, {"$set": {
+            "status": "completed",
+            "generation_stats": build_generation_stats(request, successful, failed),
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "updated_at": datetime.now(timezone.utc)
+        }})
+
+
+batch_workers = BatchJobWorkers(BATCH_JOB_WORKERS, BATCH_JOB_MAX_GENERATIONS)
+
+
+@api_router.get("/resumes/batch-jobs/{job_id}")
+async def get_batch_job(job_id: str, current_user: User = Depends(get_current_user)):
+    job = await db.batch_jobs.find_one({"id": job_id, "user_id": current_user.id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+
+    states = job["profiles"]
+    resume_ids = [state["resume_id"] for state in states.values() if state.get("status") == "done"]
+    resumes = await db.resumes.find({"id": {"$in": resume_ids}}, {"_id": 0}).to_list(len(resume_ids) or 1)
+
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "progress": {
+            "total": len(states),
+            "completed": sum(1 for s in states.values() if s.get("status") == "done"),
+            "failed": sum(1 for s in states.values() if s.get("status") == "failed"),
+            "pending": sum(1 for s in states.values() if s.get("status") == "pending"),
+        },
+        "profiles": states,
+        "resumes": resumes,
+        "generation_stats": job.get("generation_stats"),
+        "error": job.get("error"),
+        "attempts": job.get("attempts", 0),
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
 
 
 @api_router.get("/resumes/{resume_id}", response_model=Resume)
-async def get_resume(resume_id: str, current_user: User = Depends(get_current_user)):
-    resume = await db.resumes.find_one({"id": resume_id, "user_id": current_user.id}, {"_id": 0})
+async def get_resume(resume_id: str, request: Request, response: Response,
+                     current_user: User = Depends(get_current_user)):
+    owned = {"id": resume_id, "user_id": current_user.id}
+    if request.headers.get("if-none-match"):
+        # Revalidation: compare against the version fields before loading the body
+        head = await db.resumes.find_one(owned, {"_id": 0, "id": 1, "version": 1, "updated_at": 1})
+        if not head:
+            raise HTTPException(status_code=404, detail="Resume not found")
+        etag = resume_etag(head)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+    resume = await db.resumes.find_one(owned, {"_id": 0})
     if not resume:
         raise HTTPException(status_code=404, detail="Resume not found")
 
-    if isinstance(resume.get('created_at'), str):
-        resume['created_at'] = datetime.fromisoformat(resume['created_at'])
-    if isinstance(resume.get('updated_at'), str):
-        resume['updated_at'] = datetime.fromisoformat(resume['updated_at'])
-
+    set_etag(response, resume_etag(resume))
     return Resume(**resume)
 
 @api_router.put("/resumes/{resume_id}", response_model=Resume)
-async def update_resume(resume_id: str, update_data: ResumeUpdate, current_user: User = Depends(get_current_user)):
-    resume = await db.resumes.find_one({"id": resume_id, "user_id": current_user.id}, {"_id": 0})
-    if not resume:
-        raise HTTPException(status_code=404, detail="Resume not found")
-
+async def update_resume(resume_id: str, update_data: ResumeUpdate, response: Response,
+                        current_user: User = Depends(get_current_user)):
+    if update_data.sections is not None:
+        assign_section_ids(update_data.sections)
     update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
-    if update_dict:
-        update_dict['updated_at'] = datetime.now(timezone.utc).isoformat()
-        await db.resumes.update_one({"id": resume_id}, {"$set": update_dict})
 
-    updated = await db.resumes.find_one({"id": resume_id}, {"_id": 0})
-    if isinstance(updated.get('created_at'), str):
-        updated['created_at'] = datetime.fromisoformat(updated['created_at'])
-    if isinstance(updated.get('updated_at'), str):
-        updated['updated_at'] = datetime.fromisoformat(updated['updated_at'])
+    owned = {"id": resume_id, "user_id": current_user.id}
+    if update_dict:
+        update_dict['updated_at'] = datetime.now(timezone.utc)
+        updated = await db.resumes.find_one_and_update(
+            owned,
+            {"$set": update_dict, "$inc": {"version": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+    else:
+        updated = await db.resumes.find_one(owned, {"_id": 0})
 
+    if not updated:
+        raise HTTPException(status_code=404, detail="Resume not found")
+    if update_dict:
+        await bump_collection_version(current_user.id, "resumes")
+    set_etag(response, resume_etag(updated))
     return Resume(**updated)
 
+@api_router.patch("/resumes/{resume_id}", response_model=Resume)
+async def patch_resume(resume_id: str, patch: ResumePatch, response: Response,
+                       current_user: User = Depends(get_current_user)):
+    """Apply section-level edits in a single round trip.
+
+    Operations run in order and may address a section by ``index`` or by
+    stable ``section_id``. Each target is resolved after the operations before
+    it have applied; if one is out of range or gone by then, nothing is
+    written (422). When ``expected_version`` is given, the patch only
+    applies if nobody else has saved the resume in the meantime (409 otherwise).
+    """
+    guards, stages = build_section_patch(patch.operations)
+    final = {
+        "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+        "updated_at": {"$literal": datetime.now(timezone.utc)},
+    }
+    if patch.title is not None:
+        final["title"] = {"$literal": patch.title}
+    if patch.template is not None:
+        final["template"] = {"$literal": patch.template}
+    stages.append({"$set": final})
+
+    query = {"id": resume_id, "user_id": current_user.id}
+    if patch.expected_version is not None:
+        guards.append({"$eq": [{"$ifNull": ["$version", 0]}, patch.expected_version]})
+    if guards:
+        query["$expr"] = {"$and": guards}
+
+    updated = await db.resumes.find_one_and_update(
+        query, stages, projection={"_id": 0}, return_document=ReturnDocument.AFTER
+    )
+    if updated:
+        await bump_collection_version(current_user.id, "resumes")
+        set_etag(response, resume_etag(updated))
+        return Resume(**updated)
+
+    # Nothing matched: work out why (only on the failure path)
+    current = await db.resumes.find_one({"id": resume_id, "user_id": current_user.id},
+                                        {"_id": 0, "version": 1})
+    if not current:
+        raise HTTPException(status_code=404, detail="Resume not found")
+    if patch.expected_version is not None and current.get("version", 0) != patch.expected_version:
+        raise HTTPException(status_code=409, detail=f"Resume was modified (current version {current.get('version', 0)})")
+    raise HTTPException(status_code=422, detail="Section operation refers to a section that does not exist")
+
 @api_router.delete("/resumes/{resume_id}")
 async def delete_resume(resume_id: str, current_user: User = Depends(get_current_user)):
     result = await db.resumes.delete_one({"id": resume_id, "user_id": current_user.id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Resume not found")
+    await record_resume_count_change(current_user.id, -1)
     return {"message": "Resume deleted"}
 
 # ========== ATS ROUTES ==========
@@ -600,98 +2821,488 @@ JOB DESCRIPTION:
 Provide response as JSON only."""
 
 
-def parse_ai_response(response_text: str) -> dict:
-    text = response_text.strip()
-    if text.startswith('```json'):
-        text = text.split('```json')[1].split('```')[0].strip()
-    elif text.startswith('```'):
-        text = text.split('```')[1].split('```')[0].strip()
-    return json.loads(text)
+class StructuredOutputError(ValueError):
+    """A provider answer with no usable JSON object in it."""
+
+
+class StructuredOutputStats:
+    """How provider answers parsed, per kind of call.
+
+    ``clean`` parsed as-is, ``extracted`` needed the JSON dug out of other
+    text, ``repaired`` was truncated and got closed off, ``failed`` was
+    unusable. ``recalls`` counts the extra provider calls failures caused.
+    """
+
+    OUTCOMES = ("clean", "extracted", "repaired", "failed")
+
+    def __init__(self):
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def _kind(self, kind: str) -> Dict[str, int]:
+        return self.stats.setdefault(kind, {**{outcome: 0 for outcome in self.OUTCOMES}, "recalls": 0})
+
+    def record(self, kind: str, outcome: str):
+        self._kind(kind)[outcome] += 1
+
+    def record_recall(self, kind: str, count: int = 1):
+        self._kind(kind)["recalls"] += count
+
+    def snapshot(self) -> dict:
+        result = {}
+        for kind, stats in self.stats.items():
+            responses = sum(stats[outcome] for outcome in self.OUTCOMES)
+            result[kind] = {
+                **stats,
+                "responses": responses,
+                "failure_rate": round(stats["failed"] / responses, 4) if responses else 0.0,
+                "recall_rate": round(stats["recalls"] / responses, 4) if responses else 0.0,
+            }
+        return {"structured_output": STRUCTURED_OUTPUT, "kinds": result}
+
+
+structured_output = StructuredOutputStats()
+
+CODE_FENCE_PATTERN = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+JSON_SEARCH_MAX_STARTS = 20
+
+
+def scan_json_object(text: str, start: int, depth: int) -> tuple:
+    """Bracket-match the object opening at ``text[start]``.
+
+    Returns (end, cuts): ``end`` is just past the matching brace, or None if
+    the text runs out first. ``cuts`` are (position, closing brackets) pairs
+    at each comma with nesting ``depth`` or shallower, where a truncated
+    object can be cut back and closed off.
+    """
+    closers = []
+    cuts = []
+    in_string = escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            closers.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            closers.pop()
+            if not closers:
+                return i + 1, cuts
+        elif ch == "," and len(closers) <= depth:
+            cuts.append((i, "".join(reversed(closers))))
+    return None, cuts
+
+
+def find_json_object(text: str, repair_depth: int = 1) -> tuple:
+    """Dig a JSON object out of mixed text: returns (object, "extracted" or "repaired").
+
+    Code fences are searched first, then the text as a whole. An object cut
+    off by the end of the text (usually max_tokens) is cut back to its last
+    member complete at ``repair_depth`` and closed. Cutting only at shallow
+    depth means a half-written list is dropped whole, so callers fall back
+    to the base data rather than saving part of it.
+    """
+    for candidate in [block.strip() for block in CODE_FENCE_PATTERN.findall(text)] + [text]:
+        start = candidate.find("{")
+        for _ in range(JSON_SEARCH_MAX_STARTS):
+            if start < 0:
+                break
+            end, cuts = scan_json_object(candidate, start, repair_depth)
+            if end is None:
+                for cut, suffix in reversed(cuts):
+                    try:
+                        value = json.loads(candidate[start:cut] + suffix)
+                    except ValueError:
+                        continue
+                    if isinstance(value, dict):
+                        return value, "repaired"
+                break
+            try:
+                value = json.loads(candidate[start:end])
+            except ValueError:
+                value = None
+            if isinstance(value, dict):
+                return value, "extracted"
+            # Braces in prose; look past this span rather than inside it
+            start = candidate.find("{", end)
+    return None, "failed"
 
 
-async def call_gemini(prompt: str) -> dict:
-    if gemini_client is None:
-        raise RuntimeError("Gemini client is not initialized: GEMINI_API_KEY is missing or not set")
-    response = await asyncio.to_thread(
-        gemini_client.models.generate_content,
-        model='gemini-2.0-flash',
-        contents=f"{ATS_SYSTEM_PROMPT}\n\n{prompt}"
+def validate_ats_result(result: dict) -> Optional[dict]:
+    try:
+        return ATSProviderResult.model_validate(result).model_dump()
+    except ValidationError:
+        return None
+
+
+def parse_ai_response(response_text: str, kind: str = "ats", validate=None, repair_depth: int = 1) -> dict:
+    """Parse a provider's JSON answer, tolerating surrounding prose and truncation.
+
+    ``validate`` returns the (normalized) result, or None when the shape is
+    wrong. Raises StructuredOutputError when nothing usable is left.
+    """
+    text = (response_text or "").strip()
+    try:
+        result, outcome = json.loads(text), "clean"
+    except ValueError:
+        result, outcome = find_json_object(text, repair_depth)
+    if isinstance(result, dict) and validate is not None:
+        result = validate(result)
+    if not isinstance(result, dict):
+        structured_output.record(kind, "failed")
+        raise StructuredOutputError(f"No usable JSON object in the {kind} response ({len(text)} chars)")
+    structured_output.record(kind, outcome)
+    return result
+
+# ========== ATS RESULT CACHE ==========
+
+# Bump whenever the ATS prompt or result handling changes in a way that
+# should invalidate previously cached provider results.
+ATS_PROMPT_VERSION = "2"
+
+
+def normalize_job_description(job_description: str) -> str:
+    return " ".join(job_description.split()).casefold()
+
+
+def ats_cache_key(resume_text: str, job_description: str) -> str:
+    digest = hashlib.sha256()
+    for part in (ATS_PROMPT_VERSION, GEMINI_MODEL, GROQ_MODEL, ATS_SYSTEM_PROMPT,
+                 resume_text, normalize_job_description(job_description)):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+def ats_results_cacheable(results: dict) -> bool:
+    # A one-provider answer (failure, open circuit or deadline) is served once
+    # but not cached, so the next check asks the missing provider again
+    return bool(results.get("gemini") and results.get("groq"))
+
+
+ats_cache = ResultCache(
+    "ATS",
+    ATS_CACHE_MAX_ENTRIES,
+    ATS_CACHE_TTL_SECONDS,
+    collection=db.ats_cache if ATS_CACHE_MONGO else None
+)
+
+# ========== LOCAL ATS SCORER ==========
+
+ATS_STOPWORDS = frozenset("""
+    a about across all also an and any are as at be been being both but by can could do does each etc
+    for from has have how if in including into is it its may more most must new not of on or other our
+    out over per plus such than that the their them then there these they this those through to under
+    up us using via was we well were what when where which while who will with within work working
+    would you your years year experience team teams role ability strong excellent looking join
+    build building candidate candidates company culture ideal job knowledge plus preferred required
+    requirement requirements responsibilities responsibility qualifications senior junior skills
+""".split())
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9+#]*(?:[./-][a-z0-9+#]+)*")
+
+ATS_EXPECTED_SECTIONS = ("personal", "summary", "experience", "education", "skills")
+
+# Blend of keyword coverage, BM25 similarity and section completeness
+ATS_LOCAL_WEIGHTS = (0.5, 0.3, 0.2)
+ATS_LOCAL_MAX_JD_TERMS = 20
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25_AVG_RESUME_TOKENS = 350
+
+
+@functools.lru_cache(maxsize=65536)
+def stem_token(token: str) -> str:
+    # Plural folding only ("apis" -> "api"); enough for keyword matching
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "is", "us")):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    return [stem_token(t) for t in TOKEN_PATTERN.findall(text.casefold()) if t not in ATS_STOPWORDS]
+
+
+SURFACE_TOKEN_PATTERN = re.compile(TOKEN_PATTERN.pattern, re.IGNORECASE)
+
+
+def surface_forms(text: str) -> Dict[str, str]:
+    """First spelling of each token as written ("DevOps" for "devop"), for display."""
+    forms: Dict[str, str] = {}
+    for word in SURFACE_TOKEN_PATTERN.findall(text):
+        forms.setdefault(stem_token(word.casefold()), word)
+    return forms
+
+
+def phrase_ngrams(tokens: List[str], max_n: int) -> set:
+    return {tuple(tokens[i:i + n]) for n in range(1, max_n + 1) for i in range(len(tokens) - n + 1)}
+
+
+# Domain vocabulary from the job profile presets: token phrase -> display form
+ATS_VOCABULARY = {
+    tuple(tokenize(keyword)): keyword
+    for preset in JOB_PROFILE_PRESETS.values()
+    for keyword in preset["keywords"]
+    if tokenize(keyword)
+}
+ATS_VOCABULARY_MAX_N = max(len(phrase) for phrase in ATS_VOCABULARY)
+
+
+def extract_job_keywords(job_tokens: List[str], surface: Optional[Dict[str, str]] = None) -> Dict[tuple, tuple]:
+    """Weighted keywords of a job description: phrase -> (display, weight).
+
+    Preset vocabulary phrases found in the posting weigh double; the most
+    frequent remaining terms fill up to ATS_LOCAL_MAX_JD_TERMS. Those are
+    displayed as ``surface`` (see surface_forms) spells them, not stemmed.
+    """
+    grams = phrase_ngrams(job_tokens, ATS_VOCABULARY_MAX_N)
+    keywords = {phrase: (display, 2.0) for phrase, display in ATS_VOCABULARY.items() if phrase in grams}
+    covered = {token for phrase in keywords for token in phrase}
+
+    counts: Dict[str, int] = {}
+    for token in job_tokens:
+        if len(token) > 2 and not token.isdigit() and token not in covered:
+            counts[token] = counts.get(token, 0) + 1
+    # Stable order (frequency, then first occurrence) keeps scores deterministic
+    for token in sorted(counts, key=lambda t: -counts[t])[:max(0, ATS_LOCAL_MAX_JD_TERMS - len(keywords))]:
+        display = (surface or {}).get(token, token)
+        keywords[(token,)] = (display, min(2.0, 1.0 + 0.25 * (counts[token] - 1)))
+    return keywords
+
+
+def keyword_query(keywords: Dict[tuple, tuple]) -> Dict[str, float]:
+    """Per-token query weights for the BM25 part of the score."""
+    query: Dict[str, float] = {}
+    for phrase, (_, weight) in keywords.items():
+        for token in phrase:
+            query[token] = max(query.get(token, 0.0), weight)
+    return query
+
+
+def bm25_similarity(query: Dict[str, float], tf: Dict[str, int], doc_len: int) -> float:
+    """BM25 term saturation against a typical resume length, scaled to 0..1."""
+    if not query:
+        return 0.0
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / BM25_AVG_RESUME_TOKENS)
+    achieved = sum(w * tf.get(t, 0) * (BM25_K1 + 1) / (tf.get(t, 0) + norm) for t, w in query.items())
+    return achieved / sum(w * (BM25_K1 + 1) for w in query.values())
+
+
+def resume_tokens(resume: dict) -> List[str]:
+    return tokenize(" ".join(
+        [resume.get("title", "")] + [flatten_content(s.get("content")) for s in resume.get("sections", [])]
+    ))
+
+
+def missing_resume_sections(resume: dict) -> List[str]:
+    filled = {s.get("type") for s in resume.get("sections", []) if flatten_content(s.get("content")).strip()}
+    return [name for name in ATS_EXPECTED_SECTIONS if name not in filled]
+
+
+def score_resume_locally(resume: dict, job_description: str) -> LocalATSScore:
+    """Deterministic, in-process ATS score of a resume against a job description."""
+    tokens = resume_tokens(resume)
+    keywords = extract_job_keywords(tokenize(job_description), surface_forms(job_description))
+
+    grams = phrase_ngrams(tokens, ATS_VOCABULARY_MAX_N)
+    matched = [display for phrase, (display, _) in keywords.items() if phrase in grams]
+    missing = [display for phrase, (display, _) in keywords.items() if phrase not in grams]
+    total_weight = sum(weight for _, weight in keywords.values())
+    coverage = (sum(weight for phrase, (_, weight) in keywords.items() if phrase in grams) / total_weight
+                if total_weight else 0.0)
+
+    query = keyword_query(keywords)
+    tf: Dict[str, int] = {}
+    for token in tokens:
+        tf[token] = tf.get(token, 0) + 1
+    similarity = bm25_similarity(query, tf, len(tokens))
+
+    missing_sections = missing_resume_sections(resume)
+    completeness = 1 - len(missing_sections) / len(ATS_EXPECTED_SECTIONS)
+
+    w_cov, w_sim, w_sec = ATS_LOCAL_WEIGHTS
+    return LocalATSScore(
+        score=round(100 * (w_cov * coverage + w_sim * similarity + w_sec * completeness)),
+        keyword_coverage=round(coverage, 4),
+        similarity=round(similarity, 4),
+        section_completeness=round(completeness, 4),
+        matched_keywords=matched,
+        missing_keywords=missing,
+        missing_sections=missing_sections,
     )
-    return parse_ai_response(response.text)
+
+
+def local_ats_feedback(local: LocalATSScore) -> dict:
+    """Feedback in the provider result shape, derived from a local score."""
+    strengths = []
+    if local.matched_keywords:
+        strengths.append(f"Mentions key terms from the posting: {', '.join(local.matched_keywords[:8])}")
+    if not local.missing_sections:
+        strengths.append("Includes all standard resume sections")
+    improvements = []
+    if local.missing_keywords:
+        improvements.append(f"Add relevant keywords where they apply: {', '.join(local.missing_keywords[:8])}")
+    for name in local.missing_sections:
+        improvements.append(f"Add {'an' if name[0] in 'aeiou' else 'a'} {name} section")
+    return {
+        "feedback": (f"Keyword analysis: your resume covers {round(local.keyword_coverage * 100)}% of the "
+                     f"weighted terms in this job description."),
+        "strengths": strengths,
+        "improvements": improvements or ["Quantify achievements"],
+    }
+
+
+def match_resumes_to_jobs(resumes: List[dict], job_descriptions: List[str], top_k: int) -> tuple:
+    """Score every resume against every job description in one vectorized pass.
+
+    Uses the same blend as score_resume_locally, except that BM25 gets real
+    IDF and length normalization from the user's own resumes as the corpus.
+    Returns ``(scores, rankings)``: a jobs x resumes matrix of 0-100 scores and,
+    per job, the ``top_k`` best ATSMatchCandidate entries.
+    """
+    docs = [resume_tokens(r) for r in resumes]
+    jobs = [extract_job_keywords(tokenize(jd), surface_forms(jd)) for jd in job_descriptions]
+
+    # Only query terms get a column: other resume tokens count towards each
+    # resume's length but never towards a score, so the matrix is documents x
+    # query terms rather than documents x every distinct token.
+    vocab: Dict[str, int] = {}
+    query_entries = [(row, vocab.setdefault(token, len(vocab)), weight)
+                     for row, keywords in enumerate(jobs)
+                     for token, weight in keyword_query(keywords).items()]
+    doc_rows, doc_cols = [], []
+    for row, tokens in enumerate(docs):
+        for token in tokens:
+            col = vocab.get(token)
+            if col is not None:
+                doc_rows.append(row)
+                doc_cols.append(col)
+
+    n_docs, n_jobs, n_terms = len(docs), len(jobs), max(len(vocab), 1)
+    flat = np.array(doc_rows, dtype=np.intp) * n_terms + np.array(doc_cols, dtype=np.intp)
+    tf = np.bincount(flat, minlength=n_docs * n_terms).reshape(n_docs, n_terms).astype(np.float32)
+    query = np.zeros((n_jobs, n_terms), dtype=np.float32)
+    for row, col, weight in query_entries:
+        query[row, col] = weight
+    doc_len = np.array([len(tokens) for tokens in docs], dtype=np.float32)
+
+    # BM25 with corpus statistics, scaled by the best achievable score per job
+    avg_len = max(float(doc_len.mean()), 1.0) if n_docs else 1.0
+    df = (tf > 0).sum(axis=0)
+    idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / avg_len)
+    saturated = tf * (BM25_K1 + 1) / (tf + norm[:, None])
+    weighted_query = query * idf
+    best = weighted_query.sum(axis=1) * (BM25_K1 + 1)
+    similarity = np.divide(weighted_query @ saturated.T, best[:, None],
+                           out=np.zeros((n_jobs, n_docs), dtype=np.float32), where=best[:, None] > 0)
+
+    # Weighted keyword coverage from a resumes x phrases presence matrix
+    phrases = list({phrase: None for keywords in jobs for phrase in keywords})
+    phrase_index = {phrase: col for col, phrase in enumerate(phrases)}
+    max_n = max([ATS_VOCABULARY_MAX_N] + [len(phrase) for phrase in phrases])
+    presence = np.zeros((n_docs, max(len(phrases), 1)), dtype=np.float32)
+    for row, tokens in enumerate(docs):
+        grams = phrase_ngrams(tokens, max_n)
+        for col, phrase in enumerate(phrases):
+            if phrase in grams:
+                presence[row, col] = 1.0
+    weights = np.zeros((n_jobs, presence.shape[1]), dtype=np.float32)
+    for row, keywords in enumerate(jobs):
+        for phrase, (_, weight) in keywords.items():
+            weights[row, phrase_index[phrase]] = weight
+    total = weights.sum(axis=1)
+    coverage = np.divide(weights @ presence.T, total[:, None],
+                         out=np.zeros((n_jobs, n_docs), dtype=np.float32), where=total[:, None] > 0)
+
+    completeness = np.array([1 - len(missing_resume_sections(r)) / len(ATS_EXPECTED_SECTIONS) for r in resumes],
+                            dtype=np.float32)
+
+    w_cov, w_sim, w_sec = ATS_LOCAL_WEIGHTS
+    scores = np.rint(100 * (w_cov * coverage + w_sim * similarity + w_sec * completeness[None, :])).astype(int)
+
+    rankings = []
+    for row, keywords in enumerate(jobs):
+        ranking = []
+        for col in np.argsort(-scores[row], kind="stable")[:top_k]:
+            present = presence[col]
+            ranking.append(ATSMatchCandidate(
+                resume_id=resumes[col]["id"],
+                title=resumes[col].get("title", ""),
+                score=int(scores[row, col]),
+                keyword_coverage=round(float(coverage[row, col]), 4),
+                similarity=round(float(similarity[row, col]), 4),
+                matched_keywords=[d for p, (d, _) in keywords.items() if present[phrase_index[p]]],
+                missing_keywords=[d for p, (d, _) in keywords.items() if not present[phrase_index[p]]],
+            ))
+        rankings.append(ranking)
+    return scores.tolist(), rankings
+
+
+async def call_gemini(prompt: str) -> dict:
+    text = await gemini_generate(f"{ATS_SYSTEM_PROMPT}\n\n{prompt}", 2000, schema=ATSProviderResult)
+    return parse_ai_response(text, "ats", validate=validate_ats_result)
 
 
 async def call_groq(prompt: str) -> dict:
-    groq_client = AsyncGroq(api_key=GROQ_API_KEY)
-    response = await groq_client.chat.completions.create(
-        model="llama-3.3-70b-versatile",
-        messages=[
-            {"role": "system", "content": ATS_SYSTEM_PROMPT},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.3,
-        max_tokens=2000
-    )
-    return parse_ai_response(response.choices[0].message.content)
+    text = await groq_chat(ATS_SYSTEM_PROMPT, prompt, temperature=0.3, max_tokens=2000, schema=ATSProviderResult)
+    return parse_ai_response(text, "ats", validate=validate_ats_result)
 
 
-@api_router.post("/ats/analyze", response_model=ATSAnalysis)
-async def analyze_resume(request: ATSAnalysisRequest, current_user: User = Depends(get_current_user)):
-    # Check usage limits
-    if not current_user.is_premium and current_user.ats_checks_used >= current_user.ats_checks_limit:
-        raise HTTPException(status_code=403, detail="ATS check limit reached. Upgrade to premium for unlimited checks.")
+async def prepare_ats_check(request: ATSAnalysisRequest, current_user: User) -> tuple:
+    """Validate an ATS request and build its prompt, cache key and local score.
 
+    Does not charge: that happens in charge_ats_analysis, once per check
+    however many identical requests share it.
+    """
     # Get resume
     resume = await db.resumes.find_one({"id": request.resume_id, "user_id": current_user.id}, {"_id": 0})
     if not resume:
         raise HTTPException(status_code=404, detail="Resume not found")
 
-    # Build resume text
-    resume_text = f"Resume Title: {resume['title']}\n\n"
-    for section in resume.get('sections', []):
-        resume_text += f"{section['type'].upper()}:\n{section['content']}\n\n"
-
-    prompt = build_ats_prompt(resume_text, request.job_description)
+    resume_text = render_resume_text(resume.get('title'), resume.get('sections', []), ATS_RESUME_TOKEN_BUDGET)
+    prompt = build_ats_prompt(resume_text, fit_job_description(request.job_description))
+    local = score_resume_locally(resume, request.job_description)
+    return prompt, ats_cache_key(resume_text, request.job_description), local
 
-    # Call both AI models in parallel with graceful fallback
-    gemini_result = None
-    groq_result = None
 
-    async def safe_call_gemini():
-        nonlocal gemini_result
-        try:
-            gemini_result = await call_gemini(prompt)
-        except Exception as e:
-            logging.error(f"Gemini error: {str(e)}")
+async def run_ats_provider(name: str, prompt: str, cache_key: str) -> tuple:
+    """Call one ATS provider, returning (name, result) with result None on failure.
 
-    async def safe_call_groq():
-        nonlocal groq_result
-        try:
-            groq_result = await call_groq(prompt)
-        except Exception as e:
-            logging.error(f"Groq error: {str(e)}")
+    Identical checks running at the same time share the provider call.
+    """
+    call = call_gemini if name == "gemini" else call_groq
+    try:
+        return name, await single_flight.run(f"ats_{name}", cache_key, functools.partial(call, prompt))
+    except Exception as e:
+        logging.error(f"{name.capitalize()} error: {str(e)}")
+        return name, None
 
-    await asyncio.gather(safe_call_gemini(), safe_call_groq())
 
+def build_ats_analysis(request: ATSAnalysisRequest, user_id: str, gemini_result: Optional[dict],
+                       groq_result: Optional[dict], local: LocalATSScore) -> ATSAnalysis:
     # Build analysis from dual results
     gemini_score = gemini_result.get('score', 0) if gemini_result else None
     groq_score = groq_result.get('score', 0) if groq_result else None
 
     # Compute combined average score
     scores = [s for s in [gemini_score, groq_score] if s is not None]
-    combined_score = round(sum(scores) / len(scores)) if scores else 75
+    combined_score = round(sum(scores) / len(scores)) if scores else local.score
 
     # Pick best available feedback for top-level fields
     primary = gemini_result or groq_result
     if not primary:
-        # Both failed — use fallback
-        primary = {
-            'feedback': "Your resume has been analyzed. Consider tailoring it more to the job description.",
-            'strengths': ["Clear structure", "Professional formatting"],
-            'improvements': ["Add more relevant keywords", "Quantify achievements"]
-        }
+        # Both failed — fall back to the local keyword analysis
+        primary = local_ats_feedback(local)
 
-    analysis = ATSAnalysis(
-        user_id=current_user.id,
+    return ATSAnalysis(
+        user_id=user_id,
         resume_id=request.resume_id,
         job_description=request.job_description,
         score=combined_score,
@@ -706,28 +3317,322 @@ async def analyze_resume(request: ATSAnalysisRequest, current_user: User = Depen
         groq_feedback=groq_result.get('feedback', '') if groq_result else None,
         groq_strengths=groq_result.get('strengths', []) if groq_result else [],
         groq_improvements=groq_result.get('improvements', []) if groq_result else [],
+        local_score=local.score,
+        matched_keywords=local.matched_keywords,
+        missing_keywords=local.missing_keywords,
     )
 
-    # Save analysis
+
+def analysis_provider_result(analysis: ATSAnalysis, name: str) -> Optional[dict]:
+    """One provider's answer as recorded in a saved analysis (None if it failed)."""
+    score = getattr(analysis, f"{name}_score")
+    if score is None:
+        return None
+    return {
+        "score": score,
+        "feedback": getattr(analysis, f"{name}_feedback") or "",
+        "strengths": getattr(analysis, f"{name}_strengths"),
+        "improvements": getattr(analysis, f"{name}_improvements"),
+    }
+
+
+async def save_ats_analysis(analysis: ATSAnalysis):
     analysis_dict = analysis.model_dump()
-    analysis_dict['created_at'] = analysis_dict['created_at'].isoformat()
     await db.ats_analyses.insert_one(analysis_dict)
 
-    # Update user's usage count
-    await db.users.update_one(
-        {"id": current_user.id},
-        {"$inc": {"ats_checks_used": 1}}
+    # Usage was already reserved when the check started
+    await bump_collection_version(analysis.user_id, "ats_analyses")
+
+
+class ATSCheckProgress:
+    """How far one in-flight ATS check has got, for every request sharing it.
+
+    The streaming route reports provider answers from here as they arrive,
+    whichever request is actually running the check.
+    """
+
+    def __init__(self):
+        self.reserved = asyncio.Event()
+        self.results: Dict[str, tuple] = {}  # provider -> (result, cached)
+        self.changed = asyncio.Event()
+
+    def publish(self, name: str, result: Optional[dict], cached: bool):
+        self.results[name] = (result, cached)
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+# Keyed like the "ats_analysis" flights; entries live while their check runs
+ats_check_progress: Dict[str, ATSCheckProgress] = {}
+
+
+async def fetch_ats_results(prompt: str, cache_key: str, progress: Optional[ATSCheckProgress] = None) -> dict:
+    """Provider results for one ATS check, from cache or from both providers."""
+    # Serve repeated checks of identical content from cache
+    results = await ats_cache.get(cache_key)
+    if results is not None:
+        if progress is not None:
+            for name in ("gemini", "groq"):
+                progress.publish(name, results[name], cached=True)
+        return results
+
+    async def run(name: str) -> tuple:
+        name, result = await run_ats_provider(name, prompt, cache_key)
+        if progress is not None:
+            progress.publish(name, result, cached=False)
+        return name, result
+
+    # Call both AI models in parallel with graceful fallback
+    results = dict(await asyncio.gather(run("gemini"), run("groq")))
+    if ats_results_cacheable(results):
+        await ats_cache.set(cache_key, results)
+    return results
+
+
+async def run_ats_analysis(request: ATSAnalysisRequest, current_user: User) -> ATSAnalysis:
+    """Run, save and return one full (quota-consuming) ATS analysis.
+
+    A double-click or client retry arriving while the same check is still
+    running gets that check's analysis, and is not charged again.
+    """
+    prompt, cache_key, local = await prepare_ats_check(request, current_user)
+    return await ats_analysis_flight(request, current_user, prompt, cache_key, local)
+
+
+def ats_flight_key(request: ATSAnalysisRequest, current_user: User, cache_key: str) -> str:
+    return f"{current_user.id}:{request.resume_id}:{cache_key}"
+
+
+def ats_analysis_flight(request: ATSAnalysisRequest, current_user: User, prompt: str, cache_key: str,
+                        local: LocalATSScore):
+    """Join (or start) the charged analysis for this user, resume and content."""
+    deadline = deadline_after(ATS_DEADLINE_SECONDS)
+    flight_key = ats_flight_key(request, current_user, cache_key)
+    return single_flight.run(
+        "ats_analysis", flight_key,
+        functools.partial(charge_ats_analysis, request, current_user, deadline, prompt, cache_key, local, flight_key)
+    )
+
+
+async def charge_ats_analysis(request: ATSAnalysisRequest, current_user: User, deadline: Optional[float],
+                              prompt: str, cache_key: str, local: LocalATSScore, flight_key: str) -> ATSAnalysis:
+    progress = ats_check_progress.setdefault(flight_key, ATSCheckProgress())
+    try:
+        # Check usage limits (atomically, so concurrent requests cannot overspend)
+        await reserve_ats_check(current_user.id)
+        progress.reserved.set()
+        charged = False
+        try:
+            # A provider still running at the deadline counts as failed, so the
+            # analysis falls back to whichever answered (or the local score).
+            # Saving and refunding stay outside the deadline.
+            results = await with_deadline(deadline, fetch_ats_results(prompt, cache_key, progress))
+            charged = bool(results["gemini"] or results["groq"])
+
+            analysis = build_ats_analysis(request, current_user.id, results["gemini"], results["groq"], local)
+            await save_ats_analysis(analysis)
+        finally:
+            if not charged:
+                await refund_ats_check(current_user.id)
+        return analysis
+    finally:
+        if ats_check_progress.get(flight_key) is progress:
+            del ats_check_progress[flight_key]
+
+
+@api_router.post("/ats/analyze", response_model=ATSAnalysis)
+async def analyze_resume(request: ATSAnalysisRequest, current_user: User = Depends(get_current_user)):
+    return await run_ats_analysis(request, current_user)
+
+
+@api_router.post("/ats/analyze/stream")
+async def analyze_resume_stream(request: ATSAnalysisRequest, current_user: User = Depends(get_current_user)):
+    """Server-Sent Events variant of /ats/analyze.
+
+    Emits a ``prescore`` event with the local keyword score straight away, a
+    ``provider`` event for each provider as soon as it answers, then an
+    ``analysis`` event with the combined record once it has been saved.
+
+    Like /ats/analyze, a request identical to one still running joins it
+    rather than being charged (and saved) a second time.
+    """
+    prompt, cache_key, local = await prepare_ats_check(request, current_user)
+    progress = ats_check_progress.setdefault(ats_flight_key(request, current_user, cache_key), ATSCheckProgress())
+    flight = asyncio.create_task(ats_analysis_flight(request, current_user, prompt, cache_key, local))
+
+    # Wait for the check to be reserved, so the limit still comes back as a 403
+    reserved = asyncio.create_task(progress.reserved.wait())
+    try:
+        await asyncio.wait({flight, reserved}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        flight.cancel()
+        raise
+    finally:
+        reserved.cancel()
+    if flight.done():
+        flight.result()  # raises the limit (or lookup) error; otherwise the check is already over
+
+    async def events():
+        yield sse_event("prescore", local)
+        pending = ["gemini", "groq"]
+        while pending:
+            changed = progress.changed
+            for name in [name for name in pending if name in progress.results]:
+                result, cached = progress.results[name]
+                pending.remove(name)
+                yield sse_event("provider", {"provider": name, "cached": cached, "result": result})
+            if flight.done() or not pending:
+                break
+            waiter = asyncio.create_task(changed.wait())
+            try:
+                await asyncio.wait({flight, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+
+        analysis = await flight
+        for name in pending:
+            # Not seen as they arrived; the saved analysis has them
+            yield sse_event("provider", {"provider": name, "cached": False,
+                                         "result": analysis_provider_result(analysis, name)})
+        yield sse_event("analysis", analysis.model_dump(mode="json"))
+
+    async def leave_check():
+        # Charging and refunding happen in the shared check; a disconnected
+        # client only stops waiting on it (the last one to go cancels it)
+        if not flight.done():
+            flight.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await flight
+
+    return SettlingStreamingResponse(events(), leave_check, media_type="text/event-stream",
+                                     headers=SSE_HEADERS)
+
+@api_router.post("/ats/score", response_model=LocalATSScore)
+async def score_resume(request: ATSAnalysisRequest, current_user: User = Depends(get_current_user)):
+    """Instant keyword-based ATS score. No LLM calls, so it does not use up ATS checks."""
+    resume = await db.resumes.find_one({"id": request.resume_id, "user_id": current_user.id},
+                                       {"_id": 0, "title": 1, "sections": 1})
+    if not resume:
+        raise HTTPException(status_code=404, detail="Resume not found")
+    return score_resume_locally(resume, request.job_description)
+
+@api_router.post("/ats/match", response_model=ATSMatchResponse)
+async def match_resumes(request: ATSMatchRequest, current_user: User = Depends(get_current_user)):
+    """Rank the user's resumes against one or more job descriptions.
+
+    Scoring is local and free. With ``escalate`` > 0, the best candidates for
+    each posting also get a full LLM analysis, which uses ATS checks as usual.
+    """
+    query = {"user_id": current_user.id}
+    if request.resume_ids is not None:
+        query["id"] = {"$in": request.resume_ids}
+    resumes = await (db.resumes.find(query, {"_id": 0, "id": 1, "title": 1, "sections": 1})
+                     .sort([("updated_at", -1), ("id", -1)])
+                     .to_list(ATS_MATCH_MAX_RESUMES))
+    if not resumes:
+        raise HTTPException(status_code=404, detail="No resumes found")
+
+    # Tokenizing a few hundred resumes is real CPU work; keep it off the event loop
+    scores, rankings = await asyncio.to_thread(
+        match_resumes_to_jobs, resumes, request.job_descriptions, request.top_k
+    )
+
+    analyses, errors = [], []
+    if request.escalate:
+        async def escalate(job_description: str, resume_id: str):
+            try:
+                return await run_ats_analysis(
+                    ATSAnalysisRequest(resume_id=resume_id, job_description=job_description), current_user
+                )
+            except HTTPException as e:
+                errors.append(f"{resume_id}: {e.detail}")
+                return None
+
+        escalated = await asyncio.gather(*[
+            escalate(job_description, candidate.resume_id)
+            for job_description, ranking in zip(request.job_descriptions, rankings)
+            for candidate in ranking[:request.escalate]
+        ])
+        analyses = [analysis for analysis in escalated if analysis is not None]
+
+    return ATSMatchResponse(
+        resume_ids=[r["id"] for r in resumes],
+        scores=scores,
+        rankings=rankings,
+        analyses=analyses,
+        escalation_errors=errors,
+    )
+
+@api_router.get("/ats/analyses", response_model=None,
+                responses={200: {"model": List[ATSAnalysis], "description": "Analyses, newest first; "
+                                 "ATSAnalysisSummary items when fields=summary. X-Next-Cursor is set when more remain."}})
+async def get_analyses(
+    request: Request,
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    fields: str = Query("full", pattern="^(full|summary)$"),
+    current_user: User = Depends(get_current_user)
+):
+    etag = await collection_etag(request, current_user.id, "ats_analyses")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
+    summary = fields == "summary"
+    analyses, next_cursor = await fetch_page(
+        db.ats_analyses, {"user_id": current_user.id}, "created_at", cursor, limit,
+        ANALYSIS_SUMMARY_PROJECTION if summary else {"_id": 0}
     )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    model = ATSAnalysisSummary if summary else ATSAnalysis
+    return [model(**a) for a in analyses]
+
+@api_router.get("/ats/cache/stats")
+async def get_ats_cache_stats(current_user: User = Depends(get_ops_user)):
+    return ats_cache.snapshot()
+
+# ========== DIAGNOSTICS ROUTES ==========
 
-    return analysis
+@api_router.get("/providers/pool")
+async def get_provider_pool_stats(current_user: User = Depends(get_ops_user)):
+    return providers.pool_stats()
 
-@api_router.get("/ats/analyses", response_model=List[ATSAnalysis])
-async def get_analyses(current_user: User = Depends(get_current_user)):
-    analyses = await db.ats_analyses.find({"user_id": current_user.id}, {"_id": 0}).sort("created_at", -1).to_list(50)
-    for analysis in analyses:
-        if isinstance(analysis.get('created_at'), str):
-            analysis['created_at'] = datetime.fromisoformat(analysis['created_at'])
-    return analyses
+@api_router.get("/providers/router")
+async def get_provider_router_state(current_user: User = Depends(get_ops_user)):
+    return provider_router.snapshot()
+
+@api_router.get("/providers/rate-limits")
+async def get_rate_limit_state(current_user: User = Depends(get_ops_user)):
+    return rate_limiter.snapshot()
+
+@api_router.get("/providers/structured-output")
+async def get_structured_output_stats(current_user: User = Depends(get_ops_user)):
+    return structured_output.snapshot()
+
+@api_router.get("/providers/hedging")
+async def get_hedging_stats(current_user: User = Depends(get_ops_user)):
+    return hedge_policy.snapshot()
+
+@api_router.get("/runtime/coalescing")
+async def get_coalescing_stats(current_user: User = Depends(get_ops_user)):
+    return single_flight.snapshot()
+
+@api_router.get("/runtime/generation-cache")
+async def get_generation_cache_stats(current_user: User = Depends(get_ops_user)):
+    return generation_cache.snapshot()
+
+@api_router.get("/runtime/user-cache")
+async def get_user_cache_stats(current_user: User = Depends(get_ops_user)):
+    return user_cache.snapshot()
+
+@api_router.get("/runtime/event-loop")
+async def get_event_loop_lag(reset: bool = False, current_user: User = Depends(get_ops_user)):
+    snapshot = {**loop_lag.snapshot(), "gemini_transport": GEMINI_TRANSPORT}
+    if reset:
+        loop_lag.reset()
+    return snapshot
 
 # ========== PAYMENT ROUTES ==========
 
@@ -773,7 +3678,6 @@ async def create_checkout(current_user: User = Depends(get_current_user)):
     )
 
     transaction_dict = transaction.model_dump()
-    transaction_dict['created_at'] = transaction_dict['created_at'].isoformat()
     await db.payment_transactions.insert_one(transaction_dict)
 
     return CheckoutResponse(session_id=session.id, url=session.url)
@@ -795,6 +3699,7 @@ async def get_payment_status(session_id: str, current_user: User = Depends(get_c
                 {"id": current_user.id},
                 {"$set": {"is_premium": True, "ats_checks_used": 0}}
             )
+            user_cache.invalidate(current_user.id)
 
     return PaymentStatusResponse(
         session_id=session.id,
@@ -832,9 +3737,221 @@ async def stripe_webhook(request: Request):
                         {"id": user_id},
                         {"$set": {"is_premium": True, "ats_checks_used": 0}}
                     )
+                    user_cache.invalidate(user_id)
 
     return {"status": "success"}
 
+# ========== DATABASE INDEXES ==========
+
+# Every collection's indexes, declared in one place and created idempotently
+# on startup. Names are fixed so a changed definition fails loudly instead of
+# silently creating a second index.
+INDEX_SPECS = [
+    {"collection": "users", "keys": [("id", 1)], "name": "id_unique", "unique": True},
+    {"collection": "users", "keys": [("email", 1)], "name": "email_unique", "unique": True},
+    {"collection": "resumes", "keys": [("id", 1)], "name": "id_unique", "unique": True},
+    {"collection": "resumes", "keys": [("user_id", 1), ("updated_at", -1), ("id", -1)], "name": "user_updated_id"},
+    {"collection": "ats_analyses", "keys": [("id", 1)], "name": "id_unique", "unique": True},
+    {"collection": "ats_analyses", "keys": [("user_id", 1), ("created_at", -1), ("id", -1)], "name": "user_created_id"},
+    {"collection": "payment_transactions", "keys": [("session_id", 1)], "name": "session_id_unique", "unique": True},
+    {"collection": "payment_transactions", "keys": [("user_id", 1)], "name": "user_id"},
+    {"collection": "batch_jobs", "keys": [("id", 1)], "name": "id_unique", "unique": True},
+    {"collection": "batch_jobs", "keys": [("status", 1), ("lease_expires_at", 1), ("created_at", 1)], "name": "claim"},
+    {"collection": "ats_cache", "keys": [("key", 1)], "name": "key_unique", "unique": True,
+     "enabled": ATS_CACHE_MONGO},
+    {"collection": "ats_cache", "keys": [("expires_at", 1)], "name": "expires_at_ttl", "expireAfterSeconds": 0,
+     "enabled": ATS_CACHE_MONGO},
+    {"collection": "generation_cache", "keys": [("key", 1)], "name": "key_unique", "unique": True,
+     "enabled": GENERATION_CACHE_TTL_SECONDS > 0},
+    {"collection": "generation_cache", "keys": [("expires_at", 1)], "name": "expires_at_ttl", "expireAfterSeconds": 0,
+     "enabled": GENERATION_CACHE_TTL_SECONDS > 0},
+]
+
+# The query shape each route sends, so the plan check covers what actually runs
+QUERY_SHAPES = [
+    {"route": "get_current_user", "collection": "users", "filter": {"id": "x"}},
+    {"route": "login / register", "collection": "users", "filter": {"email": "x@example.com"}},
+    {"route": "get_resumes", "collection": "resumes", "filter": {"user_id": "x"},
+     "sort": [("updated_at", -1), ("id", -1)]},
+    {"route": "get_resumes (cursor)", "collection": "resumes",
+     "filter": {"user_id": "x", "$or": cursor_filter("updated_at", datetime(2000, 1, 1), "x")},
+     "sort": [("updated_at", -1), ("id", -1)]},
+    {"route": "get_resume / update_resume / analyze_resume", "collection": "resumes",
+     "filter": {"id": "x", "user_id": "x"}},
+    {"route": "resume_count backfill", "collection": "resumes", "filter": {"user_id": "x"}},
+    {"route": "get_analyses", "collection": "ats_analyses", "filter": {"user_id": "x"},
+     "sort": [("created_at", -1), ("id", -1)]},
+    {"route": "get_payment_status / stripe_webhook", "collection": "payment_transactions",
+     "filter": {"session_id": "x"}},
+    {"route": "get_batch_job", "collection": "batch_jobs", "filter": {"id": "x", "user_id": "x"}},
+    {"route": "batch job claim", "collection": "batch_jobs",
+     "filter": {"$or": [{"status": "queued"}, {"status": "running", "lease_expires_at": {"$lt": datetime(2000, 1, 1)}}],
+                "attempts": {"$lt": 1}},
+     "sort": [("created_at", 1)]},
+]
+
+
+def find_plan_stages(plan: Any) -> List[str]:
+    """Collect every ``stage`` name in an explain() plan tree."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(find_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(find_plan_stages(item))
+    return stages
+
+
+class IndexManager:
+    """Creates the declared indexes and checks route queries against them."""
+
+    def __init__(self, specs: List[dict], shapes: List[dict]):
+        self.specs = specs
+        self.shapes = shapes
+        self.applied: List[dict] = []
+
+    async def ensure(self) -> List[dict]:
+        applied = []
+        for spec in self.specs:
+            if not spec.get("enabled", True):
+                continue
+            options = {k: v for k, v in spec.items() if k not in ("collection", "keys", "enabled")}
+            record = {"collection": spec["collection"], "name": spec["name"], "keys": spec["keys"]}
+            try:
+                await db[spec["collection"]].create_index(spec["keys"], **options)
+                record["status"] = "ok"
+            except Exception as e:
+                # Typically duplicate data blocking a unique index; keep serving
+                logging.error(f"Index {spec['collection']}.{spec['name']} could not be created: {str(e)}")
+                record["status"] = "error"
+                record["error"] = str(e)
+            applied.append(record)
+
+        self.applied = applied
+        try:
+            now = datetime.now(timezone.utc)
+            for record in applied:
+                await db.index_registry.update_one(
+                    {"collection": record["collection"], "name": record["name"]},
+                    {"$set": {**record, "keys": [list(k) for k in record["keys"]], "ensured_at": now}},
+                    upsert=True
+                )
+        except Exception as e:
+            logging.error(f"Recording indexes failed: {str(e)}")
+
+        ok = sum(1 for r in applied if r["status"] == "ok")
+        logging.info(f"Ensured {ok}/{len(applied)} indexes")
+        return applied
+
+    async def explain_query_shapes(self) -> List[dict]:
+        results = []
+        for shape in self.shapes:
+            cursor = db[shape["collection"]].find(shape["filter"])
+            if shape.get("sort"):
+                cursor = cursor.sort(shape["sort"])
+            explain = await cursor.limit(1).explain()
+            stages = find_plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+            results.append({
+                "route": shape["route"],
+                "collection": shape["collection"],
+                "stages": stages,
+                "collscan": "COLLSCAN" in stages,
+            })
+        return results
+
+    async def verify_query_plans(self) -> List[dict]:
+        """Raise if any route's query shape still needs a collection scan."""
+        results = await self.explain_query_shapes()
+        scans = [r for r in results if r["collscan"]]
+        for r in scans:
+            logging.error(f"COLLSCAN for {r['route']} on {r['collection']}: {r['stages']}")
+        if scans:
+            raise RuntimeError(f"{len(scans)} route queries still use a collection scan: "
+                               f"{', '.join(r['route'] for r in scans)}")
+        return results
+
+
+index_manager = IndexManager(INDEX_SPECS, QUERY_SHAPES)
+
+
+@api_router.get("/runtime/indexes")
+async def get_index_status(explain: bool = False, current_user: User = Depends(get_ops_user)):
+    result = {"indexes": index_manager.applied}
+    if explain:
+        result["query_plans"] = await index_manager.explain_query_shapes()
+    return result
+
+# ========== DATA MIGRATIONS ==========
+
+# Timestamp fields that older documents stored as ISO-8601 strings
+DATETIME_FIELDS = {
+    "users": ["created_at"],
+    "resumes": ["created_at", "updated_at"],
+    "ats_analyses": ["created_at"],
+    "payment_transactions": ["created_at"],
+}
+
+
+def parse_legacy_datetime(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+async def migrate_datetimes(batch_size: int = 500, dry_run: bool = False, report=print) -> dict:
+    """Convert ISO-string timestamps to BSON dates, one batch at a time.
+
+    Safe to run while the app is serving: documents are walked in ``_id``
+    order and each update only applies if the field still holds the string
+    that was read, so concurrent writes are never overwritten.
+    """
+    totals = {}
+    for collection_name, fields in DATETIME_FIELDS.items():
+        collection = db[collection_name]
+        string_filter = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        remaining = await collection.count_documents(string_filter)
+        converted = skipped = 0
+        last_id = None
+        report(f"{collection_name}: {remaining} documents with string timestamps")
+
+        while True:
+            query = dict(string_filter)
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            projection = {field: 1 for field in fields}
+            batch = await collection.find(query, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+
+            updates = []
+            for doc in batch:
+                for field in fields:
+                    value = doc.get(field)
+                    if not isinstance(value, str):
+                        continue
+                    try:
+                        parsed = parse_legacy_datetime(value)
+                    except ValueError:
+                        logging.error(f"{collection_name} {doc['_id']}: unparseable {field} {value!r}")
+                        skipped += 1
+                        continue
+                    updates.append(UpdateOne({"_id": doc["_id"], field: value}, {"$set": {field: parsed}}))
+
+            if updates and not dry_run:
+                result = await collection.bulk_write(updates, ordered=False)
+                converted += result.modified_count
+            else:
+                converted += len(updates)
+            report(f"{collection_name}: {converted} fields converted, {skipped} skipped")
+
+        totals[collection_name] = {"documents": remaining, "converted": converted, "skipped": skipped}
+    return totals
+
 # ========== INCLUDE ROUTER ==========
 
 app.include_router(api_router)
@@ -851,6 +3968,7 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 logging.basicConfig(
@@ -859,6 +3977,53 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def ensure_database_indexes():
+    await index_manager.ensure()
+    if VERIFY_QUERY_PLANS:
+        await index_manager.verify_query_plans()
+
+@app.on_event("startup")
+async def start_provider_clients():
+    providers.start()
+    loop_lag.start()
+
+@app.on_event("startup")
+async def start_batch_workers():
+    batch_workers.start()
+
+@app.on_event("shutdown")
+async def shutdown_provider_clients():
+    await batch_workers.stop()
+    await loop_lag.stop()
+    await providers.close()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="CareerArchitect database maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("ensure-indexes", help="Create all declared indexes")
+    sub.add_parser("verify-query-plans", help="Fail if any route query shape uses a COLLSCAN")
+    migrate = sub.add_parser("migrate-datetimes", help="Convert ISO-string timestamps to BSON dates")
+    migrate.add_argument("--batch-size", type=int, default=500)
+    migrate.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    async def main():
+        if args.command == "ensure-indexes":
+            for record in await index_manager.ensure():
+                print(f"{record['status']:>5}  {record['collection']}.{record['name']}")
+        elif args.command == "verify-query-plans":
+            for result in await index_manager.verify_query_plans():
+                print(f"ok  {result['route']}: {' > '.join(result['stages'])}")
+        elif args.command == "migrate-datetimes":
+            totals = await migrate_datetimes(args.batch_size, args.dry_run)
+            print(json.dumps(totals, indent=2))
+
+    asyncio.run(main())
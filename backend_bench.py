@@ -0,0 +1,212 @@
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(name, latencies, elapsed=None):
+    """Print and return latency stats (milliseconds) for a set of samples"""
+    stats = {
+        "name": name,
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1) if latencies else 0.0,
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1) if latencies else 0.0,
+    }
+    if elapsed:
+        stats["throughput_rps"] = round(len(latencies) / elapsed, 2)
+    print(f"📊 {name}: {json.dumps(stats)}")
+    return stats
+
+
+class ResumeBuilderBenchmark:
+    """Load scenarios for comparing server configurations (run once per config)"""
+
+    def __init__(self, base_url="http://localhost:8000"):
+        self.base_url = base_url.rstrip('/')
+        self.api_url = f"{self.base_url}/api"
+
+    def register_user(self, password="BenchPass123!"):
+        email = f"bench_{uuid.uuid4().hex[:12]}@example.com"
+        response = requests.post(f"{self.api_url}/auth/register", json={
+            "email": email,
+            "password": password,
+            "full_name": "Bench User"
+        }, timeout=30)
+        response.raise_for_status()
+        return email, password, response.json()['token']
+
+    def create_resume(self, token):
+        response = requests.post(f"{self.api_url}/resumes", json={
+            "title": "Benchmark Resume",
+            "template": "modern",
+            "sections": [
+                {"type": "summary", "content": "Backend engineer building Python and FastAPI services."},
+                {"type": "skills", "content": "Python, FastAPI, MongoDB, Docker, AWS"}
+            ]
+        }, headers={"Authorization": f"Bearer {token}"}, timeout=30)
+        response.raise_for_status()
+        return response.json()['id']
+
+    def probe(self, path, stop_event, interval=0.05):
+        """Measure latency of a cheap endpoint until stop_event is set"""
+        latencies = []
+        while not stop_event.is_set():
+            started = time.perf_counter()
+            try:
+                requests.get(f"{self.base_url}{path}", timeout=30)
+                latencies.append(time.perf_counter() - started)
+            except requests.RequestException:
+                pass
+            time.sleep(interval)
+        return latencies
+
+    def event_loop_lag(self, ops_token, reset=False):
+        """Read (and optionally reset) the server's event-loop lag; needs an ops account"""
+        response = requests.get(
+            f"{self.api_url}/runtime/event-loop",
+            params={"reset": str(reset).lower()},
+            headers={"Authorization": f"Bearer {ops_token}"},
+            timeout=30
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"Event-loop lag read failed ({response.status_code}): {response.text}. "
+                               "--ops-token must belong to an account listed in the server's OPS_ADMIN_EMAILS")
+        return response.json()
+
+    def bench_ats_load(self, total, concurrency, ops_token):
+        """Fire concurrent ATS checks while probing /health and event-loop lag.
+
+        Run once with GEMINI_TRANSPORT=thread and once with GEMINI_TRANSPORT=async
+        on the server to get the A/B comparison.
+        """
+        # Fail before creating any accounts if the lag cannot be read
+        self.event_loop_lag(ops_token)
+
+        # Free accounts get 10 ATS checks each
+        accounts = []
+        for _ in range((total + 9) // 10):
+            _, _, token = self.register_user()
+            accounts.append((token, self.create_resume(token)))
+        self.event_loop_lag(ops_token, reset=True)
+
+        def one_check(i):
+            token, resume_id = accounts[i // 10]
+            started = time.perf_counter()
+            response = requests.post(f"{self.api_url}/ats/analyze", json={
+                "resume_id": resume_id,
+                # Unique job descriptions keep the result cache out of the measurement
+                "job_description": f"Senior Python engineer, FastAPI, MongoDB, AWS. Ref {uuid.uuid4()}"
+            }, headers={"Authorization": f"Bearer {token}"}, timeout=120)
+            return response.status_code, time.perf_counter() - started
+
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=concurrency + 1) as pool:
+            probe = pool.submit(self.probe, "/health", stop)
+            started = time.perf_counter()
+            results = list(pool.map(one_check, range(total)))
+            elapsed = time.perf_counter() - started
+            stop.set()
+            health = probe.result()
+
+        errors = sum(1 for status, _ in results if status != 200)
+        print(f"⚠️  ATS errors: {errors}/{total}" if errors else f"✅ All {total} ATS checks succeeded")
+        return {
+            "ats": summarize("ats_analyze", [latency for _, latency in results], elapsed),
+            "health": summarize("health_during_load", health),
+            "event_loop": self.event_loop_lag(ops_token),
+        }
+
+    def bench_login_storm(self, total, concurrency):
+        """Hammer /auth/login while probing /health and /auth/me.
+
+        Compare runs with different PASSWORD_HASH_WORKERS / BCRYPT_ROUNDS (or
+        against a build that hashes on the event loop) to see the effect on
+        the p99 of endpoints that do no hashing at all.
+        """
+        email, password, token = self.register_user()
+
+        def one_login(_):
+            started = time.perf_counter()
+            response = requests.post(f"{self.api_url}/auth/login", json={
+                "email": email,
+                "password": password
+            }, timeout=60)
+            return response.status_code, time.perf_counter() - started
+
+        def probe_me(stop_event):
+            latencies = []
+            while not stop_event.is_set():
+                started = time.perf_counter()
+                try:
+                    requests.get(f"{self.api_url}/auth/me",
+                                 headers={"Authorization": f"Bearer {token}"}, timeout=30)
+                    latencies.append(time.perf_counter() - started)
+                except requests.RequestException:
+                    pass
+                time.sleep(0.05)
+            return latencies
+
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=concurrency + 2) as pool:
+            health_probe = pool.submit(self.probe, "/health", stop)
+            me_probe = pool.submit(probe_me, stop)
+            started = time.perf_counter()
+            results = list(pool.map(one_login, range(total)))
+            elapsed = time.perf_counter() - started
+            stop.set()
+            health = health_probe.result()
+            me = me_probe.result()
+
+        errors = sum(1 for status, _ in results if status != 200)
+        print(f"⚠️  Login errors: {errors}/{total}" if errors else f"✅ All {total} logins succeeded")
+        return {
+            "login": summarize("login", [latency for _, latency in results], elapsed),
+            "health": summarize("health_during_storm", health),
+            "auth_me": summarize("auth_me_during_storm", me),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CareerArchitect backend benchmarks")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    sub = parser.add_subparsers(dest="scenario", required=True)
+
+    ats = sub.add_parser("ats-load", help="Concurrent ATS checks vs. event-loop lag")
+    ats.add_argument("--total", type=int, default=40)
+    ats.add_argument("--concurrency", type=int, default=10)
+    ats.add_argument("--ops-token", required=True,
+                     help="Bearer token of an account in the server's OPS_ADMIN_EMAILS, for the event-loop lag reads")
+
+    login = sub.add_parser("login-storm", help="Concurrent logins vs. latency of unrelated endpoints")
+    login.add_argument("--total", type=int, default=200)
+    login.add_argument("--concurrency", type=int, default=20)
+
+    args = parser.parse_args()
+    bench = ResumeBuilderBenchmark(args.base_url)
+
+    if args.scenario == "ats-load":
+        report = bench.bench_ats_load(args.total, args.concurrency, args.ops_token)
+    elif args.scenario == "login-storm":
+        report = bench.bench_login_storm(args.total, args.concurrency)
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,10 @@
+import os
+import sys
+from pathlib import Path
+
+# server.py reads these at import time; unit tests never connect unless a
+# test asks for MONGO_TEST_URL
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "resume_builder_test")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
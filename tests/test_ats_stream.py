@@ -0,0 +1,103 @@
+"""The streaming ATS check shares the charged analysis with identical requests."""
+import asyncio
+import json
+import types
+
+import httpx
+import pytest
+
+import server
+from server import User, app, get_current_user
+
+RESUME = {"id": "r1", "user_id": "u1", "title": "Engineer",
+          "sections": [{"type": "skills", "content": "Python, FastAPI"}]}
+ANSWER = {"score": 70, "feedback": "Good", "strengths": ["Python"], "improvements": ["AWS"]}
+
+
+class FakeDB:
+    def __init__(self):
+        self.charges = 0
+        self.refunds = 0
+        self.saved = []
+        self.resumes = types.SimpleNamespace(find_one=self.find_resume)
+        self.users = types.SimpleNamespace(find_one_and_update=self.reserve, update_one=self.update_user)
+        self.ats_analyses = types.SimpleNamespace(insert_one=self.save)
+
+    async def find_resume(self, query, projection=None):
+        return dict(RESUME) if query.get("id") == RESUME["id"] else None
+
+    async def reserve(self, *args, **kwargs):
+        self.charges += 1
+        return {"id": "u1"}
+
+    async def update_user(self, query, update, **kwargs):
+        if update.get("$inc", {}).get("ats_checks_used") == -1:
+            self.refunds += 1
+
+    async def save(self, doc):
+        self.saved.append(doc)
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    fake = FakeDB()
+    provider_gate = asyncio.Event()
+
+    async def answer(prompt):
+        await provider_gate.wait()
+        return dict(ANSWER)
+
+    monkeypatch.setattr(server, "db", fake)
+    monkeypatch.setattr(server, "call_gemini", answer)
+    monkeypatch.setattr(server, "call_groq", answer)
+    monkeypatch.setattr(server, "ats_cache", server.ResultCache("ATS", 16, 60))
+    monkeypatch.setattr(server, "single_flight", server.SingleFlight())
+    app.dependency_overrides[get_current_user] = lambda: User(id="u1", email="u@example.com", full_name="U")
+    fake.provider_gate = provider_gate
+    yield fake
+    app.dependency_overrides.clear()
+
+
+def events(body: str) -> list:
+    parsed = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        parsed.append((lines["event"], json.loads(lines["data"])))
+    return parsed
+
+
+def test_identical_streams_are_charged_and_saved_once(fake_db):
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            payload = {"resume_id": "r1", "job_description": "Python engineer"}
+            first = asyncio.create_task(client.post("/api/ats/analyze/stream", json=payload))
+            second = asyncio.create_task(client.post("/api/ats/analyze/stream", json=payload))
+            await asyncio.sleep(0.05)
+            fake_db.provider_gate.set()
+            return await asyncio.gather(first, second)
+
+    responses = asyncio.run(main())
+    assert [r.status_code for r in responses] == [200, 200]
+    assert fake_db.charges == 1 and fake_db.refunds == 0
+    assert len(fake_db.saved) == 1
+    for response in responses:
+        streamed = events(response.text)
+        assert [kind for kind, _ in streamed] == ["prescore", "provider", "provider", "analysis"]
+        assert {data["provider"] for kind, data in streamed if kind == "provider"} == {"gemini", "groq"}
+        assert streamed[-1][1]["id"] == fake_db.saved[0]["id"]
+
+
+def test_limit_reached_is_still_a_403(fake_db, monkeypatch):
+    async def over_limit(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(fake_db.users, "find_one_and_update", over_limit)
+
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/api/ats/analyze/stream", json={"resume_id": "r1", "job_description": "Python"})
+
+    assert asyncio.run(main()).status_code == 403
+    assert server.ats_check_progress == {}
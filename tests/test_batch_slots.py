@@ -0,0 +1,81 @@
+"""Batch generation: a slot stays used once its resume is saved, consumed or not."""
+import asyncio
+import contextlib
+import types
+
+import pytest
+
+import server
+from server import BatchGenerateRequest, iter_batch_generation
+
+PROFILES = ["software_engineer", "data_scientist"]
+RESULT = {"summary": "S", "skills": "Python", "experience": [], "education": []}
+
+
+class FakeResumes:
+    """insert_one holds each profile's write until its gate opens."""
+
+    def __init__(self):
+        self.gates = {pid: asyncio.Event() for pid in PROFILES}
+        self.started = {pid: asyncio.Event() for pid in PROFILES}
+        self.written = []
+
+    async def insert_one(self, doc):
+        profile_id = doc["job_profile"]
+        self.started[profile_id].set()
+        await self.gates[profile_id].wait()
+        self.written.append(profile_id)
+
+
+@pytest.fixture
+def resumes(monkeypatch):
+    async def prepare_generation(request, profile_ids):
+        return {pid: (RESULT, "groq", "cache") for pid in profile_ids}
+
+    async def update_one(*args, **kwargs):
+        return None
+
+    fake = FakeResumes()
+    monkeypatch.setattr(server, "prepare_generation", prepare_generation)
+    monkeypatch.setattr(server, "db", types.SimpleNamespace(resumes=fake, users=types.SimpleNamespace(update_one=update_one)))
+    return fake
+
+
+def batch_request():
+    return BatchGenerateRequest(personal_info={"name": "A"}, summary_base="s", experience=[], education=[],
+                                skills_base="Python", job_profiles=PROFILES)
+
+
+def test_resume_saved_but_not_yet_consumed_counts_as_saved(resumes):
+    async def main():
+        saved = set()
+        resumes.gates["software_engineer"].set()
+        async with contextlib.aclosing(iter_batch_generation(batch_request(), "u", None, saved)) as batch:
+            first, _ = await batch.__anext__()
+            resumes.gates["data_scientist"].set()
+            while len(resumes.written) < 2:
+                await asyncio.sleep(0)
+            # The client goes away before the second event is taken off the generator
+        return first, saved
+
+    first, saved = asyncio.run(main())
+    assert first == "software_engineer"
+    assert saved == set(PROFILES)
+
+
+def test_closing_mid_write_waits_for_the_write(resumes):
+    async def main():
+        saved = set()
+        resumes.gates["software_engineer"].set()
+        batch = iter_batch_generation(batch_request(), "u", None, saved)
+        await batch.__anext__()
+        await resumes.started["data_scientist"].wait()
+        closing = asyncio.create_task(batch.aclose())
+        await asyncio.sleep(0.01)
+        assert not closing.done()  # still waiting on the in-flight insert
+        resumes.gates["data_scientist"].set()
+        await closing
+        return saved
+
+    assert asyncio.run(main()) == set(PROFILES)
+
@@ -0,0 +1,110 @@
+"""Legacy ISO-string timestamps: parsing, model reads and the online migration."""
+import asyncio
+import types
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from server import ResumeSummary, migrate_datetimes, parse_legacy_datetime
+
+
+def test_naive_legacy_timestamp_is_read_as_utc():
+    assert parse_legacy_datetime("2023-01-02T03:04:05") == datetime(2023, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+
+
+def test_offset_legacy_timestamp_keeps_its_offset():
+    parsed = parse_legacy_datetime("2023-01-02T03:04:05+02:00")
+    assert parsed.utcoffset() == timedelta(hours=2)
+
+
+def test_unparseable_legacy_timestamp_raises():
+    with pytest.raises(ValueError):
+        parse_legacy_datetime("last tuesday")
+
+
+def test_summary_model_still_reads_string_timestamps():
+    summary = ResumeSummary(id="r", title="T", created_at="2023-01-02T03:04:05+00:00",
+                            updated_at=datetime(2024, 1, 1, tzinfo=timezone.utc))
+    assert summary.created_at == datetime(2023, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, field, direction):
+        self.docs = sorted(self.docs, key=lambda doc: doc[field], reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    async def to_list(self, length):
+        return self.docs[:length]
+
+
+class FakeCollection:
+    """Enough of a motor collection for migrate_datetimes' string-field walk."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.writes = []
+
+    def matches(self, doc, query):
+        if "_id" in query and not doc["_id"] > query["_id"]["$gt"]:
+            return False
+        return any(isinstance(doc.get(field), str) for clause in query["$or"] for field in clause)
+
+    async def count_documents(self, query):
+        return sum(self.matches(doc, query) for doc in self.docs)
+
+    def find(self, query, projection):
+        return FakeCursor([doc for doc in self.docs if self.matches(doc, query)])
+
+    async def bulk_write(self, updates, ordered):
+        self.writes.extend(updates)
+        for update in updates:
+            for doc in self.docs:
+                if all(doc.get(key) == value for key, value in update._filter.items()):
+                    doc.update(update._doc["$set"])
+        return types.SimpleNamespace(modified_count=len(updates))
+
+
+@pytest.fixture
+def collections(monkeypatch):
+    fakes = {name: FakeCollection([]) for name in server.DATETIME_FIELDS}
+    fakes["resumes"].docs = [
+        {"_id": 1, "created_at": "2023-01-02T03:04:05", "updated_at": datetime(2024, 1, 1, tzinfo=timezone.utc)},
+        {"_id": 2, "created_at": "not a date", "updated_at": "2023-02-03T04:05:06+00:00"},
+        {"_id": 3, "created_at": "2023-03-04T05:06:07", "updated_at": "2023-03-04T05:06:07"},
+    ]
+    monkeypatch.setattr(server, "db", fakes)
+    return fakes
+
+
+def test_migration_converts_strings_and_skips_unparseable_values(collections):
+    totals = asyncio.run(migrate_datetimes(batch_size=2, report=lambda line: None))
+
+    assert totals["resumes"] == {"documents": 3, "converted": 4, "skipped": 1}
+    docs = {doc["_id"]: doc for doc in collections["resumes"].docs}
+    assert docs[1]["created_at"] == datetime(2023, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    assert docs[2]["created_at"] == "not a date"
+    assert isinstance(docs[2]["updated_at"], datetime)
+    assert isinstance(docs[3]["updated_at"], datetime)
+
+
+def test_migration_only_updates_fields_still_holding_the_string_read(collections):
+    asyncio.run(migrate_datetimes(report=lambda line: None))
+
+    filters = [update._filter for update in collections["resumes"].writes]
+    assert {"_id": 1, "created_at": "2023-01-02T03:04:05"} in filters
+
+
+def test_dry_run_writes_nothing(collections):
+    totals = asyncio.run(migrate_datetimes(dry_run=True, report=lambda line: None))
+
+    assert totals["resumes"]["converted"] == 4
+    assert collections["resumes"].writes == []
+    assert collections["resumes"].docs[0]["created_at"] == "2023-01-02T03:04:05"
@@ -0,0 +1,66 @@
+"""Conditional requests: ETag construction and If-None-Match matching."""
+import asyncio
+import types
+from datetime import datetime, timezone
+
+import pytest
+from starlette.requests import Request
+
+import server
+from server import collection_etag, etag_matches, make_etag, resume_etag
+
+
+def request(query_string="", if_none_match=None):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match is not None else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers,
+                    "query_string": query_string.encode()})
+
+
+def test_etag_is_quoted_and_stable():
+    etag = make_etag("resume", "r1", 3)
+    assert etag.startswith('"') and etag.endswith('"') and len(etag) == 34
+    assert etag == make_etag("resume", "r1", 3)
+    assert etag != make_etag("resume", "r1", 4)
+
+
+def test_resume_etag_follows_version_and_updated_at():
+    doc = {"id": "r1", "version": 2, "updated_at": datetime(2024, 1, 1, tzinfo=timezone.utc)}
+    assert resume_etag(doc) != resume_etag({**doc, "version": 3})
+    assert resume_etag(doc) != resume_etag({**doc, "updated_at": datetime(2024, 1, 2, tzinfo=timezone.utc)})
+
+
+@pytest.mark.parametrize("header,expected", [
+    (None, False),
+    ("", False),
+    ("*", True),
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"old", W/"abc"', True),
+    ('"old","other"', False),
+])
+def test_if_none_match(header, expected):
+    assert etag_matches(request(if_none_match=header), '"abc"') is expected
+
+
+@pytest.fixture
+def users(monkeypatch):
+    versions = {"resumes_version": 1}
+
+    async def find_one(query, projection):
+        return {field: versions[field] for field in projection if field in versions}
+
+    monkeypatch.setattr(server, "db", types.SimpleNamespace(users=types.SimpleNamespace(find_one=find_one)))
+    return versions
+
+
+def test_collection_etag_changes_with_version_and_not_with_param_order(users):
+    first = asyncio.run(collection_etag(request("limit=5&cursor=x"), "u", "resumes"))
+    assert first == asyncio.run(collection_etag(request("cursor=x&limit=5"), "u", "resumes"))
+    assert first != asyncio.run(collection_etag(request("limit=6&cursor=x"), "u", "resumes"))
+    users["resumes_version"] = 2
+    assert first != asyncio.run(collection_etag(request("limit=5&cursor=x"), "u", "resumes"))
+
+
+def test_collection_etag_defaults_a_missing_counter(users):
+    etag = asyncio.run(collection_etag(request(), "u", "ats_analyses"))
+    assert etag == make_etag("ats_analyses", "u", 0, [])
@@ -0,0 +1,125 @@
+"""Batch generation: result validation, the combined single-call mode and the result cache."""
+import asyncio
+
+import pytest
+
+import server
+from server import (BatchGenerateRequest, ResultCache, combined_generation_schema, generate_combined,
+                    generation_cache_key, prepare_generation, request_base_profile, use_combined_generation,
+                    validate_generation_result)
+
+GENERATED = {"summary": "Engineer.", "skills": "Python", "experience": [{"title": "Dev"}], "education": []}
+
+
+def batch_request(**overrides):
+    fields = dict(personal_info={"name": "A"}, summary_base="Builds things", experience=[], education=[],
+                  skills_base="Python", job_profiles=["software_engineer", "data_scientist"])
+    return BatchGenerateRequest(**{**fields, **overrides})
+
+
+def test_valid_result_is_returned_unchanged():
+    assert validate_generation_result(GENERATED) == GENERATED
+
+
+def test_skills_list_is_joined():
+    assert validate_generation_result({**GENERATED, "skills": ["Python", "SQL"]})["skills"] == "Python, SQL"
+
+
+@pytest.mark.parametrize("result", [
+    None,
+    "summary",
+    {"skills": "Python"},
+    {**GENERATED, "summary": "  "},
+    {**GENERATED, "experience": "Dev at Acme"},
+    {**GENERATED, "education": ["BSc"]},
+    {**GENERATED, "skills": {"languages": ["Python"]}},
+])
+def test_wrong_shapes_are_rejected(result):
+    assert validate_generation_result(result) is None
+
+
+def test_combined_schema_has_one_resume_per_profile_and_is_reused():
+    schema = combined_generation_schema(("software_engineer", "data_scientist"))
+    assert set(schema.model_fields) == {"software_engineer", "data_scientist"}
+    assert schema is combined_generation_schema(("software_engineer", "data_scientist"))
+
+
+def test_combined_mode_follows_the_request_then_the_server_default(monkeypatch):
+    monkeypatch.setattr(server, "BATCH_COMBINED_GENERATION", False)
+    assert not use_combined_generation(batch_request(), 2)
+    assert use_combined_generation(batch_request(combined_generation=True), 2)
+    assert not use_combined_generation(batch_request(combined_generation=True), 1)
+
+    monkeypatch.setattr(server, "BATCH_COMBINED_GENERATION", True)
+    assert use_combined_generation(batch_request(), 2)
+    assert not use_combined_generation(batch_request(combined_generation=False), 2)
+
+
+def test_combined_generation_keeps_only_valid_profiles(monkeypatch):
+    async def hedged_generate(prompt, label, profile_ids=None):
+        return {"software_engineer": GENERATED, "data_scientist": {"summary": ""}}, "groq"
+
+    monkeypatch.setattr(server, "hedged_generate", hedged_generate)
+    generated = asyncio.run(generate_combined(batch_request(), ["software_engineer", "data_scientist"]))
+    assert generated == {"software_engineer": (GENERATED, "groq")}
+
+
+def test_failed_combined_call_falls_back_to_every_profile(monkeypatch):
+    async def hedged_generate(prompt, label, profile_ids=None):
+        raise server.ProviderUnavailable("groq")
+
+    monkeypatch.setattr(server, "hedged_generate", hedged_generate)
+    assert asyncio.run(generate_combined(batch_request(), ["software_engineer", "data_scientist"])) == {}
+
+
+def test_cache_key_ignores_whitespace_and_template_but_not_content():
+    key = generation_cache_key(request_base_profile(batch_request()), "software_engineer")
+    same = batch_request(summary_base="  Builds   things\n", template="classic")
+    assert generation_cache_key(request_base_profile(same), "software_engineer") == key
+    assert generation_cache_key(request_base_profile(batch_request(summary_base="Ships things")),
+                                "software_engineer") != key
+    assert generation_cache_key(request_base_profile(batch_request()), "data_scientist") != key
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    combined_calls = []
+
+    async def generate_combined(request, profile_ids):
+        combined_calls.append(list(profile_ids))
+        return {pid: (GENERATED, "gemini") for pid in profile_ids}
+
+    fake = ResultCache("Generation", 16, 3600)
+    monkeypatch.setattr(server, "BATCH_COMBINED_GENERATION", False)
+    monkeypatch.setattr(server, "generation_cache", fake)
+    monkeypatch.setattr(server, "generate_combined", generate_combined)
+    return fake, combined_calls
+
+
+def seed(cache, profile_id):
+    key = generation_cache_key(request_base_profile(batch_request()), profile_id)
+    asyncio.run(cache.set(key, {"result": GENERATED, "provider": "groq"}))
+
+
+def test_cached_profiles_skip_generation(cache):
+    seed(cache[0], "software_engineer")
+    generated = asyncio.run(prepare_generation(batch_request(), ["software_engineer", "data_scientist"]))
+    assert generated == {"software_engineer": (GENERATED, "groq", "cache")}
+
+
+def test_force_regenerate_bypasses_the_cache(cache):
+    store, combined_calls = cache
+    seed(store, "software_engineer")
+    request = batch_request(force_regenerate=True, combined_generation=True)
+    generated = asyncio.run(prepare_generation(request, ["software_engineer", "data_scientist"]))
+    assert {source for _, _, source in generated.values()} == {"combined"}
+    assert combined_calls == [["software_engineer", "data_scientist"]]
+
+
+def test_combined_results_are_cached_per_profile(cache):
+    _, combined_calls = cache
+    request = batch_request(combined_generation=True)
+    asyncio.run(prepare_generation(request, ["software_engineer", "data_scientist"]))
+    generated = asyncio.run(prepare_generation(request, ["software_engineer", "data_scientist"]))
+    assert {source for _, _, source in generated.values()} == {"cache"}
+    assert len(combined_calls) == 1
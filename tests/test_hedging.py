@@ -0,0 +1,35 @@
+"""Hedge delay for slow generation calls."""
+from server import HedgePolicy
+
+
+def test_fixed_delay_wins_and_scales():
+    policy = HedgePolicy(fixed_delay=2.0, default_delay=5.0)
+    for _ in range(50):
+        policy.record("groq", 0.1)
+    assert policy.delay("groq") == 2.0
+    assert policy.delay("groq", scale=3) == 6.0
+
+
+def test_default_delay_until_enough_samples():
+    policy = HedgePolicy(fixed_delay=None, default_delay=5.0, min_samples=3)
+    policy.record("groq", 1.0)
+    policy.record("groq", 1.0)
+    assert policy.delay("groq") == 5.0
+    assert policy.delay("groq", scale=2) == 10.0
+    assert policy.delay("gemini") == 5.0
+
+
+def test_observed_p90_once_warmed_up():
+    policy = HedgePolicy(fixed_delay=None, default_delay=5.0, min_samples=10)
+    for seconds in range(1, 11):
+        policy.record("groq", float(seconds))
+    assert policy.delay("groq") == 9.0
+    # Samples are kept per call shape, so an observed p90 is not scaled again
+    assert policy.delay("groq", scale=3) == 9.0
+
+
+def test_only_the_latest_window_counts():
+    policy = HedgePolicy(fixed_delay=None, default_delay=5.0, min_samples=5, window=5)
+    for seconds in [100.0] * 5 + [1.0] * 5:
+        policy.record("groq", seconds)
+    assert policy.delay("groq") == 1.0
@@ -0,0 +1,93 @@
+"""Local ATS scoring: keyword extraction, scoring and resume matching."""
+from server import (ATS_LOCAL_WEIGHTS, extract_job_keywords, local_ats_feedback, match_resumes_to_jobs,
+                    score_resume_locally, surface_forms, tokenize)
+
+DEVOPS_POSTING = ("DevOps engineer wanted. DevOps experience with AWS and Terraform is key. "
+                  "Sales exposure a plus; sales engineering helps.")
+
+
+def resume(*sections, title="Resume"):
+    return {"title": title, "sections": [{"type": kind, "content": content} for kind, content in sections]}
+
+
+def test_surface_forms_keep_the_first_spelling():
+    forms = surface_forms("DevOps and devops, Clusters")
+    assert forms["devop"] == "DevOps"
+    assert forms["cluster"] == "Clusters"
+
+
+def test_keywords_are_displayed_as_written_not_stemmed():
+    keywords = extract_job_keywords(tokenize(DEVOPS_POSTING), surface_forms(DEVOPS_POSTING))
+    displays = {display for display, _ in keywords.values()}
+    assert {"DevOps", "Sales"} <= displays
+    assert not {"devop", "sale"} & displays
+
+
+def test_feedback_lists_missing_keywords_as_written():
+    local = score_resume_locally(resume(("skills", "AWS")), DEVOPS_POSTING)
+    improvements = local_ats_feedback(local)["improvements"][0]
+    assert "DevOps" in improvements and "devop" not in improvements
+
+
+def test_score_rewards_keyword_coverage_and_complete_sections():
+    sparse = score_resume_locally(resume(("skills", "Excel")), DEVOPS_POSTING)
+    strong = score_resume_locally(resume(
+        ("personal", "Ada Lovelace"), ("summary", "DevOps engineer"),
+        ("experience", "Ran DevOps on AWS with Terraform; sales engineering support"),
+        ("education", "BSc"), ("skills", "AWS, Terraform, DevOps"),
+    ), DEVOPS_POSTING)
+
+    assert strong.score > sparse.score
+    assert strong.keyword_coverage > sparse.keyword_coverage == 0.0
+    assert strong.missing_sections == [] and strong.section_completeness == 1.0
+    assert sparse.missing_sections == ["personal", "summary", "experience", "education"]
+    assert {"DevOps", "AWS", "Terraform"} <= set(strong.matched_keywords)
+    assert not set(strong.matched_keywords) & set(strong.missing_keywords)
+
+
+def test_score_is_deterministic():
+    doc = resume(("summary", "Terraform and AWS"), ("skills", "Python"))
+    assert score_resume_locally(doc, DEVOPS_POSTING) == score_resume_locally(doc, DEVOPS_POSTING)
+
+
+def test_empty_job_description_scores_sections_only():
+    local = score_resume_locally(resume(("skills", "AWS")), "")
+    assert local.keyword_coverage == 0.0 and local.similarity == 0.0
+    assert local.matched_keywords == local.missing_keywords == []
+    assert local.score == round(100 * ATS_LOCAL_WEIGHTS[2] * local.section_completeness)
+
+
+DATA_POSTING = "Data analyst: SQL, Tableau dashboards and statistics. SQL daily."
+
+RESUMES = [
+    {"id": "ops", **resume(("summary", "DevOps engineer"), ("skills", "AWS, Terraform, DevOps"), title="Ops")},
+    {"id": "data", **resume(("summary", "Data analyst"), ("skills", "SQL, Tableau, statistics"), title="Data")},
+    {"id": "blank", **resume(title="Blank")},
+]
+
+
+def test_matching_scores_every_resume_against_every_job():
+    scores, rankings = match_resumes_to_jobs(RESUMES, [DEVOPS_POSTING, DATA_POSTING], top_k=2)
+
+    assert len(scores) == 2 and all(len(row) == 3 for row in scores)
+    assert [len(ranking) for ranking in rankings] == [2, 2]
+    assert [rankings[0][0].resume_id, rankings[1][0].resume_id] == ["ops", "data"]
+    for row, ranking in zip(scores, rankings):
+        assert [c.score for c in ranking] == sorted(row, reverse=True)[:2]
+
+
+def test_matching_coverage_agrees_with_the_single_resume_score():
+    _, rankings = match_resumes_to_jobs(RESUMES, [DEVOPS_POSTING], top_k=3)
+
+    for candidate in rankings[0]:
+        doc = next(r for r in RESUMES if r["id"] == candidate.resume_id)
+        local = score_resume_locally(doc, DEVOPS_POSTING)
+        assert candidate.keyword_coverage == local.keyword_coverage
+        assert candidate.matched_keywords == local.matched_keywords
+        assert candidate.missing_keywords == local.missing_keywords
+
+
+def test_matching_handles_empty_inputs():
+    assert match_resumes_to_jobs([], [DEVOPS_POSTING], top_k=3)[1] == [[]]
+    scores, rankings = match_resumes_to_jobs(RESUMES, [], top_k=3)
+    assert scores == [] and rankings == []
@@ -0,0 +1,45 @@
+"""Operational endpoints are limited to the configured ops accounts."""
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from server import User, app, get_current_user
+
+OPS_ENDPOINTS = ["/api/providers/rate-limits", "/api/runtime/event-loop?reset=true", "/api/ats/cache/stats"]
+
+
+@pytest.fixture
+def client_as(monkeypatch):
+    monkeypatch.setattr(server, "OPS_ADMIN_EMAILS", frozenset({"ops@example.com"}))
+
+    def make(email):
+        app.dependency_overrides[get_current_user] = lambda: User(email=email, full_name="Test User")
+        return TestClient(app)
+
+    yield make
+    app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize("path", OPS_ENDPOINTS)
+def test_regular_user_is_refused(client_as, path):
+    assert client_as("someone@example.com").get(path).status_code == 403
+
+
+@pytest.mark.parametrize("path", OPS_ENDPOINTS)
+def test_ops_user_is_allowed(client_as, path):
+    assert client_as("Ops@Example.com").get(path).status_code == 200
+
+
+def test_event_loop_reset_needs_ops_access(client_as, monkeypatch):
+    resets = []
+    monkeypatch.setattr(server.loop_lag, "reset", lambda: resets.append(True))
+    client_as("someone@example.com").get("/api/runtime/event-loop?reset=true")
+    assert resets == []
+
+
+def test_query_plan_explain_needs_ops_access(client_as, monkeypatch):
+    async def explain():
+        raise AssertionError("explain ran for a regular user")
+
+    monkeypatch.setattr(server.index_manager, "explain_query_shapes", explain)
+    assert client_as("someone@example.com").get("/api/runtime/indexes?explain=true").status_code == 403
@@ -0,0 +1,133 @@
+"""Keyset pagination cursors and pages, including documents with legacy string timestamps.
+
+The paging test needs a real server; point MONGO_TEST_URL at a disposable
+instance to run it.
+"""
+import asyncio
+import base64
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from server import cursor_filter, decode_cursor, encode_cursor, fetch_page
+
+MONGO_TEST_URL = os.environ.get("MONGO_TEST_URL")
+
+
+def test_date_cursor_round_trips():
+    timestamp = datetime(2024, 5, 1, 12, 30, 15, 250000)
+    assert decode_cursor(encode_cursor(timestamp, "abc")) == (timestamp, "abc")
+
+
+def test_legacy_string_cursor_stays_a_string():
+    assert decode_cursor(encode_cursor("2023-01-02T03:04:05", "abc")) == ("2023-01-02T03:04:05", "abc")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    base64.urlsafe_b64encode(b'["2024-01-01T00:00:00", "a", "int"]').decode(),
+])
+def test_malformed_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_date_cursor_also_selects_legacy_string_documents():
+    timestamp = datetime(2024, 1, 1)
+    assert {"created_at": {"$type": "string"}} in cursor_filter("created_at", timestamp, "x")
+    assert {"created_at": {"$type": "string"}} not in cursor_filter("created_at", "2023-01-01", "x")
+
+
+
+class RecordingCollection:
+    """Returns canned documents and records the query fetch_page builds."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.calls = []
+
+    def find(self, query, projection):
+        self.calls.append({"query": query, "projection": projection})
+        return self
+
+    def sort(self, keys):
+        self.calls[-1]["sort"] = keys
+        return self
+
+    def limit(self, count):
+        self.calls[-1]["limit"] = count
+        return self
+
+    async def to_list(self, length):
+        return self.docs[:length]
+
+
+def test_full_page_returns_a_cursor_at_its_last_document():
+    created = [datetime(2024, 1, 10 - i) for i in range(4)]
+    collection = RecordingCollection([{"id": str(i), "created_at": c} for i, c in enumerate(created)])
+
+    docs, cursor = asyncio.run(fetch_page(collection, {"user_id": "u"}, "created_at", None, 3, {"_id": 0}))
+
+    assert [d["id"] for d in docs] == ["0", "1", "2"]
+    assert decode_cursor(cursor) == (created[2], "2")
+    assert collection.calls == [{"query": {"user_id": "u"}, "projection": {"_id": 0},
+                                 "sort": [("created_at", -1), ("id", -1)], "limit": 4}]
+
+
+def test_last_page_has_no_cursor_and_cursor_narrows_the_query():
+    collection = RecordingCollection([{"id": "a", "created_at": "2023-01-01T00:00:00"}])
+    cursor = encode_cursor("2023-02-01T00:00:00", "b")
+
+    docs, next_cursor = asyncio.run(fetch_page(collection, {"user_id": "u"}, "created_at", cursor, 3, {}))
+
+    assert len(docs) == 1 and next_cursor is None
+    assert collection.calls[0]["query"] == {"user_id": "u",
+                                            "$or": cursor_filter("created_at", "2023-02-01T00:00:00", "b")}
+
+def walk(collection, base_filter, limit):
+    async def main():
+        pages, cursor = [], None
+        while True:
+            docs, cursor = await fetch_page(collection, base_filter, "created_at", cursor, limit, {"_id": 0})
+            pages.append([d["id"] for d in docs])
+            if not cursor:
+                return pages
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def mixed_collection():
+    if not MONGO_TEST_URL:
+        pytest.skip("MONGO_TEST_URL is not set")
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from pymongo import MongoClient
+    name = f"pagination_{uuid.uuid4().hex[:8]}"
+    sync = MongoClient(MONGO_TEST_URL, serverSelectionTimeoutMS=2000)["resume_builder_test"][name]
+    yield sync, AsyncIOMotorClient(MONGO_TEST_URL)["resume_builder_test"][name]
+    sync.drop()
+
+
+def test_pages_cover_mixed_string_and_date_documents(mixed_collection):
+    sync, collection = mixed_collection
+    start = datetime(2023, 1, 1)
+    docs = []
+    for i in range(60):
+        created = start + timedelta(hours=i)
+        # Every third document is not migrated yet; two share a timestamp to exercise the id tiebreak
+        docs.append({"user_id": "u", "id": f"{i:03d}",
+                     "created_at": created.isoformat() if i % 3 == 0 else created})
+    docs.append({"user_id": "u", "id": "060", "created_at": docs[59]["created_at"]})
+    sync.insert_many([dict(d) for d in docs])
+
+    pages = walk(collection, {"user_id": "u"}, limit=7)
+
+    seen = [doc_id for page in pages for doc_id in page]
+    assert sorted(seen) == sorted(d["id"] for d in docs)
+    assert len(seen) == len(set(seen))
+    dated = [d for d in docs if isinstance(d["created_at"], datetime)]
+    assert seen[:len(dated)] == [d["id"] for d in sorted(dated, key=lambda d: (d["created_at"], d["id"]), reverse=True)]
@@ -0,0 +1,32 @@
+"""Password hashing on the bcrypt pool and rehash-on-login detection."""
+import asyncio
+
+import pytest
+
+import server
+from server import hash_password, password_needs_rehash, verify_password
+
+
+@pytest.fixture(autouse=True)
+def cheap_rounds(monkeypatch):
+    monkeypatch.setattr(server, "BCRYPT_ROUNDS", 4)
+
+
+def test_hash_round_trips_and_uses_the_configured_cost():
+    async def main():
+        hashed = await hash_password("hunter2")
+        return hashed, await verify_password("hunter2", hashed), await verify_password("hunter3", hashed)
+
+    hashed, right, wrong = asyncio.run(main())
+    assert right and not wrong
+    assert hashed.split("$")[2] == "04"
+    assert not password_needs_rehash(hashed)
+
+
+def test_hash_with_another_cost_needs_rehash():
+    assert password_needs_rehash("$2b$12$" + "a" * 53)
+
+
+@pytest.mark.parametrize("hashed", ["", "plaintext", "$2b$xx$abc"])
+def test_unrecognized_hash_is_left_alone(hashed):
+    assert not password_needs_rehash(hashed)
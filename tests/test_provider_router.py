@@ -0,0 +1,194 @@
+"""ProviderRouter: circuit breaker transitions and health ranking."""
+import asyncio
+
+import pytest
+
+from server import DeadlineExceeded, ProviderRouter, ProviderUnavailable, provider_call_seconds
+
+
+def make_router(threshold=3, probes=1):
+    return ProviderRouter(("groq", "gemini"), failure_threshold=threshold, open_seconds=30,
+                          half_open_probes=probes, alpha=0.5)
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+async def call(router, name, error=None):
+    async with router.guard(name):
+        async with router.observe(name):
+            if error is not None:
+                raise error
+
+
+async def fail(router, name, times=1):
+    for _ in range(times):
+        with pytest.raises(RuntimeError):
+            await call(router, name, RuntimeError("boom"))
+
+
+def expire_open_period(router, name):
+    router.health[name]["opened_at"] -= router.open_seconds
+
+
+def state(router, name):
+    return router.snapshot()["providers"][name]["state"]
+
+
+def test_circuit_opens_after_consecutive_failures():
+    async def main():
+        router = make_router(threshold=3)
+        await fail(router, "groq", 2)
+        assert state(router, "groq") == "closed"
+        await fail(router, "groq")
+        assert state(router, "groq") == "open"
+        with pytest.raises(ProviderUnavailable):
+            await call(router, "groq")
+        return router
+
+    router = asyncio.run(main())
+    providers = router.snapshot()["providers"]
+    assert providers["groq"]["rejected"] == 1 and providers["groq"]["opened"] == 1
+    assert providers["gemini"]["state"] == "closed"
+
+
+def test_success_resets_the_failure_run():
+    async def main():
+        router = make_router(threshold=3)
+        await fail(router, "groq", 2)
+        await call(router, "groq")
+        await fail(router, "groq", 2)
+        return state(router, "groq")
+
+    assert asyncio.run(main()) == "closed"
+
+
+def test_open_circuit_goes_half_open_after_the_open_period():
+    async def main():
+        router = make_router(threshold=1)
+        await fail(router, "groq")
+        assert not router.available("groq")
+        expire_open_period(router, "groq")
+        assert router.available("groq")
+        return state(router, "groq")
+
+    assert asyncio.run(main()) == "half_open"
+
+
+def test_half_open_admits_only_the_probe_budget():
+    async def main():
+        router = make_router(threshold=1, probes=1)
+        await fail(router, "groq")
+        expire_open_period(router, "groq")
+        release = asyncio.Event()
+
+        async def probe():
+            async with router.guard("groq"), router.observe("groq"):
+                await release.wait()
+
+        task = asyncio.create_task(probe())
+        await asyncio.sleep(0)
+        with pytest.raises(ProviderUnavailable):
+            await call(router, "groq")
+        release.set()
+        await task
+        return state(router, "groq")
+
+    assert asyncio.run(main()) == "closed"
+
+
+def test_failed_probe_reopens_the_circuit():
+    async def main():
+        router = make_router(threshold=3)
+        await fail(router, "groq", 3)
+        expire_open_period(router, "groq")
+        await fail(router, "groq")  # a single failure is enough while half-open
+        return router
+
+    router = asyncio.run(main())
+    assert state(router, "groq") == "open"
+    assert router.snapshot()["providers"]["groq"]["opened"] == 2
+    assert router.snapshot()["providers"]["groq"]["probes_in_flight"] == 0
+
+
+def test_successful_probe_closes_the_circuit():
+    async def main():
+        router = make_router(threshold=1)
+        await fail(router, "groq")
+        expire_open_period(router, "groq")
+        await call(router, "groq")
+        return router
+
+    router = asyncio.run(main())
+    providers = router.snapshot()["providers"]
+    assert providers["groq"]["state"] == "closed"
+    assert providers["groq"]["consecutive_failures"] == 0
+
+
+@pytest.mark.parametrize("error", [asyncio.CancelledError(), DeadlineExceeded("budget spent")])
+def test_cancellation_and_deadlines_do_not_count_as_failures(error):
+    async def main():
+        router = make_router(threshold=1)
+        with pytest.raises(type(error)):
+            await call(router, "groq", error)
+        return router
+
+    router = asyncio.run(main())
+    providers = router.snapshot()["providers"]
+    assert providers["groq"]["state"] == "closed"
+    assert providers["groq"]["failures"] == 0
+
+
+def test_rank_puts_open_providers_last():
+    async def main():
+        router = make_router(threshold=1)
+        assert router.rank() == ["groq", "gemini"]
+        await fail(router, "groq")
+        return router.rank()
+
+    assert asyncio.run(main()) == ["gemini", "groq"]
+
+
+def test_rate_limit_errors_do_not_count_as_failures():
+    async def main():
+        router = make_router(threshold=1)
+        for _ in range(3):
+            with pytest.raises(RateLimited):
+                await call(router, "groq", RateLimited())
+        return router.snapshot()["providers"]["groq"]
+
+    groq = asyncio.run(main())
+    assert groq["state"] == "closed"
+    assert groq["failures"] == 0
+
+
+def test_only_the_request_itself_is_timed():
+    async def main():
+        router = make_router()
+        timings = []
+        provider_call_seconds.set(timings)
+        async with router.guard("groq"):
+            await asyncio.sleep(0.2)  # rate-limit or slot wait
+            async with router.observe("groq"):
+                await asyncio.sleep(0.01)
+        return router.health["groq"]["latency_ewma"], timings
+
+    latency, timings = asyncio.run(main())
+    assert latency < 0.1
+    assert timings == [latency]
+
+
+def test_half_open_probe_without_a_request_leaves_the_circuit_half_open():
+    async def main():
+        router = make_router(threshold=1)
+        await fail(router, "groq")
+        expire_open_period(router, "groq")
+        with pytest.raises(DeadlineExceeded):
+            async with router.guard("groq"):
+                raise DeadlineExceeded("spent waiting on the rate limiter")
+        return router
+
+    router = asyncio.run(main())
+    groq = router.snapshot()["providers"]["groq"]
+    assert groq["state"] == "half_open" and groq["probes_in_flight"] == 0
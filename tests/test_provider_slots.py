@@ -0,0 +1,41 @@
+"""Provider concurrency slots respect the request deadline."""
+import asyncio
+import time
+
+import pytest
+
+import server
+from server import DeadlineExceeded, ProviderClients, deadline_after, with_deadline
+
+
+def test_slot_wait_is_bounded_by_the_deadline(monkeypatch):
+    monkeypatch.setattr(server, "PROVIDER_DEADLINE_RESERVE_SECONDS", 0.0)
+
+    async def main():
+        clients = ProviderClients()
+        clients._slots["groq"] = asyncio.Semaphore(1)
+        release = asyncio.Event()
+
+        async def hold_slot():
+            async with clients.track("groq"):  # no deadline, like a background job
+                await release.wait()
+
+        holder = asyncio.create_task(hold_slot())
+        await asyncio.sleep(0)
+
+        async def interactive():
+            async with clients.track("groq"):
+                pass
+
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await with_deadline(deadline_after(0.1), interactive())
+        waited = time.monotonic() - started
+        release.set()
+        await holder
+        return clients, waited
+
+    clients, waited = asyncio.run(main())
+    assert waited < 0.5
+    assert clients.waiting["groq"] == 0 and clients.in_flight["groq"] == 0
+    assert clients._slots["groq"]._value == 1  # the timed-out waiter did not keep a slot
@@ -0,0 +1,112 @@
+"""Quota ledger: ATS check and resume slot reservations.
+
+The ledger updates are single Mongo operations, so these tests need a real
+server; point MONGO_TEST_URL at a disposable instance to run them.
+"""
+import asyncio
+import os
+import types
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import (FREE_TIER_RESUME_LIMIT, refund_ats_check, release_resume_slots, reserve_ats_check,
+                    reserve_resume_slots)
+
+MONGO_TEST_URL = os.environ.get("MONGO_TEST_URL")
+
+
+def test_releasing_no_slots_does_not_touch_the_user(monkeypatch):
+    async def update_one(*args, **kwargs):
+        raise AssertionError("no update expected")
+
+    monkeypatch.setattr(server, "db", types.SimpleNamespace(users=types.SimpleNamespace(update_one=update_one)))
+    asyncio.run(release_resume_slots("u", 0))
+
+
+@pytest.fixture
+def ledger(monkeypatch):
+    if not MONGO_TEST_URL:
+        pytest.skip("MONGO_TEST_URL is not set")
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from pymongo import MongoClient
+    name = f"quota_{uuid.uuid4().hex[:8]}"
+    sync = MongoClient(MONGO_TEST_URL, serverSelectionTimeoutMS=2000)[name]
+
+    def run(main):
+        # A fresh client per event loop, as asyncio.run closes the loop each time
+        async def bound():
+            monkeypatch.setattr(server, "db", AsyncIOMotorClient(MONGO_TEST_URL)[name])
+            return await main()
+        return asyncio.run(bound())
+
+    yield sync, run
+    sync.client.drop_database(name)
+
+
+def used(sync, field):
+    return sync.users.find_one({"id": "u"})[field]
+
+
+def test_ats_checks_stop_at_the_limit_and_refunds_give_one_back(ledger):
+    sync, run = ledger
+    sync.users.insert_one({"id": "u", "ats_checks_used": 1, "ats_checks_limit": 2})
+
+    run(lambda: reserve_ats_check("u"))
+    with pytest.raises(HTTPException) as error:
+        run(lambda: reserve_ats_check("u"))
+    assert error.value.status_code == 403
+    assert used(sync, "ats_checks_used") == 2
+
+    run(lambda: refund_ats_check("u"))
+    assert used(sync, "ats_checks_used") == 1
+
+
+def test_ats_check_defaults_apply_to_older_accounts_and_premium_is_unlimited(ledger):
+    sync, run = ledger
+    sync.users.insert_many([{"id": "u"}, {"id": "p", "is_premium": True, "ats_checks_used": 50}])
+
+    run(lambda: reserve_ats_check("u"))
+    run(lambda: reserve_ats_check("p"))
+    assert used(sync, "ats_checks_used") == 1
+    assert sync.users.find_one({"id": "p"})["ats_checks_used"] == 51
+
+
+def test_refund_never_goes_below_zero(ledger):
+    sync, run = ledger
+    sync.users.insert_one({"id": "u", "ats_checks_used": 0})
+
+    run(lambda: refund_ats_check("u"))
+    assert used(sync, "ats_checks_used") == 0
+
+
+def test_concurrent_ats_checks_cannot_overdraw(ledger):
+    sync, run = ledger
+    sync.users.insert_one({"id": "u", "ats_checks_used": 0, "ats_checks_limit": 3})
+
+    async def main():
+        return await asyncio.gather(*[reserve_ats_check("u") for _ in range(10)], return_exceptions=True)
+
+    outcomes = run(main)
+    assert sum(outcome is None for outcome in outcomes) == 3
+    assert used(sync, "ats_checks_used") == 3
+
+
+def test_resume_slots_backfill_reserve_and_release(ledger):
+    sync, run = ledger
+    sync.users.insert_one({"id": "u"})
+    sync.resumes.insert_many([{"user_id": "u", "id": str(i)} for i in range(2)])
+
+    run(lambda: reserve_resume_slots("u", FREE_TIER_RESUME_LIMIT - 2))
+    assert used(sync, "resume_count") == FREE_TIER_RESUME_LIMIT
+    with pytest.raises(HTTPException) as error:
+        run(lambda: reserve_resume_slots("u", 1))
+    assert error.value.status_code == 403
+
+    run(lambda: release_resume_slots("u", 2))
+    assert used(sync, "resume_count") == FREE_TIER_RESUME_LIMIT - 2
+    # Releasing more than is held leaves the count alone rather than going negative
+    run(lambda: release_resume_slots("u", FREE_TIER_RESUME_LIMIT))
+    assert used(sync, "resume_count") == FREE_TIER_RESUME_LIMIT - 2
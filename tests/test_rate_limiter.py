@@ -0,0 +1,141 @@
+"""RateLimiter: queue ordering, deadlines and budget accounting."""
+import asyncio
+import time
+
+import pytest
+
+import server
+from server import PRIORITY_BATCH, PRIORITY_INTERACTIVE, DeadlineExceeded, RateLimiter, deadline_after, with_deadline
+
+
+@pytest.fixture(autouse=True)
+def no_deadline_reserve(monkeypatch):
+    monkeypatch.setattr(server, "PROVIDER_DEADLINE_RESERVE_SECONDS", 0.0)
+
+
+def limiter(rpm=0, tpm=0, window=0.2):
+    limiter = RateLimiter({"groq": (rpm, tpm)})
+    limiter.WINDOW_SECONDS = window
+    return limiter
+
+
+async def queue_up(limiter, calls, spacing=0.01):
+    """Start ``(name, priority)`` acquisitions in order; returns names in grant order."""
+    granted = []
+
+    async def acquire(name, priority):
+        await limiter.acquire("groq", 1, priority)
+        granted.append(name)
+
+    tasks = []
+    for name, priority in calls:
+        tasks.append(asyncio.create_task(acquire(name, priority)))
+        await asyncio.sleep(spacing)
+    await asyncio.gather(*tasks)
+    return granted
+
+
+def test_interactive_calls_go_ahead_of_queued_batch_calls():
+    async def main():
+        rl = limiter(rpm=1)
+        await rl.acquire("groq", 1, PRIORITY_BATCH)
+        return await queue_up(rl, [("batch-1", PRIORITY_BATCH), ("batch-2", PRIORITY_BATCH),
+                                   ("interactive", PRIORITY_INTERACTIVE)])
+
+    assert asyncio.run(main()) == ["interactive", "batch-1", "batch-2"]
+
+
+def test_same_priority_is_first_come_first_served():
+    async def main():
+        rl = limiter(rpm=1)
+        await rl.acquire("groq", 1, PRIORITY_INTERACTIVE)
+        return await queue_up(rl, [(f"call-{i}", PRIORITY_INTERACTIVE) for i in range(3)])
+
+    assert asyncio.run(main()) == ["call-0", "call-1", "call-2"]
+
+
+def test_rpm_budget_spaces_calls_by_the_window():
+    async def main():
+        rl = limiter(rpm=2, window=0.2)
+        started = time.monotonic()
+        for _ in range(3):
+            await rl.acquire("groq", 1, PRIORITY_INTERACTIVE)
+        return time.monotonic() - started
+
+    assert 0.18 <= asyncio.run(main()) < 0.5
+
+
+def test_wait_past_the_deadline_fails_fast():
+    async def main():
+        rl = limiter(rpm=1, window=60)
+        await rl.acquire("groq", 1, PRIORITY_INTERACTIVE)
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await with_deadline(deadline_after(5), rl.acquire("groq", 1, PRIORITY_INTERACTIVE))
+        return rl, time.monotonic() - started
+
+    rl, waited = asyncio.run(main())
+    assert waited < 0.5  # the window frees up in 60s, so there is no point waiting 5
+    assert rl.snapshot()["groq"]["waiting"] == 0
+
+
+def test_call_behind_the_queue_head_gives_up_at_its_deadline():
+    async def main():
+        rl = limiter(rpm=1, window=0.5)
+        await rl.acquire("groq", 1, PRIORITY_INTERACTIVE)
+        head = asyncio.create_task(rl.acquire("groq", 1, PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0.01)
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await with_deadline(deadline_after(0.1), rl.acquire("groq", 1, PRIORITY_BATCH))
+        waited = time.monotonic() - started
+        await head
+        return rl, waited
+
+    rl, waited = asyncio.run(main())
+    assert 0.05 <= waited < 0.3
+    assert rl.snapshot()["groq"]["waiting"] == 0
+
+
+def test_timed_out_head_lets_the_next_call_through():
+    async def main():
+        rl = limiter(rpm=1, window=0.3)
+        await rl.acquire("groq", 1, PRIORITY_BATCH)
+        head = asyncio.create_task(with_deadline(deadline_after(0.05), rl.acquire("groq", 1, PRIORITY_INTERACTIVE)))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(rl.acquire("groq", 1, PRIORITY_BATCH))
+        with pytest.raises(DeadlineExceeded):
+            await head
+        await asyncio.wait_for(follower, timeout=1)
+
+    asyncio.run(main())
+
+
+def test_settling_below_the_estimate_frees_token_budget():
+    async def main():
+        rl = limiter(tpm=100, window=60)
+        reservation = await rl.acquire("groq", 100, PRIORITY_INTERACTIVE)
+        waiter = asyncio.create_task(rl.acquire("groq", 50, PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        rl.settle("groq", reservation, 20)
+        await asyncio.wait_for(waiter, timeout=1)
+        return rl.snapshot()["groq"]["tokens_last_minute"]
+
+    assert asyncio.run(main()) == 70
+
+
+def test_back_off_holds_back_every_call(monkeypatch):
+    monkeypatch.setattr(server, "RATE_LIMIT_BACKOFF_SECONDS", 0.0)
+
+    async def main():
+        rl = limiter()
+        delay = rl.back_off("groq", 0.2, attempt=0)
+        started = time.monotonic()
+        await rl.acquire("groq", 1, PRIORITY_INTERACTIVE)
+        return delay, time.monotonic() - started, rl.snapshot()["groq"]["rate_limited"]
+
+    delay, waited, rate_limited = asyncio.run(main())
+    assert delay == pytest.approx(0.2)
+    assert waited >= 0.18
+    assert rate_limited == 1
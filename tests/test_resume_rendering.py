@@ -0,0 +1,13 @@
+"""Prompt rendering of resume sections."""
+from server import render_section
+
+
+def test_single_entry_section_renders_as_entry():
+    entry = {"position": "Engineer", "company": "Acme", "duration": "2020-2023", "description": "Built things."}
+    assert render_section("experience", entry, None) == render_section("experience", [entry], None)
+    assert render_section("experience", entry, None) == ["EXPERIENCE:", "- Engineer, Acme (2020-2023): Built things."]
+
+
+def test_single_education_entry_keeps_field_order():
+    entry = {"details": "Honours", "year": "2019", "institution": "MIT", "degree": "BSc"}
+    assert render_section("education", entry, None) == ["EDUCATION:", "- BSc, MIT (2019): Honours"]
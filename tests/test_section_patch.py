@@ -0,0 +1,105 @@
+"""build_section_patch: request validation, and the compiled pipeline run on MongoDB.
+
+The pipeline tests need a real server (mongomock has no $reduce/$switch);
+point MONGO_TEST_URL at a disposable instance to run them.
+"""
+import os
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from server import SectionOperation, build_section_patch
+
+MONGO_TEST_URL = os.environ.get("MONGO_TEST_URL")
+
+
+def section(section_id):
+    return {"type": "summary", "content": f"content {section_id}", "id": section_id}
+
+
+@pytest.fixture(scope="module")
+def collection():
+    if not MONGO_TEST_URL:
+        pytest.skip("MONGO_TEST_URL is not set")
+    from pymongo import MongoClient
+    client = MongoClient(MONGO_TEST_URL, serverSelectionTimeoutMS=2000)
+    coll = client["resume_builder_test"][f"section_patch_{uuid.uuid4().hex[:8]}"]
+    yield coll
+    coll.drop()
+    client.close()
+
+
+def apply(collection, ids, operations):
+    """Run the patch like patch_resume does; returns the new section ids, or None if nothing matched."""
+    doc_id = uuid.uuid4().hex
+    collection.insert_one({"id": doc_id, "sections": [section(i) for i in ids]})
+    guards, stages = build_section_patch([SectionOperation(**op) for op in operations])
+    query = {"id": doc_id}
+    if guards:
+        query["$expr"] = {"$and": guards}
+    result = collection.update_one(query, stages)
+    doc = collection.find_one({"id": doc_id})
+    if result.matched_count == 0:
+        assert [s["id"] for s in doc["sections"]] == ids  # untouched
+        return None
+    return doc["sections"]
+
+
+def ids_of(sections):
+    return [s["id"] for s in sections]
+
+
+def test_rejects_incomplete_operations():
+    with pytest.raises(HTTPException):
+        build_section_patch([SectionOperation(op="remove")])
+    with pytest.raises(HTTPException):
+        build_section_patch([SectionOperation(op="set", index=0)])
+    with pytest.raises(HTTPException):
+        build_section_patch([SectionOperation(op="reorder", index=0)])
+
+
+def test_no_operations_compile_to_nothing():
+    assert build_section_patch([]) == ([], [])
+
+
+def test_user_content_is_literal():
+    content = {"type": "summary", "content": "$sections"}
+    guards, stages = build_section_patch([SectionOperation(op="insert", section=content)])
+    steps = stages[0]["$set"]["sections"]["$let"]["vars"]["patched"]["$reduce"]["input"]
+    assert steps["$literal"][0]["section"]["content"] == "$sections"
+
+
+def test_single_operations(collection):
+    assert ids_of(apply(collection, ["a", "b", "c"], [{"op": "remove", "index": 0}])) == ["b", "c"]
+    assert ids_of(apply(collection, ["a", "b", "c"], [{"op": "reorder", "index": 2, "to_index": 0}])) == ["c", "a", "b"]
+    assert ids_of(apply(collection, ["a", "b", "c"],
+                        [{"op": "reorder", "section_id": "a", "to_index": 9}])) == ["b", "c", "a"]
+
+    sections = apply(collection, ["a", "b"], [{"op": "set", "section_id": "b",
+                                               "section": {"type": "skills", "content": "$new"}}])
+    assert sections[1] == {"id": "b", "type": "skills", "content": "$new"}
+
+    sections = apply(collection, ["a", "b"], [{"op": "insert", "index": 1,
+                                               "section": {"type": "skills", "content": "x"}}])
+    assert ids_of(sections)[0] == "a" and ids_of(sections)[2] == "b" and sections[1]["id"]
+
+
+def test_operations_see_earlier_ones(collection):
+    assert ids_of(apply(collection, ["a", "b", "c"],
+                        [{"op": "remove", "index": 0}, {"op": "remove", "index": 0}])) == ["c"]
+    sections = apply(collection, ["a", "b"], [{"op": "insert", "section": {"type": "skills", "content": "x"}},
+                                              {"op": "reorder", "index": 2, "to_index": 0}])
+    assert ids_of(sections)[1:] == ["a", "b"]
+
+
+@pytest.mark.parametrize("operations", [
+    [{"op": "remove", "index": 0}, {"op": "reorder", "index": 2, "to_index": 0}],
+    [{"op": "remove", "section_id": "c"}, {"op": "reorder", "section_id": "c", "to_index": 0}],
+    [{"op": "remove", "index": 2}, {"op": "set", "index": 2, "section": {"type": "skills", "content": "x"}}],
+    [{"op": "remove", "section_id": "a"}, {"op": "remove", "section_id": "a"}],
+    [{"op": "remove", "index": 3}],
+])
+def test_stale_targets_write_nothing(collection, operations):
+    assert apply(collection, ["a", "b", "c"], operations) is None
+
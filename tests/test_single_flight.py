@@ -0,0 +1,85 @@
+"""SingleFlight: coalescing, and each caller keeping its own deadline."""
+import asyncio
+
+import pytest
+
+import server
+from server import DeadlineExceeded, SingleFlight, deadline_after, with_deadline
+
+
+def test_concurrent_callers_share_one_call():
+    async def main():
+        flights = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        results = await asyncio.gather(*[flights.run("kind", "key", work) for _ in range(3)])
+        return flights, calls, results
+
+    flights, calls, results = asyncio.run(main())
+    assert results == ["result"] * 3
+    assert len(calls) == 1
+    assert flights.snapshot()["kind"]["coalesced"] == 2
+
+
+def test_follower_does_not_inherit_leader_deadline(monkeypatch):
+    monkeypatch.setattr(server, "PROVIDER_DEADLINE_RESERVE_SECONDS", 0.0)
+
+    async def main():
+        flights = SingleFlight()
+
+        async def work():
+            assert server.remaining_time() is None
+            await asyncio.sleep(0.3)
+            return "done"
+
+        leader = asyncio.create_task(with_deadline(deadline_after(0.1), flights.run("kind", "key", work)))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.run("kind", "key", work))
+        leader_result, follower_result = await asyncio.gather(leader, follower, return_exceptions=True)
+        return flights, leader_result, follower_result
+
+    flights, leader_result, follower_result = asyncio.run(main())
+    assert isinstance(leader_result, DeadlineExceeded)
+    assert follower_result == "done"
+    assert flights.snapshot()["kind"]["deadline_exceeded"] == 1
+
+
+def test_last_caller_leaving_cancels_the_call(monkeypatch):
+    monkeypatch.setattr(server, "PROVIDER_DEADLINE_RESERVE_SECONDS", 0.0)
+
+    async def main():
+        flights = SingleFlight()
+        finished = []
+
+        async def work():
+            await asyncio.sleep(1)
+            finished.append(1)
+
+        with pytest.raises(DeadlineExceeded):
+            await with_deadline(deadline_after(0.05), flights.run("kind", "key", work))
+        await asyncio.sleep(0.01)
+        return flights, finished
+
+    flights, finished = asyncio.run(main())
+    assert not finished
+    assert flights.snapshot()["kind"]["in_flight"] == 0
+
+
+def test_errors_reach_every_caller():
+    async def main():
+        flights = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        return await asyncio.gather(*[flights.run("kind", "key", work) for _ in range(2)],
+                                    return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
@@ -0,0 +1,80 @@
+"""SettlingStreamingResponse: settle runs however the response ends."""
+import asyncio
+
+from server import SettlingStreamingResponse
+
+SCOPE = {"type": "http", "method": "GET", "path": "/", "headers": []}
+
+
+def run_response(receive_messages, body):
+    settled = []
+    sent = []
+
+    async def settle():
+        settled.append(True)
+
+    async def main():
+        messages = list(receive_messages)
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.sleep(3600)
+
+        async def send(message):
+            sent.append(message)
+
+        response = SettlingStreamingResponse(body(), settle, media_type="text/event-stream")
+        await response(SCOPE, receive, send)
+
+    asyncio.run(main())
+    return settled, sent
+
+
+def test_settles_after_a_complete_stream():
+    async def body():
+        yield "event: done\n\n"
+
+    settled, sent = run_response([], body)
+    assert settled == [True]
+    assert sent[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+
+
+def test_settles_when_client_leaves_before_the_body_starts():
+    async def body():
+        await asyncio.sleep(3600)
+        yield "never"
+
+    settled, _ = run_response([{"type": "http.disconnect"}], body)
+    assert settled == [True]
+
+
+def test_closes_the_body_before_settling():
+    order = []
+
+    async def body():
+        try:
+            yield "first\n\n"
+            await asyncio.sleep(3600)
+            yield "never"
+        finally:
+            order.append("closed")
+
+    async def main():
+        sent_first = asyncio.Event()
+
+        async def receive():
+            await sent_first.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message.get("body"):
+                sent_first.set()
+
+        async def settle():
+            order.append("settled")
+
+        await SettlingStreamingResponse(body(), settle)(SCOPE, receive, send)
+
+    asyncio.run(main())
+    assert order == ["closed", "settled"]
@@ -0,0 +1,75 @@
+"""Parsing and repair of provider JSON answers."""
+import json
+
+import pytest
+
+from server import (
+    ATSProviderResult,
+    StructuredOutputError,
+    find_json_object,
+    parse_ai_response,
+    validate_ats_result,
+)
+
+ATS_ANSWER = {"score": 72, "feedback": "Solid.", "strengths": ["Python"], "improvements": ["Metrics"]}
+
+
+def test_clean_json_parses_as_is():
+    assert parse_ai_response(json.dumps(ATS_ANSWER)) == ATS_ANSWER
+
+
+def test_object_in_code_fence_is_extracted():
+    text = f"Here is the analysis:\n```json\n{json.dumps(ATS_ANSWER)}\n```\nHope it helps!"
+    assert find_json_object(text) == (ATS_ANSWER, "extracted")
+
+
+def test_braces_in_prose_are_skipped():
+    text = "Scores use {a scale} from 0-100. " + json.dumps(ATS_ANSWER) + " Thanks."
+    assert find_json_object(text) == (ATS_ANSWER, "extracted")
+
+
+def test_nested_object_is_not_mistaken_for_the_answer():
+    text = '{"score": 80, "details": {"a": 1}, "feedback": "cut off mid-str'
+    result, outcome = find_json_object(text)
+    assert outcome == "repaired"
+    assert result == {"score": 80, "details": {"a": 1}}
+
+
+def test_truncated_object_is_cut_back_to_last_complete_member():
+    text = json.dumps(ATS_ANSWER)[:-20]
+    result, outcome = find_json_object(text)
+    assert outcome == "repaired"
+    assert result == {"score": 72, "feedback": "Solid.", "strengths": ["Python"]}
+
+
+def test_half_written_list_is_dropped_whole():
+    text = '{"summary": "S", "experience": [{"position": "A"}, {"position": "B", "company": "C'
+    result, outcome = find_json_object(text, repair_depth=1)
+    assert outcome == "repaired"
+    assert result == {"summary": "S"}
+
+
+def test_deeper_repair_keeps_complete_list_items():
+    text = '{"summary": "S", "experience": [{"position": "A"}, {"position": "B", "company": "C'
+    result, _ = find_json_object(text, repair_depth=2)
+    assert result == {"summary": "S", "experience": [{"position": "A"}]}
+
+
+def test_no_object_raises():
+    with pytest.raises(StructuredOutputError):
+        parse_ai_response("I cannot help with that.")
+
+
+def test_wrong_shape_fails_validation():
+    with pytest.raises(StructuredOutputError):
+        parse_ai_response('{"feedback": "no score"}', validate=validate_ats_result)
+
+
+@pytest.mark.parametrize("raw, expected", [(72.5, 72), (72.6, 73), ("72", 72), (" 81.4 ", 81), ("64%", 64), (90, 90)])
+def test_score_is_coerced_to_int(raw, expected):
+    assert ATSProviderResult.model_validate({**ATS_ANSWER, "score": raw}).score == expected
+
+
+@pytest.mark.parametrize("raw", ["high", None, float("nan")])
+def test_non_numeric_score_is_rejected(raw):
+    assert validate_ats_result({**ATS_ANSWER, "score": raw}) is None